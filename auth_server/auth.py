@@ -1,19 +1,23 @@
+import time
+import uuid
 import logging
 
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import NoResultFound
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from datetime import datetime, timedelta, UTC
+from datetime import timedelta
+from typing import Any
 import jwt
-from passlib.hash import pbkdf2_sha256
 
 from auth_server.db import api as dbapi
-from auth_server import schema
-from auth_server.config import Settings
+from auth_server.db import async_api
+from auth_server import schema, passwords, scopes
+from auth_server.config import get_settings
+from auth_server.keys import get_keyring
 
 
 logger = logging.getLogger(__name__)
-settings = Settings()
 
 
 def authenticate(
@@ -24,28 +28,44 @@ def authenticate(
     return db_auth(session, username, password)
 
 
+async def async_authenticate(
+    session: AsyncSession,
+    username: str,
+    password: str,
+) -> schema.User | None:
+    return await async_db_auth(session, username, password)
+
+
 def verify_password(password: str, hashed_password: str) -> bool:
     logger.debug("checking credentials...")
-    return pbkdf2_sha256.verify(password, hashed_password)
+    return passwords.verify_password(password, hashed_password)
 
 
 def create_access_token(
-    data: schema.TokenData,
-    secret_key: str,
+    claims: dict,
+    secret_key: Any,
     algorithm: str,
     expires_delta: timedelta | None = None,
+    headers: dict | None = None,
 ) -> str:
-    logger.debug(f"create access token for data={data}")
-
-    to_encode = data.model_dump()
-    if expires_delta:
-        expire = datetime.now(UTC) + expires_delta
-    else:
-        expire = datetime.now(UTC) + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    """Signs token with given claims plus `exp`, `iat` and `jti`"""
+    logger.debug("create access token for sub=%s", claims["sub"])
+
+    now = int(time.time())
+    if expires_delta is None:
+        expires_delta = timedelta(minutes=15)
+    # `jti` and `iat` make the token revocable, see `auth_server.revocation`
+    payload = {
+        **claims,
+        "exp": now + int(expires_delta.total_seconds()),
+        "iat": now,
+        "jti": uuid.uuid4().hex,
+    }
 
     try:
-        encoded_jwt = jwt.encode(to_encode, secret_key, algorithm=algorithm)
+        encoded_jwt = jwt.encode(
+            payload, secret_key, algorithm=algorithm, headers=headers
+        )
     except Exception as exc:
         logger.error(exc)
         raise
@@ -56,43 +76,123 @@ def create_access_token(
 def db_auth(session: Session, username: str, password: str) -> schema.User | None:
     """Authenticates user based on username and password
 
-    User data is read from database.
+    User data is read from database. If user's password hash does not
+    match hashing policy anymore, it is replaced. Usernames which were not
+    found are remembered for a short while, see `dbapi.get_unknown_usernames`.
     """
-    logger.info(f"Database based authentication for '{username}'")
+    logger.debug("Database based authentication for '%s'", username)
 
-    try:
-        user: schema.User | None = dbapi.get_user_by_username(session, username)
-    except NoResultFound:
-        user = None
+    user: schema.User | None = None
+    if not dbapi.get_unknown_usernames().get(username):
+        try:
+            user = dbapi.get_user_by_username(session, username)
+        except NoResultFound:
+            dbapi.get_unknown_usernames().set(username, True)
 
     if not user:
-        logger.warning(f"User {username} not found in database")
+        logger.warning("User %s not found in database", username)
+        if get_settings().login_dummy_verify:
+            passwords.verify_dummy(password)
         return None
 
-    if not verify_password(password, user.password):
-        logger.warning(f"Authentication failed for '{username}'")
+    valid, new_hash = passwords.verify_and_update(password, user.password)
+    if not valid:
+        logger.warning("Authentication failed for '%s'", username)
         return None
 
-    logger.info(f"Authentication succeded for '{username}'")
+    if new_hash is not None:
+        logger.info("Rehashing password of '%s'", username)
+        dbapi.update_password_hash(session, user.id, user.password, new_hash)
+
+    logger.debug("Authentication succeded for '%s'", username)
+    return user
+
+
+async def async_db_auth(
+    session: AsyncSession, username: str, password: str
+) -> schema.User | None:
+    """Same as `db_auth`, but user is read via async DB session
+
+    Password is verified in password workers pool; raises
+    `passwords.PasswordQueueFull` if the pool is saturated. Outdated
+    password hash is replaced.
+    """
+    logger.debug("Database based authentication for '%s'", username)
+
+    user = None
+    if not dbapi.get_unknown_usernames().get(username):
+        try:
+            user = await async_api.get_user_by_username(session, username)
+        except NoResultFound:
+            dbapi.get_unknown_usernames().set(username, True)
+
+    if not user:
+        logger.warning("User %s not found in database", username)
+        if get_settings().login_dummy_verify:
+            await passwords.verify_dummy_async(password)
+        return None
+
+    valid, new_hash = await passwords.verify_and_update_async(
+        password, user.password
+    )
+    if not valid:
+        logger.warning("Authentication failed for '%s'", username)
+        return None
+
+    if new_hash is not None:
+        logger.info("Rehashing password of '%s'", username)
+        await async_api.update_password_hash(
+            session, user.id, user.password, new_hash
+        )
+
+    logger.debug("Authentication succeded for '%s'", username)
     return user
 
 
 def create_token(user: schema.User) -> str:
+    settings = get_settings()
     access_token_expires = timedelta(
         minutes=settings.token_expire_minutes
     )
-    data = schema.TokenData(
-        sub=str(user.id),
-        preferred_username=user.username,
-        email=user.email,
-        scopes=user.scopes,
-    )
+    # same claims as `schema.TokenData`, built without validation
+    claims = {
+        "sub": str(user.id),
+        "preferred_username": user.username,
+        "email": user.email,
+    }
+    if settings.token_compact_scopes:
+        claims["scm"] = scopes.encode_claim(user.scopes)
+    else:
+        claims["scopes"] = sorted(user.scopes)
 
+    keyring = get_keyring()
     access_token = create_access_token(
-        data=data,
+        claims=claims,
         expires_delta=access_token_expires,
-        secret_key=settings.secret_key,
-        algorithm=settings.token_algorithm,
+        secret_key=keyring.signing_key,
+        algorithm=keyring.algorithm,
+        headers=keyring.headers,
     )
 
     return access_token
+
+
+def reissue_token(claims: dict) -> str:
+    """Signs claims of a valid token anew, with fresh `exp`, `iat` and `jti`
+
+    Used in stateless mode, where tokens are not checked against DB;
+    user's data is kept as it is in the token.
+    """
+    keyring = get_keyring()
+
+    return create_access_token(
+        claims={
+            key: value
+            for key, value in claims.items()
+            if key not in ("exp", "iat", "jti")
+        },
+        expires_delta=timedelta(minutes=get_settings().token_expire_minutes),
+        secret_key=keyring.signing_key,
+        algorithm=keyring.algorithm,
+        headers=keyring.headers,
+    )
@@ -2,11 +2,19 @@ import typer
 
 from auth_server.cli import users
 from auth_server.cli import tokens
+from auth_server.cli import db
+from auth_server.cli import passwords
+from auth_server.cli import perms
+from auth_server.cli import serve
 
 app = typer.Typer(help="Papermerge Auth server command line tool")
 
 app.add_typer(users.app, name="users")
 app.add_typer(tokens.app, name="tokens")
+app.add_typer(db.app, name="db")
+app.add_typer(passwords.app, name="passwords")
+app.add_typer(perms.app, name="perms")
+app.command(name="serve")(serve.serve_cmd)
 
 if __name__ == "__main__":
     app()
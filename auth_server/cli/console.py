@@ -0,0 +1,13 @@
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from rich.console import Console
+
+
+@lru_cache()
+def get_console() -> "Console":
+    # rich takes a while to import, commands print only when they are done
+    from rich.console import Console
+
+    return Console()
@@ -1,14 +1,14 @@
 import click
 
 from auth_server.db.base import Base
-from auth_server.db.engine import engine
+from auth_server.db.engine import get_engine
 # loads user model into Base.metadata so that engine can create it
 from auth_server.models import User  # noqa
 
 
 @click.command()
 def cli():
-    Base.metadata.create_all(engine)
+    Base.metadata.create_all(get_engine())
 
 
 if __name__ == '__main__':
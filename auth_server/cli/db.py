@@ -0,0 +1,42 @@
+import typer
+
+from auth_server.cli.console import get_console
+
+app = typer.Typer(help="Database schema management")
+
+
+@app.command(name="migrate")
+def migrate_cmd():
+    """Applies pending schema migrations"""
+    from auth_server.db.engine import get_engine
+    from auth_server.db import migrations
+
+    console = get_console()
+    with get_engine().connect() as conn:
+        try:
+            applied = migrations.migrate(conn)
+        except migrations.MigrationError as exc:
+            console.print(str(exc), style="red")
+            raise typer.Exit(code=1)
+
+    for migration in applied:
+        console.print(
+            f"Applied {migration.version}: {migration.description}", style="green"
+        )
+
+    if not applied:
+        console.print("Schema is up to date")
+
+
+@app.command(name="version")
+def version_cmd():
+    """Shows version of the latest applied migration"""
+    from auth_server.db.engine import get_engine
+    from auth_server.db import migrations
+
+    with get_engine().connect() as conn:
+        get_console().print(migrations.current_version(conn))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,49 @@
+import typer
+
+from typing_extensions import Annotated
+
+from auth_server.cli.console import get_console
+
+app = typer.Typer(help="Password hashing")
+
+
+@app.command(name="benchmark")
+def benchmark_cmd(
+    # plain str, PasswordScheme would import settings just to show --help
+    scheme: Annotated[
+        str, typer.Option(help="pbkdf2_sha256, argon2 or bcrypt")
+    ] = "pbkdf2_sha256",
+    target_ms: Annotated[
+        int, typer.Option(min=1, help="Desired hashing time of one password")
+    ] = 250,
+    memory_cost: Annotated[
+        int | None, typer.Option(min=1, help="KiB per hash, argon2 only")
+    ] = None,
+):
+    """Finds hashing cost which takes target time on this machine
+
+    Every login costs one hash computation i.e. about target time of
+    one CPU core.
+    """
+    from auth_server import passwords
+    from auth_server.config import PasswordScheme
+
+    try:
+        scheme = PasswordScheme(scheme)
+    except ValueError:
+        raise typer.BadParameter(f"Unknown scheme {scheme}", param_hint="--scheme")
+
+    console = get_console()
+    rounds, elapsed = passwords.calibrate(
+        scheme, target=target_ms / 1000, memory_cost=memory_cost
+    )
+
+    console.print(f"{scheme.value}: rounds={rounds} takes {elapsed * 1000:.0f} ms")
+    console.print(f"PM_PASSWORD_SCHEME={scheme.value}")
+    console.print(f"PM_PASSWORD_ROUNDS={rounds}")
+    if memory_cost is not None:
+        console.print(f"PM_PASSWORD_MEMORY_COST={memory_cost}")
+
+
+if __name__ == "__main__":
+    app()
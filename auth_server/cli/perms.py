@@ -0,0 +1,31 @@
+import typer
+
+from auth_server.cli.console import get_console
+
+app = typer.Typer(help="Permissions management")
+
+
+@app.command(name="sync")
+def sync_perms_cmd():
+    """Syncs permissions table with scopes known to auth server
+
+    Safe to run from several replicas at the same time.
+    """
+    from auth_server.db.engine import Session
+    from auth_server.db import api as dbapi
+
+    console = get_console()
+    with Session() as db_session:
+        result = dbapi.sync_perms(db_session)
+
+    for codename in result.added:
+        console.print(f"Added {codename}", style="green")
+    for codename in result.removed:
+        console.print(f"Removed {codename}", style="yellow")
+
+    if not result.changed:
+        console.print("Permissions are up to date")
+
+
+if __name__ == "__main__":
+    app()
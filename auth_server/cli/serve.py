@@ -0,0 +1,137 @@
+import importlib
+from pathlib import Path
+
+import typer
+from typing_extensions import Annotated
+
+from auth_server.cli.console import get_console
+
+
+def preload_app() -> None:
+    """Imports the app and builds what it needs from settings: settings
+    themselves, signing keys and password hashing context
+
+    Importing the app alone does not read settings, these are otherwise
+    built by each worker on first use.
+    """
+    from auth_server import passwords
+    from auth_server.config import get_settings
+    from auth_server.keys import get_keyring
+    from auth_server.workers import APP
+
+    importlib.import_module(APP.split(":")[0])
+    get_settings()
+    get_keyring()
+    passwords.get_context()
+
+
+def serve_cmd(
+    host: Annotated[str, typer.Option(envvar="PM_HOST")] = "127.0.0.1",
+    port: Annotated[int, typer.Option(envvar="PM_PORT")] = 8000,
+    workers: Annotated[
+        int | None,
+        typer.Option(min=1, envvar="PM_WORKERS", help="Defaults to available CPUs"),
+    ] = None,
+    max_requests: Annotated[
+        int,
+        typer.Option(
+            min=0,
+            envvar="PM_MAX_REQUESTS",
+            help="Worker is replaced after serving this many requests; 0 never",
+        ),
+    ] = 0,
+    max_requests_jitter: Annotated[
+        int,
+        typer.Option(
+            min=0,
+            envvar="PM_MAX_REQUESTS_JITTER",
+            help="Random extra requests per worker, so they are not replaced at once",
+        ),
+    ] = 0,
+    graceful_timeout: Annotated[
+        int,
+        typer.Option(
+            min=1,
+            envvar="PM_GRACEFUL_TIMEOUT",
+            help="Seconds stopping worker waits for requests in flight",
+        ),
+    ] = 30,
+    preload: Annotated[
+        bool,
+        typer.Option(
+            envvar="PM_PRELOAD",
+            help="Load the app, settings, keys and password hashing before "
+            "starting workers, so that bad configuration fails once instead "
+            "of in every worker",
+        ),
+    ] = False,
+    forwarded_allow_ips: Annotated[
+        str,
+        typer.Option(
+            envvar="PM_FORWARDED_ALLOW_IPS",
+            help="Comma separated addresses of proxies whose X-Forwarded-For "
+            "is taken as client address, e.g. for login throttling",
+        ),
+    ] = "127.0.0.1",
+    log_config: Annotated[
+        Path | None,
+        typer.Option(
+            exists=True,
+            dir_okay=False,
+            envvar="PM_LOG_CONFIG",
+            help="YAML logging configuration, e.g. etc/logging.yml; "
+            "defaults to uvicorn's",
+        ),
+    ] = None,
+):
+    """Runs auth server with multiple worker processes
+
+    Workers which die are started again. SIGHUP replaces workers one by one,
+    e.g. to pick up new settings or code.
+    """
+    import uvicorn
+    from uvicorn.config import LOGGING_CONFIG
+    from uvicorn.supervisors import Multiprocess
+    from auth_server import logs
+    from auth_server.workers import APP, WorkerConfig, available_cpus, best_available
+
+    if workers is None:
+        workers = available_cpus()
+    if preload:
+        # workers are spawned, not forked: they load all of it again,
+        # yet settings and imports are known to be fine by now
+        try:
+            preload_app()
+        except Exception as exc:
+            get_console().print(f"Bad configuration: {exc}", style="red")
+            raise typer.Exit(code=1)
+
+    loop = best_available("uvloop", "asyncio")
+    http = best_available("httptools", "h11")
+    get_console().print(
+        f"Starting {workers} workers on {host}:{port} (loop={loop}, http={http})"
+    )
+
+    config = WorkerConfig(
+        APP,
+        host=host,
+        port=port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        # no websocket endpoints
+        ws="none",
+        limit_max_requests=max_requests or None,
+        max_requests_jitter=max_requests_jitter,
+        timeout_graceful_shutdown=graceful_timeout,
+        proxy_headers=True,
+        forwarded_allow_ips=forwarded_allow_ips,
+        log_config=logs.load_config(log_config) if log_config else LOGGING_CONFIG,
+    )
+    server = uvicorn.Server(config)
+    if workers == 1:
+        server.run()
+        return
+
+    sock = config.bind_socket()
+    Multiprocess(config, target=server.run, sockets=[sock]).run()
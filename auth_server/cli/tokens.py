@@ -1,22 +1,21 @@
 import typer
 import logging
 
-from rich.console import Console
-from sqlalchemy.exc import NoResultFound
-
-from auth_server.db.engine import Session
-from auth_server.auth import create_token
-from auth_server.db import api as dbapi
+from typing_extensions import Annotated
 
+from auth_server.cli.console import get_console
 
 app = typer.Typer(help="User management")
 logger = logging.getLogger(__name__)
-console = Console()
 
 
 @app.command(name="create")
 def create_token_cmd(username: str):
     """Creates token for given user"""
+    from sqlalchemy.exc import NoResultFound
+    from auth_server.db.engine import Session
+    from auth_server.auth import create_token
+    from auth_server.db import api as dbapi
 
     with Session() as db_session:
         try:
@@ -25,14 +24,50 @@ def create_token_cmd(username: str):
             pass
 
     if user is None:
-        logger.warning(f"User username='{username}' not found")
+        logger.warning("User username='%s' not found", username)
         return
 
     token = create_token(user)
 
-    console.print(token)
+    get_console().print(token)
     logger.info(token)
 
 
+@app.command(name="revoke")
+def revoke_token_cmd(
+    jti: Annotated[str | None, typer.Option(help="`jti` claim of the token")] = None,
+    username: Annotated[
+        str | None, typer.Option(help="Revoke all tokens issued to this user")
+    ] = None,
+):
+    """Revokes one token or all tokens of the user
+
+    Revocations are honored by /verify in stateless mode.
+    """
+    from sqlalchemy.exc import NoResultFound
+    from auth_server.db.engine import Session
+    from auth_server.db import api as dbapi
+
+    console = get_console()
+    if not jti and not username:
+        console.print("Either --jti or --username is required", style="red")
+        raise typer.Exit(code=1)
+
+    with Session() as db_session:
+        if jti:
+            dbapi.revoke_token(db_session, jti)
+            console.print(f"Token {jti} revoked", style="green")
+
+        if username:
+            try:
+                user = dbapi.get_user_by_username(db_session, username)
+            except NoResultFound:
+                console.print(f"User {username} not found", style="red")
+                raise typer.Exit(code=1)
+
+            dbapi.revoke_user_tokens(db_session, user.id)
+            console.print(f"Tokens of user {username} revoked", style="green")
+
+
 if __name__ == "__main__":
     app()
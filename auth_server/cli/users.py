@@ -1,19 +1,19 @@
+import csv
+import sys
+import json
 import typer
 import logging
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+from pathlib import Path
+from typing import Iterator, TextIO
 
-from rich.console import Console
 from typing_extensions import Annotated
-from sqlalchemy.exc import NoResultFound
-from sqlalchemy.orm import sessionmaker
-from auth_server.db.engine import Session
-from auth_server.db import api as dbapi
-from auth_server.auth import db_auth
 
 app = typer.Typer(help="User management")
 logger = logging.getLogger(__name__)
 
-console = Console()
-
 Username = Annotated[str, typer.Argument(envvar="PM_USERNAME")]
 Email = Annotated[str, typer.Argument(envvar="PM_EMAIL")]
 Password = Annotated[str, typer.Argument(envvar="PM_PASSWORD")]
@@ -27,7 +27,12 @@ def create_user(
     superuser: bool = False,
 ):
     """Creates a user"""
+    from sqlalchemy.exc import NoResultFound
+    from auth_server.db.engine import Session
+    from auth_server.db import api as dbapi
+    from auth_server.cli.console import get_console
 
+    console = get_console()
     if not email:
         email = f"{username}@example.com"
 
@@ -35,7 +40,7 @@ def create_user(
     with Session() as db_session:
         try:
             user = dbapi.get_user_by_username(db_session, username)
-            logger.info(f"User '{username}' already exists.")
+            logger.info("User '%s' already exists.", username)
             console.print(f"User {username} already exists", style="yellow")
         except NoResultFound:
             pass
@@ -48,19 +53,199 @@ def create_user(
                 email=email,
                 is_superuser=superuser,
             )
-            logger.info(f"User '{username}' created.")
+            logger.info("User '%s' created.", username)
             console.print(f"User {username} created", style="green")
 
 
+class OutputFormat(str, Enum):
+    TEXT = "text"
+    CSV = "csv"
+    JSONL = "jsonl"
+
+
 @app.command(name="ls")
-def list_users():
-    """Lists all users"""
+def list_users(
+    format: OutputFormat = OutputFormat.TEXT,
+    page_size: Annotated[int, typer.Option(min=1)] = 1000,
+):
+    """Lists all users
 
+    Users are written as they are fetched, page by page.
+    """
+    from auth_server.db.engine import Session
+    from auth_server.db import api as dbapi
+
+    writer = None
     with Session() as db_session:
-        users = dbapi.get_users(db_session)
+        for user in dbapi.iter_users(db_session, page_size=page_size):
+            if format == OutputFormat.TEXT:
+                print(f"id={user.id} username={user.username} email={user.email}")
+                continue
+
+            record = user._asdict()
+            record["id"] = str(record["id"])
+            record["created_at"] = record["created_at"].isoformat()
+            if format == OutputFormat.JSONL:
+                sys.stdout.write(json.dumps(record) + "\n")
+            else:
+                if writer is None:
+                    writer = csv.DictWriter(sys.stdout, fieldnames=list(record))
+                    writer.writeheader()
+                writer.writerow(record)
+
+
+class InputFormat(str, Enum):
+    CSV = "csv"
+    JSONL = "jsonl"
+
+
+def read_records(
+    file: TextIO, format: InputFormat
+) -> Iterator[tuple[int, dict, str | None]]:
+    """Yields line number, raw record and parse error, one at a time
+
+    JSONL line which is not a JSON object is yielded as `{"_raw": line}`
+    along with the reason, so that it ends up in the error report.
+    """
+    if format == InputFormat.CSV:
+        reader = csv.DictReader(file)
+        for record in reader:
+            yield reader.line_num, record, None
+        return
+
+    for line_num, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as ex:
+            yield line_num, {"_raw": line.rstrip("\n")}, f"Invalid JSON: {ex}"
+            continue
+        if not isinstance(record, dict):
+            yield line_num, {"_raw": line.rstrip("\n")}, "Record is not an object"
+            continue
+        yield line_num, record, None
+
+
+def write_error(errors: TextIO, line_num: int, record: dict, error: str) -> None:
+    """Writes record which failed to import, along with the reason
+
+    Report is valid JSONL input of `import` command, so that it can be
+    fixed and imported again.
+    """
+    errors.write(json.dumps({**record, "_line": line_num, "_error": error}) + "\n")
+
+
+@app.command(name="import")
+def import_users(
+    path: Annotated[Path, typer.Argument(help="CSV or JSONL file, '-' for stdin")],
+    format: Annotated[
+        InputFormat | None, typer.Option(help="Defaults to file's suffix")
+    ] = None,
+    batch_size: Annotated[int, typer.Option(min=1)] = 1000,
+    workers: Annotated[
+        int | None, typer.Option(min=1, help="Hashing processes, defaults to CPUs")
+    ] = None,
+    errors_path: Annotated[
+        Path, typer.Option("--errors", help="Where to write records which failed")
+    ] = Path("import-errors.jsonl"),
+):
+    """Creates users from CSV or JSONL file
+
+    Records have username, email and password fields; first_name,
+    last_name, is_superuser, is_active and roles (space separated names,
+    or list in JSONL) are optional. Each batch is committed on its own.
+    Users which already exist are skipped, so interrupted import can be
+    resumed by running it again. Error report may be imported again once
+    fixed, even in place: it is then rewritten only after it is read.
+    """
+    from pydantic import ValidationError
+    from sqlalchemy.exc import SQLAlchemyError
+    from auth_server.db.engine import Session
+    from auth_server.db import api as dbapi
+    from auth_server import schema, passwords
+    from auth_server.cli.console import get_console
+
+    console = get_console()
+    stdin = str(path) == "-"
+    if format is None:
+        suffix = "jsonl" if stdin else path.suffix.lstrip(".").lower()
+        try:
+            format = InputFormat(suffix)
+        except ValueError:
+            raise typer.BadParameter(
+                f"Unsupported file type '{suffix}', use --format", param_hint="path"
+            ) from None
+
+    # report replaces the input it was read from only once it is read
+    in_place = not stdin and errors_path.resolve() == path.resolve()
+    report_path = errors_path
+    if in_place:
+        report_path = errors_path.with_name(f".{errors_path.name}.tmp")
+
+    created = skipped = failed = 0
+    file = sys.stdin if stdin else path.open(newline="")
+    with (
+        file,
+        report_path.open("w") as errors,
+        ProcessPoolExecutor(max_workers=workers) as executor,
+        Session() as db_session,
+    ):
+        records = read_records(file, format)
+        for batch in itertools.batched(records, batch_size):
+            users, line_nums = [], {}
+            for line_num, record, error in batch:
+                if error is not None:
+                    write_error(errors, line_num, record, error)
+                    failed += 1
+                    continue
+                try:
+                    user = schema.NewUser.model_validate(record)
+                except ValidationError as ex:
+                    write_error(errors, line_num, record, str(ex))
+                    failed += 1
+                    continue
+                users.append(user)
+                line_nums[id(user)] = (line_num, record)
+
+            new, existing, invalid = dbapi.split_new_users(db_session, users)
+            skipped += len(existing)
+            for user, error in invalid:
+                write_error(errors, *line_nums[id(user)], error)
+                failed += 1
+
+            # hashing is what takes time, spread it over all CPUs
+            chunksize = max(1, len(new) // ((workers or 1) * 4))
+            hashed_passwords = list(
+                executor.map(
+                    passwords.hash_password,
+                    [user.password for user in new],
+                    chunksize=chunksize,
+                )
+            )
+            try:
+                dbapi.create_users(db_session, new, hashed_passwords)
+            except SQLAlchemyError as ex:
+                db_session.rollback()
+                logger.exception("Failed to insert batch")
+                for user in new:
+                    write_error(errors, *line_nums[id(user)], str(ex.orig or ex))
+                failed += len(new)
+                continue
+
+            created += len(new)
+            console.print(f"Created {created} users")
+
+    if in_place:
+        report_path.replace(errors_path)
 
-    for user in users:
-        print(f"id={user.id} username={user.username} email={user.email}")
+    console.print(
+        f"Created: {created}, skipped (already exist): {skipped}, failed: {failed}",
+        style="red" if failed else "green",
+    )
+    if failed:
+        console.print(f"Failed records are in {errors_path}")
+        raise typer.Exit(code=1)
 
 
 PromptUsername = Annotated[str, typer.Option(prompt=True)]
@@ -72,12 +257,15 @@ PromptPassword = Annotated[
 @app.command(name="passwd")
 def set_password(username: PromptUsername, password: PromptPassword):
     """Sets user password"""
+    from auth_server.db.engine import Session
+    from auth_server.db import api as dbapi
+    from auth_server.cli.console import get_console
 
     with Session() as db_session:
         user = dbapi.set_user_password(db_session, username=username, password=password)
 
     if user:
-        console.print("Password successfully updated", style="green")
+        get_console().print("Password successfully updated", style="green")
 
 
 PromptPassword2 = Annotated[str, typer.Option(prompt=True, hide_input=True)]
@@ -86,7 +274,11 @@ PromptPassword2 = Annotated[str, typer.Option(prompt=True, hide_input=True)]
 @app.command(name="auth")
 def check_credentials(username: PromptUsername, password: PromptPassword2):
     """Checks user credentials"""
+    from auth_server.db.engine import Session
+    from auth_server.auth import db_auth
+    from auth_server.cli.console import get_console
 
+    console = get_console()
     with Session() as db_session:
         user = db_auth(db_session, username, password)
 
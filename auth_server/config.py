@@ -1,5 +1,6 @@
 import logging
 
+from pathlib import Path
 from functools import lru_cache
 from enum import Enum
 
@@ -22,13 +23,125 @@ class Algs(str, Enum):
     ES512 = "ES512"
 
 
+class PoolMode(str, Enum):
+    NULL = "null"  # new DB connection for every session
+    QUEUE = "queue"
+
+
+class PasswordExecutor(str, Enum):
+    THREAD = "thread"
+    PROCESS = "process"
+
+
+class PasswordScheme(str, Enum):
+    PBKDF2_SHA256 = "pbkdf2_sha256"
+    # requires `argon2` extra
+    ARGON2 = "argon2"
+    # requires `bcrypt` extra
+    BCRYPT = "bcrypt"
+
+
+class VerifyMode(str, Enum):
+    # token's user must be present in DB
+    DATABASE = "database"
+    # token's signature and `exp` are trusted, unless token is revoked
+    STATELESS = "stateless"
+
+
 class Settings(BaseSettings):
     secret_key: str
     db_url: PostgresDsn
+    db_pool_mode: PoolMode = PoolMode.QUEUE
+    db_pool_size: int = Field(ge=1, default=5)
+    db_pool_max_overflow: int = Field(ge=0, default=10)
+    # seconds to wait for a free connection before giving up
+    db_pool_timeout: float = Field(gt=0, default=10)
+    # seconds after which connection is replaced; -1 means never
+    db_pool_recycle: int = Field(ge=-1, default=1800)
+    db_pool_pre_ping: bool = True
+    # on startup, every worker opens `db_pool_size` connections and loads
+    # caches, so that its first requests are not slower than the rest
+    warm_up: bool = True
+    # seconds between log lines with usage of DB pool, verify cache and
+    # login throttles of the worker; zero disables them
+    stats_log_interval: int = Field(ge=0, default=300)
 
     token_algorithm: Algs = Algs.HS256
     token_expire_minutes: int = Field(gt=0, default=1360)
+    # lifetime of refresh tokens issued along with access tokens, see
+    # `/token/refresh`; zero disables refresh tokens
+    refresh_token_expire_minutes: int = Field(ge=0, default=0)
+    # PEM private key, required by RS* and ES* algorithms
+    private_key_file: Path | None = None
+    # PEM public keys of rotated out private keys; tokens signed with them
+    # are still accepted
+    public_key_files: list[Path] = []
+    # `kid` header of issued tokens; for RS*/ES* defaults to key thumbprint
+    key_id: str | None = None
+    # seconds clients may cache `/.well-known/jwks.json`
+    jwks_max_age: int = Field(ge=0, default=3600)
     cookie_name: str = "access_token"
+    # `/verify` sets fresh token cookie when token read from the cookie
+    # expires within this many minutes; zero disables renewal
+    token_renew_before_minutes: int = Field(ge=0, default=0)
+    # max number of tokens remembered as renewed, so that each is renewed once
+    token_renew_cache_size: int = Field(gt=0, default=4096)
+    # encode scopes in tokens as bitmask (`scm` claim) instead of list
+    token_compact_scopes: bool = False
+
+    # seconds after which role -> scopes map is reloaded, so that changes
+    # made by other processes are picked up
+    scope_cache_ttl: int = Field(ge=0, default=60)
+
+    verify_mode: VerifyMode = VerifyMode.DATABASE
+    # seconds between fetches of new revocations, stateless mode only
+    revocation_refresh_interval: int = Field(gt=0, default=30)
+
+    # `/verify` responds with X-Auth-User-Id, X-Auth-Username and
+    # X-Auth-Scopes headers; nginx can pass them on via `auth_request_set`
+    verify_identity_headers: bool = False
+    # `/verify` is answered by minimal ASGI handler in front of FastAPI
+    # routing; responses have empty bodies
+    verify_fast_path: bool = False
+
+    # verified tokens are remembered by `/verify` for at most this many
+    # seconds (and never past token's `exp`); zero disables the cache
+    verify_cache_ttl: int = Field(ge=0, default=30)
+    verify_cache_size: int = Field(ge=0, default=4096)
+
+    # scheme of new password hashes; hashes of other schemes (or with other
+    # cost) are replaced on next successful login
+    password_scheme: PasswordScheme = PasswordScheme.PBKDF2_SHA256
+    # cost of the hash: iterations for pbkdf2_sha256, log2 of iterations
+    # for bcrypt, time cost for argon2; defaults to passlib's default
+    # (see `auth-cli passwords benchmark`)
+    password_rounds: int | None = Field(gt=0, default=None)
+    # KiB of memory used per hash, argon2 only
+    password_memory_cost: int | None = Field(gt=0, default=None)
+    password_executor: PasswordExecutor = PasswordExecutor.THREAD
+    # defaults to number of CPUs
+    password_workers: int | None = Field(gt=0, default=None)
+    # max password jobs waiting or running; above it `/token` answers 503
+    password_queue_size: int = Field(gt=0, default=64)
+
+    # usernames not found on login are remembered for this many seconds,
+    # so that repeated attempts do not reach DB; zero disables the cache
+    unknown_username_cache_ttl: int = Field(ge=0, default=10)
+    unknown_username_cache_size: int = Field(ge=0, default=1024)
+    # verify password of unknown user against dummy hash, so that response
+    # time does not tell whether username exists
+    login_dummy_verify: bool = False
+
+    # login attempts allowed per username and per client address within
+    # `login_throttle_window` seconds; zero disables the limit
+    login_throttle_attempts: int = Field(ge=0, default=10)
+    login_throttle_address_attempts: int = Field(ge=0, default=100)
+    login_throttle_window: int = Field(gt=0, default=60)
+    # seconds of the first lockout, each consecutive one is twice as long
+    login_throttle_lockout: int = Field(gt=0, default=30)
+    login_throttle_max_lockout: int = Field(gt=0, default=900)
+    # max number of tracked usernames and addresses (each)
+    login_throttle_size: int = Field(ge=0, default=10000)
 
     model_config = SettingsConfigDict(env_prefix='pm_')
 
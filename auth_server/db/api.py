@@ -1,18 +1,98 @@
+import itertools
 import uuid
 import logging
+from datetime import datetime, timedelta, UTC
 
-from typing import Tuple
-from passlib.hash import pbkdf2_sha256
-from sqlalchemy import select, func
+from functools import lru_cache
+from typing import Tuple, Iterable, Iterator
+from sqlalchemy import select, func, text, Select, Row
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PGUUID, insert as pg_insert
 from sqlalchemy.orm import Session
-from sqlalchemy import delete
+from sqlalchemy import delete, update, insert
 
-from auth_server import schema, constants, scopes, types, const
+from auth_server import schema, constants, scopes, types, const, passwords
+from auth_server.cache import TTLCache
+from auth_server.config import get_settings
 from auth_server.db import orm
 from auth_server.db.orm import OwnerType, FolderType, Ownership
+from auth_server.db.role_scopes import get_role_scopes, ALL_SCOPES
 
 logger = logging.getLogger(__name__)
 
+# key of the advisory lock held while syncing permissions
+SYNC_PERMS_LOCK_KEY = 0x7065726D  # "perm"
+
+
+@lru_cache()
+def get_unknown_usernames() -> TTLCache:
+    """Usernames recently not found on login
+
+    Name is removed as soon as user with it is created here, other
+    processes forget it after the TTL.
+    """
+    settings = get_settings()
+
+    return TTLCache(
+        maxsize=settings.unknown_username_cache_size,
+        ttl=settings.unknown_username_cache_ttl,
+    )
+
+
+def create_special_folders(
+    session: Session, owners: list[types.Owner]
+) -> dict[uuid.UUID, dict[str, uuid.UUID]]:
+    """
+    Create home and inbox folders for many users/groups at once.
+
+    Folder nodes, their ownerships and special folder entries are inserted
+    with one multi-row statement per table i.e. four statements regardless
+    of number of owners.
+
+    Returns:
+        Dictionary mapping owner ID to dictionary with 'home' and 'inbox'
+        keys mapping to folder IDs
+    """
+    folder_rows, special_rows, ownerships = [], [], []
+    result = {}
+    for owner in owners:
+        folder_ids = {}
+        for folder_type, title in (
+            (FolderType.HOME, constants.HOME_TITLE),
+            (FolderType.INBOX, constants.INBOX_TITLE),
+        ):
+            folder_id = uuid.uuid4()
+            folder_ids[folder_type.value] = folder_id
+            # the actual folder nodes WITHOUT user_id
+            folder_rows.append(
+                {
+                    "id": folder_id,
+                    "title": title,
+                    "ctype": constants.CTYPE_FOLDER,
+                    "lang": "xxx",
+                    "created_by": const.SYSTEM_USER_ID,
+                    "updated_by": const.SYSTEM_USER_ID,
+                }
+            )
+            ownerships.append((types.NodeResource(id=folder_id), owner))
+            special_rows.append(
+                {
+                    "owner_type": owner.owner_type,
+                    "owner_id": owner.owner_id,
+                    "folder_type": folder_type,
+                    "folder_id": folder_id,
+                }
+            )
+        result[owner.owner_id] = folder_ids
+
+    if not owners:
+        return result
+
+    session.execute(insert(orm.Folder), folder_rows)
+    set_owners(session, ownerships)
+    session.execute(insert(orm.SpecialFolder), special_rows)
+
+    return result
+
 
 def create_special_folders_for_user(
     session: Session,
@@ -28,59 +108,9 @@ def create_special_folders_for_user(
     Returns:
         Dictionary with 'home' and 'inbox' keys mapping to folder IDs
     """
-    home_id = uuid.uuid4()
-    inbox_id = uuid.uuid4()
     owner = types.Owner.create_from(user_id=user_id)
 
-    # Create the actual folder nodes WITHOUT user_id
-    home_folder = orm.Folder(
-        id=home_id,
-        title=constants.HOME_TITLE,
-        ctype=constants.CTYPE_FOLDER,
-        lang="xxx",
-        created_by=const.SYSTEM_USER_ID,
-        updated_by=const.SYSTEM_USER_ID,
-    )
-    inbox_folder = orm.Folder(
-        id=inbox_id,
-        title=constants.INBOX_TITLE,
-        ctype=constants.CTYPE_FOLDER,
-        lang="xxx",
-        created_by=const.SYSTEM_USER_ID,
-        updated_by=const.SYSTEM_USER_ID,
-    )
-
-    session.add(home_folder)
-    session.add(inbox_folder)
-    session.flush()
-
-    # Set ownership for both folders
-    set_owner(
-        session=session,
-        resource=types.NodeResource(id=home_id),
-        owner=owner,
-    )
-
-    set_owner(session=session, resource=types.NodeResource(id=inbox_id), owner=owner)
-
-    # Create special folder entries
-    home_special = orm.SpecialFolder(
-        owner_type=OwnerType.USER,
-        owner_id=user_id,
-        folder_type=FolderType.HOME,
-        folder_id=home_id,
-    )
-    inbox_special = orm.SpecialFolder(
-        owner_type=OwnerType.USER,
-        owner_id=user_id,
-        folder_type=FolderType.INBOX,
-        folder_id=inbox_id,
-    )
-
-    session.add_all([home_special, inbox_special])
-    session.flush()
-
-    return {"home": home_id, "inbox": inbox_id}
+    return create_special_folders(session, [owner])[user_id]
 
 
 def create_role(
@@ -100,7 +130,7 @@ def create_role(
         stmt = select(orm.Role).where(orm.Role.name == name)
         result = db_session.execute(stmt).scalars().all()
         if len(result) >= 1:
-            logger.info(f"Role {name} already exists")
+            logger.info("Role %s already exists", name)
             return schema.Role.model_validate(result[0]), None
 
     stmt = select(orm.Permission).where(orm.Permission.codename.in_(scopes))
@@ -120,9 +150,13 @@ def create_role(
     try:
         db_session.commit()
     except Exception as e:
+        db_session.rollback()
         error_msg = str(e)
         if "UNIQUE constraint failed" in error_msg:
             return None, "Role already exists"
+        return None, error_msg
+
+    get_role_scopes().invalidate()
 
     result = schema.Role.model_validate(role)
 
@@ -153,37 +187,49 @@ def get_perms(db_session: Session) -> list[schema.Permission]:
     return model_perms
 
 
-def sync_perms(db_session: Session):
+def sync_perms(db_session: Session) -> schema.PermsSync:
     """Syncs `core.auth.scopes.SCOPES` with `auth_permissions` table
 
     In other words makes sure that all scopes defined in
     `core.auth.scopes.SCOPES` are in `auth_permissions` table and other way
     around - any permission found in db table is also in
     `core.auth.scopes.SCOPES`.
-    """
-    # A. add missing scopes to perms table
-    scopes_to_be_added = []
-    db_perms = db_session.scalars(select(orm.Permission))
-    model_perms = [schema.Permission.model_validate(db_perm) for db_perm in db_perms]
-    perms_codenames = [perm.codename for perm in model_perms]
-
-    # collect missing scopes
-    for codename, desc in scopes.SCOPES.items():
-        if codename not in perms_codenames:
-            scopes_to_be_added.append((codename, desc))
-    # add missing scopes
-    for scope in scopes_to_be_added:
-        db_session.add(orm.Permission(codename=scope[0], name=scope[1]))
-    db_session.commit()
 
-    # B. removes permissions not present in scopes
+    Changes are applied in one transaction. Concurrent calls (e.g. from
+    replicas started at the same time) wait for each other, so the
+    later ones find nothing to change.
+    """
+    db_session.execute(select(func.pg_advisory_xact_lock(SYNC_PERMS_LOCK_KEY)))
 
-    scope_codenames = [scope for scope in scopes.SCOPES.keys()]
+    db_codenames = set(db_session.scalars(select(orm.Permission.codename)))
+    added = sorted(scopes.SCOPES.keys() - db_codenames)
+    removed = sorted(db_codenames - scopes.SCOPES.keys())
 
-    stmt = delete(orm.Permission).where(orm.Permission.codename.notin_(scope_codenames))
-    db_session.execute(stmt)
+    if added:
+        db_session.execute(
+            insert(orm.Permission),
+            [{"codename": codename, "name": scopes.SCOPES[codename]} for codename in added],
+        )
+    if removed:
+        removed_ids = select(orm.Permission.id).where(
+            orm.Permission.codename.in_(removed)
+        )
+        db_session.execute(
+            delete(orm.roles_permissions_association).where(
+                orm.roles_permissions_association.c.permission_id.in_(removed_ids)
+            )
+        )
+        db_session.execute(
+            delete(orm.Permission).where(orm.Permission.codename.in_(removed))
+        )
     db_session.commit()
 
+    if added or removed:
+        logger.info("Permissions added: %s, removed: %s", added, removed)
+        get_role_scopes().invalidate()
+
+    return schema.PermsSync(added=added, removed=removed)
+
 
 def get_user_uuid(session: Session, user_id: uuid.UUID) -> orm.User:
     stmt = select(orm.User).where(orm.User.id == user_id)
@@ -193,62 +239,201 @@ def get_user_uuid(session: Session, user_id: uuid.UUID) -> orm.User:
     return db_user
 
 
-def get_user_by_username(session: Session, username: str) -> schema.User | None:
-    stmt = select(orm.User).where(orm.User.username == username)
-    db_user = session.scalars(stmt).one()
-    model_user = schema.User.model_validate(db_user)
-    if model_user.is_superuser:
-        # superuser has all permissions (permission = scope)
-        model_user.scopes = scopes.SCOPES.keys()
-    else:
-        # user inherits his/her scopes
-        # from the direct permissions associated
-        # and from groups he/she belongs to
-        user_scopes = set()
-        for role in db_user.roles:
-            user_scopes.update([p.codename for p in role.permissions])
+def user_exists(session: Session, user_id: uuid.UUID) -> bool:
+    stmt = select(orm.User.id).where(orm.User.id == user_id)
 
-        model_user.scopes = list(user_scopes)
+    return session.scalar(stmt) is not None
 
-    return model_user
 
+def user_role_ids_column():
+    """IDs of user's roles
 
-def get_user_by_email(session: Session, email: str) -> schema.User | None:
+    Correlated subquery to be selected along with `orm.User`, so that
+    user and its roles are fetched in one round-trip, regardless of the
+    number of roles user has. Scopes of the roles are then looked up in
+    `role_scopes` map.
+    """
+    users_roles = orm.users_roles_association
+
+    return (
+        select(
+            # tuples (unlike lists) are hashable
+            func.array_agg(
+                users_roles.c.role_id,
+                type_=ARRAY(PGUUID(as_uuid=True), as_tuple=True),
+            )
+        )
+        .where(users_roles.c.user_id == orm.User.id)
+        .correlate(orm.User)
+        .scalar_subquery()
+        .label("role_ids")
+    )
 
-    stmt = select(orm.User).where(orm.User.email == email)
-    db_user = session.scalar(stmt)
 
-    if db_user is None:
-        return None
+def special_folder_id_column(folder_type: FolderType):
+    """ID of user's special folder of given type, see `user_role_ids_column`"""
+    special_folder = orm.SpecialFolder
 
-    model_user = schema.User.model_validate(db_user)
+    return (
+        select(special_folder.folder_id)
+        .where(
+            special_folder.owner_type == OwnerType.USER,
+            special_folder.owner_id == orm.User.id,
+            special_folder.folder_type == folder_type,
+        )
+        .correlate(orm.User)
+        .scalar_subquery()
+        .label(f"{folder_type.value}_folder_id")
+    )
+
+
+def select_user_row(*whereclause) -> Select:
+    """Statement selecting fields of `schema.User` along with role IDs
+
+    Columns are selected instead of `orm.User`, so that rows map straight
+    into `schema.User` (see `to_model_user`), without ORM objects being
+    built, tracked and then validated by pydantic.
+    """
+    return select(
+        orm.User.id,
+        orm.User.username,
+        orm.User.password,
+        orm.User.email,
+        orm.User.is_superuser,
+        special_folder_id_column(FolderType.HOME),
+        special_folder_id_column(FolderType.INBOX),
+        user_role_ids_column(),
+    ).where(*whereclause)
+
+
+def select_role_permissions() -> Select:
+    """Statement selecting (role ID, permission codename) of all roles
+
+    Roles without permissions are selected too, with NULL codename.
+    """
+    roles_permissions = orm.roles_permissions_association
+
+    return (
+        select(orm.Role.id, orm.Permission.codename)
+        .outerjoin(roles_permissions, roles_permissions.c.role_id == orm.Role.id)
+        .outerjoin(
+            orm.Permission, orm.Permission.id == roles_permissions.c.permission_id
+        )
+    )
 
-    if model_user.is_superuser:
+
+def to_model_user(row: Row) -> schema.User:
+    """Converts row selected by `select_user_row` into schema.User
+
+    Values come from DB columns of matching types, so they are not
+    validated again. Role -> scopes map must be loaded.
+    """
+    fields = row._asdict()
+    role_ids = fields.pop("role_ids")
+    if fields["is_superuser"]:
         # superuser has all permissions (permission = scope)
-        model_user.scopes = scopes.SCOPES.keys()
+        fields["scopes"] = ALL_SCOPES
     else:
-        # user inherits his/her scopes
-        # from the direct permissions associated
-        # and from groups he/she belongs to
-        user_scopes = set()
-        for role in db_user.roles:
-            user_scopes.update([p.codename for p in role.permissions])
+        # user inherits his/her scopes from the roles
+        # he/she has
+        fields["scopes"] = get_role_scopes().scopes_for(role_ids or ())
+
+    return schema.User.model_construct(**fields)
 
-        model_user.scopes = list(user_scopes)
 
-    return model_user
+def load_role_scopes(session: Session, role_ids: Iterable[uuid.UUID] = ()) -> None:
+    """Loads role -> scopes map if it is stale or lacks any of `role_ids`
+
+    Roles created by other processes are thus not resolved to no scopes
+    until the map expires.
+    """
+    role_scopes = get_role_scopes()
+    if role_scopes.is_stale() or not role_scopes.knows(role_ids):
+        role_scopes.load(session.execute(select_role_permissions()))
+
+
+def get_user_by_username(session: Session, username: str) -> schema.User | None:
+    stmt = select_user_row(orm.User.username == username)
+    row = session.execute(stmt).one()
+    load_role_scopes(session, row.role_ids or ())
+
+    return to_model_user(row)
+
+
+def get_user_by_email(session: Session, email: str) -> schema.User | None:
+
+    stmt = select_user_row(orm.User.email == email)
+    row = session.execute(stmt).first()
+
+    if row is None:
+        return None
+
+    load_role_scopes(session, row.role_ids or ())
+
+    return to_model_user(row)
 
 
 def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(orm.User).offset(skip).limit(limit).all()
 
 
+def iter_users(session: Session, page_size: int = 1000) -> Iterator[Row]:
+    """Yields all users as lightweight rows, ordered by username
+
+    Users are fetched page by page; each page starts right after the last
+    username of the previous one (keyset pagination over the username
+    index), so every page costs the same and at most one page is in
+    memory at a time.
+    """
+    columns = (
+        orm.User.id,
+        orm.User.username,
+        orm.User.email,
+        orm.User.first_name,
+        orm.User.last_name,
+        orm.User.is_superuser,
+        orm.User.is_active,
+        orm.User.created_at,
+    )
+    last_username = None
+    while True:
+        stmt = select(*columns).order_by(orm.User.username).limit(page_size)
+        if last_username is not None:
+            stmt = stmt.where(orm.User.username > last_username)
+        rows = session.execute(stmt).all()
+
+        yield from rows
+
+        if len(rows) < page_size:
+            return
+        last_username = rows[-1].username
+
+
+def free_username(session: Session, username: str) -> str:
+    """Returns `username` or, if it is taken, `username` with the lowest
+    numeric suffix which is not taken e.g. "john2"
+    """
+    stmt = select(orm.User.username).where(
+        orm.User.username.startswith(username, autoescape=True)
+    )
+    taken = set(session.scalars(stmt))
+    if username not in taken:
+        return username
+
+    return next(
+        f"{username}{number}"
+        for number in itertools.count(2)
+        if f"{username}{number}" not in taken
+    )
+
+
 def create_user_from_email(session: Session, email: str) -> schema.User:
     """
     Creates user with its home and inbox folders
 
     As username first part of the email address will be used i.e.
-    the part before '@'.
+    the part before '@'; if another user has it already, a numeric
+    suffix is appended, see `free_username`.
 
     Password field will be set a random UUID4 string as it is
     not supposed to be used in this case.
@@ -256,8 +441,8 @@ def create_user_from_email(session: Session, email: str) -> schema.User:
     is created via oauth2 provider and thus, authentication
     will be performed via oauth2 provider.
     """
-    logger.debug(f"Inserting user with email {email}...")
-    username = email.split("@")[0]
+    logger.debug("Inserting user with email %s...", email)
+    username = free_username(session, email.split("@")[0])
 
     return create_user(
         session,
@@ -282,57 +467,142 @@ def create_user(
 ) -> schema.User:
     """Creates a user with its home and inbox folders via special_folders table"""
 
-    if role_names is None:
-        role_names = []
-
-    user_id = uuid.uuid4()
-    create_special_folders_for_user(session, user_id)
+    roles = []
+    if role_names:
+        stmt = select(orm.Role).where(orm.Role.name.in_(role_names))
+        roles = session.execute(stmt).scalars().all()
 
-    # Step 1: Create user first
+    # user and its role links are inserted by the same flush
     db_user = orm.User(
-        id=user_id,
+        id=uuid.uuid4(),
         username=username,
         email=email,
         first_name=first_name,
         last_name=last_name,
         is_superuser=is_superuser,
         is_active=is_active,
-        password=pbkdf2_sha256.hash(password),
+        password=passwords.hash_password(password),
         created_by=const.SYSTEM_USER_ID,
         updated_by=const.SYSTEM_USER_ID,
+        roles=roles,
     )
-
     session.add(db_user)
     session.flush()
 
-    # Step 3: Add roles if specified
-    stmt = select(orm.Role).where(orm.Role.name.in_(role_names))
-    roles = session.execute(stmt).scalars().all()
-    db_user.roles = roles
+    folder_ids = create_special_folders_for_user(session, db_user.id)
 
     session.commit()
+    get_unknown_usernames().pop(username)
+
+    return schema.User(
+        id=db_user.id,
+        username=username,
+        password=db_user.password,
+        email=email,
+        home_folder_id=folder_ids["home"],
+        inbox_folder_id=folder_ids["inbox"],
+        is_superuser=is_superuser,
+    )
+
+
+def split_new_users(
+    session: Session, users: list[schema.NewUser]
+) -> tuple[list[schema.NewUser], list[schema.NewUser], list[tuple[schema.NewUser, str]]]:
+    """Splits users to be imported into new, already existing and invalid ones
+
+    Invalid ones are returned along with the reason. Issues two statements
+    regardless of number of users.
+    """
+    usernames = {user.username for user in users}
+    role_names = {name for user in users for name in user.roles}
+    stmt = select(orm.User.username).where(orm.User.username.in_(usernames))
+    existing = set(session.scalars(stmt))
+    stmt = select(orm.Role.name).where(orm.Role.name.in_(role_names))
+    known_roles = set(session.scalars(stmt))
+
+    new, old, invalid = [], [], []
+    seen = set()
+    for user in users:
+        unknown_roles = set(user.roles) - known_roles
+        if user.username in existing:
+            old.append(user)
+        elif user.username in seen:
+            invalid.append((user, "Duplicate username"))
+        elif unknown_roles:
+            invalid.append((user, f"Unknown roles: {', '.join(sorted(unknown_roles))}"))
+        else:
+            seen.add(user.username)
+            new.append(user)
+
+    return new, old, invalid
+
+
+def create_users(
+    session: Session, users: list[schema.NewUser], hashed_passwords: list[str]
+) -> None:
+    """Creates users, with their home and inbox folders, in one transaction
+
+    Same as `create_user` for many users at once: each table gets one
+    multi-row INSERT (split into pages of 1000 rows by SQLAlchemy), so the
+    number of statements does not depend on number of users. Users are
+    expected to be checked with `split_new_users` first; passwords are
+    expected to be already hashed, in the same order as users.
+    """
+    role_names = {name for user in users for name in user.roles}
+    stmt = select(orm.Role.name, orm.Role.id).where(orm.Role.name.in_(role_names))
+    role_ids = dict(session.execute(stmt).all())
+
+    user_rows, role_rows = [], []
+    for user, hashed_password in zip(users, hashed_passwords, strict=True):
+        user_id = uuid.uuid4()
+        user_rows.append(
+            {
+                "id": user_id,
+                "username": user.username,
+                "email": user.email,
+                "password": hashed_password,
+                "first_name": user.first_name,
+                "last_name": user.last_name,
+                "is_superuser": user.is_superuser,
+                "is_active": user.is_active,
+                "created_by": const.SYSTEM_USER_ID,
+                "updated_by": const.SYSTEM_USER_ID,
+            }
+        )
+        role_rows.extend(
+            {"user_id": user_id, "role_id": role_ids[name]} for name in user.roles
+        )
 
-    # Refresh user to get special_folders loaded
-    session.refresh(db_user)
+    session.execute(insert(orm.User), user_rows)
+    create_special_folders(
+        session,
+        [types.Owner.create_from(user_id=row["id"]) for row in user_rows],
+    )
+    if role_rows:
+        session.execute(insert(orm.users_roles_association), role_rows)
+    session.commit()
 
-    return schema.User.model_validate(db_user)
+    for user in users:
+        get_unknown_usernames().pop(user.username)
 
 
 def get_or_create_user_by_email(session: Session, email: str) -> schema.User:
-    logger.debug(f"get or create user with email: {email}")
+    logger.debug("get or create user with email: %s", email)
 
     user = get_user_by_email(session, email)
     if user is None:
-        logger.info(f"User with email {email} is None")
+        logger.info("User with email %s is None", email)
         try:
             create_user_from_email(session, email)
         except Exception:
-            logger.exception(f"Exception while creating user from email={email}")
+            # e.g. user with the same email or username created concurrently
+            session.rollback()
+            logger.exception("Exception while creating user from email=%s", email)
 
         stmt = select(orm.User).where(orm.User.email == email)
         user = session.scalar(stmt)
 
-    logger.debug(f"User with email {email} was found in database")
+    logger.debug("User with email %s was found in database", email)
 
     return user
 
@@ -342,39 +612,146 @@ def set_user_password(db_session: Session, username: str, password: str) -> orm.
     db_user = db_session.scalars(stmt).one()
 
     db_session.add(db_user)
-    db_user.password = pbkdf2_sha256.hash(password)
+    db_user.password = passwords.hash_password(password)
     db_session.commit()
 
     return db_user
 
 
+def update_password_hash(
+    session: Session, user_id: uuid.UUID, old_hash: str, new_hash: str
+) -> None:
+    """Replaces outdated password hash of the user
+
+    Hash is replaced only if it was not changed meanwhile (e.g. by
+    `set_user_password`).
+    """
+    stmt = (
+        update(orm.User)
+        .where(orm.User.id == user_id, orm.User.password == old_hash)
+        .values(password=new_hash)
+    )
+    session.execute(stmt)
+    session.commit()
+
+
+def upsert_ownerships(rows: list[dict]):
+    """INSERT of ownerships which updates owner of already owned resources"""
+    stmt = pg_insert(Ownership).values(rows)
+
+    return stmt.on_conflict_do_update(
+        constraint="uq_resource_owner",
+        set_={
+            "owner_type": stmt.excluded.owner_type,
+            "owner_id": stmt.excluded.owner_id,
+        },
+    )
+
+
 def set_owner(
     session: Session, resource: types.Resource, owner: types.Owner
 ) -> Ownership:
     """
     Set or update the owner of a resource.
 
-    Creates ownership record if it doesn't exist, updates if it does.
+    Creates ownership record if it doesn't exist, updates if it does;
+    either way with one statement.
     """
-    stmt = select(Ownership).where(
-        Ownership.resource_type == resource.type.value,
-        Ownership.resource_id == resource.id,
+    stmt = upsert_ownerships(
+        [
+            {
+                "owner_type": owner.owner_type.value,
+                "owner_id": owner.owner_id,
+                "resource_type": resource.type.value,
+                "resource_id": resource.id,
+            }
+        ]
+    ).returning(Ownership)
+
+    return session.scalars(
+        stmt, execution_options={"populate_existing": True}
+    ).one()
+
+
+def set_owners(
+    session: Session, ownerships: list[tuple[types.Resource, types.Owner]]
+) -> None:
+    """
+    Set or update owners of many resources with one statement.
+
+    If a resource is listed more than once, the last owner wins.
+    """
+    # one statement must not update the same row twice
+    rows = {
+        (resource.type.value, resource.id): {
+            "owner_type": owner.owner_type.value,
+            "owner_id": owner.owner_id,
+            "resource_type": resource.type.value,
+            "resource_id": resource.id,
+        }
+        for resource, owner in ownerships
+    }
+    if rows:
+        session.execute(upsert_ownerships(list(rows.values())))
+
+
+def revocation_expires_at() -> datetime:
+    """When all access tokens issued so far are expired"""
+    minutes = get_settings().token_expire_minutes
+
+    return datetime.now(UTC) + timedelta(minutes=minutes)
+
+
+def lock_revocations(session: Session) -> None:
+    """Locks `revoked_tokens` against other writers until commit
+
+    IDs are assigned on insert, not on commit; with the lock, rows become
+    visible in order of their IDs, so that readers which fetch rows with ID
+    greater than the last one seen (see `revocation.RevocationList.refresh`)
+    cannot skip a row committed after one with a higher ID.
+    """
+    session.execute(text("LOCK TABLE revoked_tokens IN SHARE ROW EXCLUSIVE MODE"))
+
+
+def delete_expired_revocations(session: Session) -> None:
+    stmt = delete(orm.RevokedToken).where(orm.RevokedToken.expires_at < func.now())
+    session.execute(stmt)
+
+
+def revoke_token(
+    session: Session, jti: str, expires_at: datetime | None = None
+) -> orm.RevokedToken:
+    """Revokes one token identified by its `jti` claim
+
+    Revocation is kept until `expires_at`, by default until any token issued
+    so far is expired. Expired revocations are deleted along the way.
+    """
+    lock_revocations(session)
+    delete_expired_revocations(session)
+    revoked = orm.RevokedToken(
+        jti=jti, expires_at=expires_at or revocation_expires_at()
     )
-    ownership = session.execute(stmt).scalar_one_or_none()
+    session.add(revoked)
+    session.commit()
 
-    if ownership:
-        # Update existing ownership
-        ownership.owner_type = owner.owner_type.value
-        ownership.owner_id = owner.owner_id
-    else:
-        # Create new ownership
-        ownership = Ownership(
-            owner_type=owner.owner_type.value,
-            owner_id=owner.owner_id,
-            resource_type=resource.type.value,
-            resource_id=resource.id,
+    return revoked
+
+
+def revoke_user_tokens(session: Session, user_id: uuid.UUID) -> orm.RevokedToken:
+    """Revokes all tokens, access and refresh ones, issued to the user so far"""
+    lock_revocations(session)
+    delete_expired_revocations(session)
+    revoked = orm.RevokedToken(user_id=user_id, expires_at=revocation_expires_at())
+    session.add(revoked)
+    stmt = (
+        update(orm.RefreshToken)
+        .where(
+            orm.RefreshToken.user_id == user_id,
+            orm.RefreshToken.revoked_at.is_(None),
         )
-        session.add(ownership)
+        .values(revoked_at=func.now())
+    )
+    session.execute(stmt)
+    session.commit()
 
-    session.flush()
-    return ownership
+    return revoked
@@ -0,0 +1,164 @@
+"""Async counterparts of `auth_server.db.api` read functions
+
+Used by HTTP endpoints, so that DB round-trips of concurrent requests
+overlap instead of blocking the event loop.
+"""
+import uuid
+import logging
+
+from datetime import datetime, UTC
+from typing import Iterable
+
+from sqlalchemy import select, update, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth_server import schema, refresh_tokens
+from auth_server.db import orm
+from auth_server.db.api import (
+    select_user_row,
+    select_role_permissions,
+    to_model_user,
+)
+from auth_server.db.role_scopes import get_role_scopes
+
+logger = logging.getLogger(__name__)
+
+
+async def user_exists(session: AsyncSession, user_id: uuid.UUID) -> bool:
+    stmt = select(orm.User.id).where(orm.User.id == user_id)
+
+    return await session.scalar(stmt) is not None
+
+
+async def load_role_scopes(
+    session: AsyncSession, role_ids: Iterable[uuid.UUID] = ()
+) -> None:
+    """Async version of `auth_server.db.api.load_role_scopes`"""
+    role_scopes = get_role_scopes()
+    if role_scopes.is_stale() or not role_scopes.knows(role_ids):
+        role_scopes.load(await session.execute(select_role_permissions()))
+
+
+async def get_user_by_username(
+    session: AsyncSession, username: str
+) -> schema.User | None:
+    """Async version of `auth_server.db.api.get_user_by_username`
+
+    Raises NoResultFound if there is no user with given username.
+    """
+    stmt = select_user_row(orm.User.username == username)
+    row = (await session.execute(stmt)).one()
+    await load_role_scopes(session, row.role_ids or ())
+
+    return to_model_user(row)
+
+
+async def get_user_by_id(session: AsyncSession, user_id: uuid.UUID) -> schema.User:
+    """Same as `get_user_by_username`, but user is looked up by ID"""
+    stmt = select_user_row(orm.User.id == user_id)
+    row = (await session.execute(stmt)).one()
+    await load_role_scopes(session, row.role_ids or ())
+
+    return to_model_user(row)
+
+
+async def update_password_hash(
+    session: AsyncSession, user_id: uuid.UUID, old_hash: str, new_hash: str
+) -> None:
+    """Async version of `auth_server.db.api.update_password_hash`"""
+    stmt = (
+        update(orm.User)
+        .where(orm.User.id == user_id, orm.User.password == old_hash)
+        .values(password=new_hash)
+    )
+    await session.execute(stmt)
+    await session.commit()
+
+
+async def create_refresh_token(
+    session: AsyncSession,
+    user_id: uuid.UUID,
+    expires_at: datetime,
+    family_id: uuid.UUID | None = None,
+) -> str:
+    """Issues refresh token to the user, starting new family unless given
+
+    Returns the token; only its hash is stored.
+    """
+    token = refresh_tokens.new_token()
+    session.add(
+        orm.RefreshToken(
+            token_hash=refresh_tokens.token_hash(token),
+            family_id=family_id or uuid.uuid4(),
+            user_id=user_id,
+            expires_at=expires_at,
+        )
+    )
+    await session.commit()
+
+    return token
+
+
+async def rotate_refresh_token(
+    session: AsyncSession, token: str, expires_at: datetime
+) -> tuple[uuid.UUID, str]:
+    """Exchanges refresh token for a new one of the same family
+
+    Returns user ID and the new token. Raises
+    `refresh_tokens.InvalidRefreshToken` if token is unknown, expired or
+    revoked. If token was already exchanged, revokes its whole family and
+    raises `refresh_tokens.RefreshTokenReused`.
+    """
+    stmt = (
+        select(orm.RefreshToken)
+        .where(orm.RefreshToken.token_hash == refresh_tokens.token_hash(token))
+        # concurrent exchanges of the same token: the second one is reuse
+        .with_for_update()
+    )
+    db_token = await session.scalar(stmt)
+    now = datetime.now(UTC)
+    if db_token is None or db_token.revoked_at is not None:
+        raise refresh_tokens.InvalidRefreshToken()
+
+    if db_token.used_at is not None:
+        stmt = (
+            update(orm.RefreshToken)
+            .where(
+                orm.RefreshToken.family_id == db_token.family_id,
+                orm.RefreshToken.revoked_at.is_(None),
+            )
+            .values(revoked_at=now)
+        )
+        await session.execute(stmt)
+        await session.commit()
+        raise refresh_tokens.RefreshTokenReused()
+
+    if db_token.expires_at <= now:
+        raise refresh_tokens.InvalidRefreshToken()
+
+    db_token.used_at = now
+    user_id = db_token.user_id
+    new_token = await create_refresh_token(
+        session, user_id, expires_at, family_id=db_token.family_id
+    )
+
+    return user_id, new_token
+
+
+async def get_revoked_tokens(
+    session: AsyncSession, after_id: int = 0
+) -> list[orm.RevokedToken]:
+    """Returns not yet expired revocations with ID greater than `after_id`"""
+    stmt = (
+        select(orm.RevokedToken)
+        .where(
+            orm.RevokedToken.id > after_id,
+            or_(
+                orm.RevokedToken.expires_at.is_(None),
+                orm.RevokedToken.expires_at > datetime.now(UTC),
+            ),
+        )
+        .order_by(orm.RevokedToken.id)
+    )
+
+    return list(await session.scalars(stmt))
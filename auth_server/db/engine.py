@@ -1,16 +1,201 @@
-import os
-from sqlalchemy import create_engine, Engine
-from sqlalchemy.pool import NullPool
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from sqlalchemy import create_engine, make_url, Engine, URL
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from sqlalchemy import orm
 from sqlalchemy.orm import sessionmaker
 
-from auth_server.config import get_settings
+from auth_server.config import get_settings, PoolMode, Settings
+
+logger = logging.getLogger(__name__)
+
+# query parameters which asyncpg dialect accepts in the URL (as strings)
+ASYNCPG_PARAMS = {"ssl", "target_session_attrs", "prepared_statement_cache_size"}
+
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def record(self, waited: float, timeout: bool = False) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timeout
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_total": self.wait_total,
+                "wait_max": self.wait_max,
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool which keeps track of checkouts and of the time spent
+    waiting for a free connection
+
+    Stats are kept when the pool is recreated e.g. by `Engine.dispose`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
 
-settings = get_settings()
+    def recreate(self) -> "InstrumentedQueuePool":
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
 
-engine = create_engine(str(settings.db_url), poolclass=NullPool)
+    def _do_get(self):
+        started = time.perf_counter()
+        timeout = False
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timeout = True
+            raise
+        finally:
+            self.stats.record(time.perf_counter() - started, timeout)
 
-Session = sessionmaker(engine, expire_on_commit=False)
 
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    pass
 
+
+def engine_options(
+    settings: Settings,
+    queue_pool: type[QueuePool] = InstrumentedQueuePool,
+) -> dict:
+    if settings.db_pool_mode == PoolMode.NULL:
+        return {"poolclass": NullPool}
+
+    return {
+        "poolclass": queue_pool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_pool_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+@lru_cache()
 def get_engine() -> Engine:
-    return engine
+    """Engine of the process, created on first use"""
+    settings = get_settings()
+
+    return create_engine(str(settings.db_url), **engine_options(settings))
+
+
+def async_url(db_url: str | URL) -> tuple[URL, dict]:
+    """asyncpg URL and connect arguments equivalent to psycopg2 `db_url`
+
+    libpq parameters `sslmode`, `connect_timeout` and `application_name`
+    are translated into their asyncpg counterparts; other parameters which
+    asyncpg does not accept are dropped with a warning.
+    """
+    url = make_url(str(db_url))
+    query = dict(url.query)
+    connect_args = {}
+    if "sslmode" in query:
+        connect_args["ssl"] = query.pop("sslmode")
+    if "connect_timeout" in query:
+        connect_args["timeout"] = float(query.pop("connect_timeout"))
+    if "application_name" in query:
+        connect_args["server_settings"] = {
+            "application_name": query.pop("application_name")
+        }
+    dropped = sorted(query.keys() - ASYNCPG_PARAMS)
+    if dropped:
+        logger.warning("Not supported by asyncpg, ignored: %s", ", ".join(dropped))
+
+    url = url.set(
+        drivername="postgresql+asyncpg",
+        query={key: value for key, value in query.items() if key in ASYNCPG_PARAMS},
+    )
+    return url, connect_args
+
+
+@lru_cache()
+def get_async_engine() -> AsyncEngine:
+    """Same database accessed via asyncpg driver
+
+    Used by HTTP endpoints so that DB round-trips do not block the event
+    loop.
+    """
+    settings = get_settings()
+    url, connect_args = async_url(settings.db_url)
+
+    return create_async_engine(
+        url,
+        connect_args=connect_args,
+        **engine_options(settings, queue_pool=InstrumentedAsyncQueuePool),
+    )
+
+
+class LazySession(orm.Session):
+    """Session bound to `get_engine()`
+
+    Engine (and with it DB driver) is created when the first session
+    actually needs a connection, not when this module is imported.
+    """
+
+    def get_bind(self, mapper=None, **kwargs):
+        return get_engine()
+
+
+class LazyAsyncSession(orm.Session):
+    """Sync part of async sessions, bound to `get_async_engine()`"""
+
+    def get_bind(self, mapper=None, **kwargs):
+        return get_async_engine().sync_engine
+
+
+Session = sessionmaker(class_=LazySession, expire_on_commit=False)
+
+AsyncSession = async_sessionmaker(
+    sync_session_class=LazyAsyncSession, expire_on_commit=False
+)
+
+
+def __getattr__(name: str):
+    # `engine` used to be created on import
+    if name == "engine":
+        return get_engine()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_pool_stats(engine: Engine | AsyncEngine | None = None) -> dict:
+    """Returns connection pool usage of current process
+
+    Defaults to the sync engine; endpoints use `get_async_engine()`.
+    Empty dictionary is returned when pooling is disabled.
+    """
+    pool = (engine or get_engine()).pool
+    if not isinstance(pool, InstrumentedQueuePool):
+        return {}
+
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        **pool.stats.as_dict(),
+    }
@@ -0,0 +1,211 @@
+"""Versioned schema migrations of the tables auth server relies on
+
+Migrations are applied in order by `auth-cli db migrate`; applied versions
+are recorded in `auth_server_migrations` table. Each migration must be
+idempotent i.e. safe to run against a schema which already has its changes
+(e.g. schema created by `Base.metadata.create_all`).
+"""
+import logging
+from dataclasses import dataclass
+
+from sqlalchemy import Connection, text
+
+logger = logging.getLogger(__name__)
+
+# key of the advisory lock held while migrating, so that replicas started
+# at the same time do not migrate concurrently
+MIGRATIONS_LOCK_KEY = 0x61757468  # "auth"
+
+
+class MigrationError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Check:
+    """Query selecting values which prevent the migration, e.g. duplicates
+    which a unique index cannot be built over; `message` says what they are
+    """
+
+    query: str
+    message: str
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    statements: tuple[str, ...]
+    checks: tuple[Check, ...] = ()
+
+
+def add_primary_key(table: str, *columns: str) -> tuple[str, ...]:
+    """Statements adding primary key to association table
+
+    Duplicate and incomplete rows, which were possible without the key,
+    are removed first.
+    """
+    cols = ", ".join(columns)
+    same_row = " AND ".join(f"a.{col} = b.{col}" for col in columns)
+    incomplete = " OR ".join(f"{col} IS NULL" for col in columns)
+
+    return (
+        f"DELETE FROM {table} WHERE {incomplete}",
+        f"DELETE FROM {table} a USING {table} b WHERE a.ctid < b.ctid AND {same_row}",
+        f"""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = '{table}'::regclass AND contype = 'p'
+            ) THEN
+                ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({cols});
+            END IF;
+        END $$
+        """,
+    )
+
+
+MIGRATIONS = (
+    Migration(
+        version=1,
+        description="Lookup indexes of users and keys of association tables",
+        checks=(
+            Check(
+                "SELECT username FROM users GROUP BY username"
+                " HAVING count(*) > 1 ORDER BY username",
+                "Usernames shared by several users, rename all but one of each",
+            ),
+        ),
+        statements=(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username ON users (username)",
+            "CREATE INDEX IF NOT EXISTS ix_users_email ON users (email)",
+            *add_primary_key("users_roles", "user_id", "role_id"),
+            "CREATE INDEX IF NOT EXISTS ix_users_roles_role_id ON users_roles (role_id)",
+            *add_primary_key("users_groups", "user_id", "group_id"),
+            "CREATE INDEX IF NOT EXISTS ix_users_groups_group_id"
+            " ON users_groups (group_id)",
+            *add_primary_key("roles_permissions", "role_id", "permission_id"),
+            "CREATE INDEX IF NOT EXISTS ix_roles_permissions_permission_id"
+            " ON roles_permissions (permission_id)",
+        ),
+    ),
+    Migration(
+        version=2,
+        description="Refresh tokens",
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS refresh_tokens (
+                id SERIAL PRIMARY KEY,
+                token_hash VARCHAR(64) NOT NULL,
+                family_id UUID NOT NULL,
+                user_id UUID NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+                created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+                used_at TIMESTAMP WITH TIME ZONE,
+                revoked_at TIMESTAMP WITH TIME ZONE
+            )
+            """,
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_refresh_tokens_token_hash"
+            " ON refresh_tokens (token_hash)",
+            "CREATE INDEX IF NOT EXISTS ix_refresh_tokens_family_id"
+            " ON refresh_tokens (family_id)",
+            "CREATE INDEX IF NOT EXISTS ix_refresh_tokens_user_id"
+            " ON refresh_tokens (user_id)",
+        ),
+    ),
+    Migration(
+        version=3,
+        description="Revoked tokens",
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS revoked_tokens (
+                id SERIAL PRIMARY KEY,
+                jti VARCHAR(64),
+                user_id UUID,
+                revoked_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                expires_at TIMESTAMP WITH TIME ZONE,
+                CONSTRAINT revoked_tokens_jti_or_user_check
+                    CHECK (jti IS NOT NULL OR user_id IS NOT NULL)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_revoked_tokens_jti ON revoked_tokens (jti)",
+            "CREATE INDEX IF NOT EXISTS ix_revoked_tokens_user_id"
+            " ON revoked_tokens (user_id)",
+        ),
+    ),
+)
+
+
+def current_version(conn: Connection) -> int:
+    """Returns version of the latest applied migration, 0 if none"""
+    exists = conn.execute(
+        text("SELECT to_regclass('auth_server_migrations') IS NOT NULL")
+    ).scalar()
+    if not exists:
+        return 0
+
+    version = conn.execute(text("SELECT max(version) FROM auth_server_migrations"))
+
+    return version.scalar() or 0
+
+
+def missing_tables(conn: Connection, *tables: str) -> list[str]:
+    """Returns those of given tables which do not exist"""
+    stmt = text("SELECT to_regclass(:table) IS NULL")
+
+    return [table for table in tables if conn.execute(stmt, {"table": table}).scalar()]
+
+
+def migrate(conn: Connection) -> list[Migration]:
+    """Applies pending migrations, each in its own transaction
+
+    Returns applied migrations. Raises `MigrationError` if checks of
+    a migration find rows it cannot be applied to; migrations before
+    that one remain applied.
+    """
+    applied = []
+    conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+    try:
+        conn.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS auth_server_migrations ("
+                " version INTEGER PRIMARY KEY,"
+                " description TEXT NOT NULL,"
+                " applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())"
+            )
+        )
+        conn.commit()
+
+        version = current_version(conn)
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+
+            logger.info("Applying migration %s", migration.version)
+            for check in migration.checks:
+                values = conn.execute(text(check.query)).scalars().all()
+                if values:
+                    raise MigrationError(
+                        f"Migration {migration.version} cannot be applied."
+                        f" {check.message}: {', '.join(map(str, values))}"
+                    )
+            for statement in migration.statements:
+                conn.execute(text(statement))
+            conn.execute(
+                text(
+                    "INSERT INTO auth_server_migrations (version, description)"
+                    " VALUES (:version, :description)"
+                ),
+                {"version": migration.version, "description": migration.description},
+            )
+            conn.commit()
+            applied.append(migration)
+    finally:
+        conn.rollback()
+        conn.execute(
+            text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY}
+        )
+        conn.commit()
+
+    return applied
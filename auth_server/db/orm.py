@@ -41,11 +41,14 @@ roles_permissions_association = Table(
     Column(
         "role_id",
         ForeignKey("roles.id"),
+        primary_key=True,
     ),
     Column(
         "permission_id",
         ForeignKey("permissions.id"),
+        primary_key=True,
     ),
+    Index("ix_roles_permissions_permission_id", "permission_id"),
 )
 
 user_groups_association = Table(
@@ -54,24 +57,31 @@ user_groups_association = Table(
     Column(
         "user_id",
         ForeignKey("users.id"),
+        primary_key=True,
     ),
     Column(
         "group_id",
         ForeignKey("groups.id"),
+        primary_key=True,
     ),
+    Index("ix_users_groups_group_id", "group_id"),
 )
 
 users_roles_association = Table(
     "users_roles",
     Base.metadata,
-    Column(
-        "role_id",
-        ForeignKey("roles.id"),
-    ),
+    # primary key is (user_id, role_id), as roles are looked up by user
     Column(
         "user_id",
         ForeignKey("users.id"),
+        primary_key=True,
     ),
+    Column(
+        "role_id",
+        ForeignKey("roles.id"),
+        primary_key=True,
+    ),
+    Index("ix_users_roles_role_id", "role_id"),
 )
 
 
@@ -284,6 +294,13 @@ class User(Base):
                 return sf.folder
         return None
 
+    __table_args__ = (
+        # `/token` looks users up by username
+        Index("ix_users_username", "username", unique=True),
+        # oauth2 path looks users up by email
+        Index("ix_users_email", "email"),
+    )
+
     __mapper_args__ = {"confirm_deleted_rows": False}
 
 
@@ -410,3 +427,83 @@ class Ownership(Base):
             f"{self.resource_type}:{self.resource_id} -> "
             f"{self.owner_type}:{self.owner_id})>"
         )
+
+
+class RevokedToken(Base):
+    """
+    Revoked access tokens.
+
+    Row revokes either one token (by its `jti` claim) or all tokens of
+    the user issued before `revoked_at`. Used by `/verify` in stateless
+    mode, which does not look up users in DB.
+    """
+
+    __tablename__ = "revoked_tokens"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    jti: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)
+    user_id: Mapped[UUID | None] = mapped_column(
+        PGUUID(as_uuid=True), nullable=True, index=True
+    )
+    revoked_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    # row is not needed once all tokens it revokes are expired
+    expires_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+
+    __table_args__ = (
+        CheckConstraint(
+            "jti IS NOT NULL OR user_id IS NOT NULL",
+            name="revoked_tokens_jti_or_user_check",
+        ),
+    )
+
+    def __repr__(self):
+        return (
+            f"<RevokedToken(id={self.id}, jti={self.jti}, user_id={self.user_id})>"
+        )
+
+
+class RefreshToken(Base):
+    """
+    Refresh tokens, exchanged for new access tokens via `/token/refresh`.
+
+    Only keyed hash of the token is stored. Each refresh token is used
+    once: it is replaced by a new one of the same family (all tokens
+    descending from one login). Use of an already replaced token means
+    it was stolen, and revokes the whole family.
+    """
+
+    __tablename__ = "refresh_tokens"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    token_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    family_id: Mapped[UUID] = mapped_column(
+        PGUUID(as_uuid=True), nullable=False, index=True
+    )
+    user_id: Mapped[UUID] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    expires_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+    # set once the token is exchanged for a new one
+    used_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    revoked_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+
+    __table_args__ = (
+        # `/token/refresh` looks tokens up by hash
+        Index("ix_refresh_tokens_token_hash", "token_hash", unique=True),
+    )
+
+    def __repr__(self):
+        return f"<RefreshToken(id={self.id}, family_id={self.family_id})>"
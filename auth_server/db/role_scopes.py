@@ -0,0 +1,86 @@
+"""In-process map from role ID to scopes (permission codenames) of the role
+
+Permissions of roles change rarely, yet every token mint needs user's
+scopes. Instead of joining permission tables on every login, the whole
+role -> scopes map is loaded once and user's scopes are computed as a union
+of scopes of his/her roles.
+
+Scope sets are interned: users with the same combination of roles (and
+roles with the same permissions) share one frozenset.
+
+The map is invalidated when roles or permissions are changed via
+`auth_server.db.api`; roles created by other processes are picked up as
+soon as a user with such a role is looked up, other changes made by other
+processes after `scope_cache_ttl` seconds.
+"""
+import time
+import uuid
+from functools import lru_cache
+from typing import Iterable
+
+from auth_server import scopes
+from auth_server.config import get_settings
+
+ALL_SCOPES = frozenset(scopes.SCOPES)
+
+
+class RoleScopes:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._roles: dict[uuid.UUID, frozenset[str]] = {}
+        # role IDs combination -> scopes
+        self._combinations: dict[frozenset[uuid.UUID], frozenset[str]] = {}
+        self._interned: dict[frozenset[str], frozenset[str]] = {}
+        self._loaded_at: float | None = None
+
+    def is_stale(self) -> bool:
+        if self._loaded_at is None:
+            return True
+
+        return time.monotonic() - self._loaded_at > self.ttl
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+
+    def knows(self, role_ids: Iterable[uuid.UUID]) -> bool:
+        """Tells whether all given roles are in the map"""
+        return all(role_id in self._roles for role_id in role_ids)
+
+    def load(self, rows: Iterable[tuple[uuid.UUID, str | None]]) -> None:
+        """Replaces the map with given (role ID, permission codename) rows
+
+        Codename is None for roles without permissions.
+        """
+        codenames: dict[uuid.UUID, set[str]] = {}
+        for role_id, codename in rows:
+            items = codenames.setdefault(role_id, set())
+            if codename is not None:
+                items.add(codename)
+
+        self._interned = {ALL_SCOPES: ALL_SCOPES}
+        self._combinations = {}
+        self._roles = {
+            role_id: self._intern(frozenset(items))
+            for role_id, items in codenames.items()
+        }
+        self._loaded_at = time.monotonic()
+
+    def scopes_for(self, role_ids: Iterable[uuid.UUID]) -> frozenset[str]:
+        key = frozenset(role_ids)
+        result = self._combinations.get(key)
+        if result is None:
+            result = self._intern(
+                frozenset().union(*(self._roles.get(role_id, ()) for role_id in key))
+            )
+            self._combinations[key] = result
+
+        return result
+
+    def _intern(self, items: frozenset[str]) -> frozenset[str]:
+        return self._interned.setdefault(items, items)
+
+
+@lru_cache()
+def get_role_scopes() -> RoleScopes:
+    """Map of the process, created on first use"""
+    return RoleScopes(ttl=get_settings().scope_cache_ttl)
@@ -0,0 +1,98 @@
+"""Minimal ASGI handler of `GET /verify`
+
+nginx's `auth_request` calls `/verify` before every proxied request and
+looks only at the status code (and identity headers, if enabled). This
+handler sits in front of the FastAPI app and answers such requests itself,
+without routing, dependency resolution and exception handlers: responses
+have empty bodies and, unless identity headers are enabled, prebuilt
+headers. Requests it does not handle (other paths, token renewal) are
+passed on to the app.
+"""
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from fastapi import HTTPException
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from auth_server import utils
+from auth_server.config import get_settings
+
+if TYPE_CHECKING:
+    from auth_server.main import VerifiedToken
+
+EMPTY_HEADERS = ((b"content-length", b"0"),)
+OK: Message = {"type": "http.response.start", "status": 200, "headers": EMPTY_HEADERS}
+UNAUTHORIZED: Message = {
+    "type": "http.response.start",
+    "status": 401,
+    "headers": EMPTY_HEADERS,
+}
+EMPTY_BODY: Message = {"type": "http.response.body", "body": b""}
+
+
+class VerifyFastPath:
+    """ASGI middleware answering `GET /verify` when `verify_fast_path` is on
+
+    `verify` checks the token, the same way `/verify` route does (see
+    `auth_server.main.verify_cached`).
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        verify: Callable[[str], Awaitable["VerifiedToken"]],
+        path: str = "/verify",
+    ):
+        self.app = app
+        self.verify = verify
+        self.path = path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        settings = get_settings()
+        if (
+            not settings.verify_fast_path
+            or scope["type"] != "http"
+            or scope["path"] != self.path
+            or scope["method"] != "GET"
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        token = utils.get_token(request)
+        if not token:
+            await respond(send, UNAUTHORIZED)
+            return
+
+        try:
+            verified = await self.verify(token)
+        except HTTPException:
+            await respond(send, UNAUTHORIZED)
+            return
+
+        if verified.error:
+            await respond(send, UNAUTHORIZED)
+            return
+
+        renew_before = settings.token_renew_before_minutes * 60
+        if renew_before and utils.from_cookie(request) == token:
+            ttl = verified.ttl()
+            if ttl is not None and ttl <= renew_before:
+                # fresh cookie is issued by the route; outcome of the check
+                # is cached by now, so the route does not repeat it
+                await self.app(scope, receive, send)
+                return
+
+        if not settings.verify_identity_headers:
+            await respond(send, OK)
+            return
+
+        headers = list(EMPTY_HEADERS)
+        for name, value in utils.identity_headers(verified.claims).items():
+            headers.append((name.lower().encode("latin-1"), value.encode("latin-1")))
+        await respond(send, {**OK, "headers": headers})
+
+
+async def respond(send: Send, start: Message) -> None:
+    await send(start)
+    await send(EMPTY_BODY)
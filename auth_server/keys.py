@@ -0,0 +1,137 @@
+"""Keys used to sign and verify access tokens
+
+Keys are read and parsed once per process. With HS* algorithms tokens are
+signed and verified with `secret_key`. With RS*/ES* algorithms tokens are
+signed with the private key from `private_key_file`; they are verified
+with its public key or with any of the keys from `public_key_files` (e.g.
+public keys of previous, rotated out, private keys). Token's `kid` header
+tells which key to use. Public keys are published as JWKS, so that other
+services can verify tokens locally.
+"""
+import json
+import base64
+import hashlib
+from functools import lru_cache
+from typing import Any
+
+import jwt
+from jwt.algorithms import get_default_algorithms
+from cryptography.hazmat.primitives.serialization import (
+    load_pem_private_key,
+    load_pem_public_key,
+)
+
+from auth_server.config import Settings, get_settings
+
+# members of the JWK, per key type, used to compute its thumbprint (RFC 7638)
+THUMBPRINT_MEMBERS = {
+    "RSA": ("e", "kty", "n"),
+    "EC": ("crv", "kty", "x", "y"),
+}
+
+
+def is_symmetric(algorithm: str) -> bool:
+    return algorithm.startswith("HS")
+
+
+def to_jwk(public_key: Any, algorithm: str) -> dict:
+    return get_default_algorithms()[algorithm].to_jwk(public_key, as_dict=True)
+
+
+def thumbprint(jwk: dict) -> str:
+    """Returns RFC 7638 thumbprint of the key, used as default `kid`"""
+    members = THUMBPRINT_MEMBERS[jwk["kty"]]
+    canonical = json.dumps(
+        {name: jwk[name] for name in members}, separators=(",", ":"), sort_keys=True
+    )
+    digest = hashlib.sha256(canonical.encode()).digest()
+
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+class KeyRing:
+    def __init__(
+        self,
+        algorithm: str,
+        signing_key: Any,
+        kid: str | None = None,
+        verification_keys: dict[str | None, Any] | None = None,
+        jwks: list[dict] | None = None,
+    ):
+        self.algorithm = algorithm
+        self.signing_key = signing_key
+        self.kid = kid
+        self.verification_keys = verification_keys or {kid: signing_key}
+        self.jwks = {"keys": jwks or []}
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "KeyRing":
+        algorithm = settings.token_algorithm.value
+
+        if is_symmetric(algorithm):
+            return cls(
+                algorithm=algorithm,
+                signing_key=settings.secret_key,
+                kid=settings.key_id,
+            )
+
+        if settings.private_key_file is None:
+            raise ValueError(f"{algorithm} algorithm requires private_key_file")
+
+        private_key = load_pem_private_key(
+            settings.private_key_file.read_bytes(), password=None
+        )
+        public_keys = [private_key.public_key()] + [
+            load_pem_public_key(path.read_bytes())
+            for path in settings.public_key_files
+        ]
+
+        kid = None
+        jwks = []
+        verification_keys = {}
+        for public_key in public_keys:
+            jwk = to_jwk(public_key, algorithm)
+            if kid is None:
+                # first one is the signing key
+                kid = settings.key_id or thumbprint(jwk)
+                key_id = kid
+            else:
+                key_id = thumbprint(jwk)
+            jwks.append({**jwk, "kid": key_id, "use": "sig", "alg": algorithm})
+            verification_keys[key_id] = public_key
+
+        return cls(
+            algorithm=algorithm,
+            signing_key=private_key,
+            kid=kid,
+            verification_keys=verification_keys,
+            jwks=jwks,
+        )
+
+    @property
+    def headers(self) -> dict | None:
+        """JWT headers to add to signed tokens"""
+        if self.kid is None:
+            return None
+
+        return {"kid": self.kid}
+
+    def verification_key(self, token: str) -> Any:
+        """Returns key to verify the token with, based on its `kid` header
+
+        Tokens without `kid` are verified with the signing key.
+        Raises `jwt.InvalidTokenError` if the key is unknown.
+        """
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            kid = self.kid
+
+        try:
+            return self.verification_keys[kid]
+        except KeyError:
+            raise jwt.InvalidTokenError(f"Unknown kid {kid}")
+
+
+@lru_cache()
+def get_keyring() -> KeyRing:
+    return KeyRing.from_settings(get_settings())
@@ -0,0 +1,113 @@
+"""Logging which stays off the request path
+
+Handlers which write (console, files) run in a background thread: the
+configuration in `etc/logging.yml` puts `QueueHandler` in front of them,
+so that logging a record in a request only appends it to a queue.
+Messages use %-style arguments and are formatted by the background thread,
+if at all. Events which may happen on every request (failed logins,
+access log) go through `RateLimitFilter`, so that a flood of them is
+reduced to a few records per second.
+"""
+import atexit
+import logging
+import logging.config
+import logging.handlers
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Hashable
+
+import yaml
+
+DEFAULT_CONFIG = Path("etc/logging.yml")
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Queue handler which never blocks the logging thread
+
+    Records are put on the queue as they are; message is formatted by the
+    handlers of the listener, in its thread. That is fine as long as the
+    queue does not cross process boundaries. If the queue is bounded and
+    full, records are dropped and counted in `dropped`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimitFilter(logging.Filter):
+    """Passes at most `rate` records of the same event per `per` seconds
+
+    Event is the logger name and message template, so e.g. failed logins
+    of different users are one event. Records over the limit are dropped;
+    the first record of the event which passes after that tells how many
+    were dropped. Attached to a logger, the filter applies to records
+    logged by that very logger; attached to a handler, to all its records.
+    """
+
+    def __init__(self, rate: int = 10, per: float = 1.0, maxsize: int = 1024):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self.maxsize = maxsize
+        # event -> (window start, records in window, records suppressed)
+        self._events: dict[Hashable, tuple[float, int, int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool | logging.LogRecord:
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._events.get(key, (now, 0, 0))
+            if now - started >= self.per:
+                started, count = now, 0
+            if count >= self.rate:
+                self._events[key] = (started, count, suppressed + 1)
+                return False
+            if len(self._events) >= self.maxsize and key not in self._events:
+                # many distinct templates, e.g. f-strings; start over
+                self._events.clear()
+            self._events[key] = (started, count + 1, 0)
+
+        if not suppressed:
+            return record
+        # rare, message is formatted here only once per window
+        summary = logging.makeLogRecord(record.__dict__)
+        summary.msg = f"{record.getMessage()} ({suppressed} similar suppressed)"
+        summary.args = None
+        return summary
+
+
+def load_config(path: Path = DEFAULT_CONFIG) -> dict:
+    return yaml.safe_load(path.read_text())
+
+
+def start_listeners() -> None:
+    """Starts listeners of queue handlers set up by `dictConfig`
+
+    `dictConfig` creates the listener, but does not start it. Listeners are
+    stopped at exit, after records left in the queue are handled.
+    """
+    for name in logging.getHandlerNames():
+        handler = logging.getHandlerByName(name)
+        listener = getattr(handler, "listener", None)
+        if listener is None or listener._thread is not None:
+            continue
+        listener.start()
+        atexit.register(listener.stop)
+
+
+def configure(path: Path = DEFAULT_CONFIG) -> None:
+    logging.config.dictConfig(load_config(path))
+    start_listeners()
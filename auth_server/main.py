@@ -1,78 +1,370 @@
+import asyncio
 import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from datetime import datetime, timedelta, UTC
+from typing import NamedTuple
 from uuid import UUID
 
-from sqlalchemy.exc import OperationalError, NoResultFound
-from fastapi import FastAPI, HTTPException, Response, Request, status, APIRouter
+from sqlalchemy.exc import DBAPIError, NoResultFound
+from fastapi import FastAPI, HTTPException, Response, Request, status
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.security import OAuth2PasswordBearer
 import jwt
 
-from auth_server.auth import authenticate, create_token
-from auth_server import schema
-from auth_server.config import get_settings
+from auth_server.auth import async_authenticate, create_token, reissue_token
+from auth_server import schema, passwords, refresh_tokens
+from auth_server.config import get_settings, VerifyMode, PoolMode
 from auth_server import utils
-from auth_server.db.engine import Session
-from auth_server.db import api as dbapi
+from auth_server.cache import TTLCache, token_key
+from auth_server.fast_verify import VerifyFastPath
+from auth_server.throttle import LoginThrottle
+from auth_server.keys import get_keyring
+from auth_server.db.engine import AsyncSession, get_async_engine, get_pool_stats
+from auth_server.db import async_api, migrations
+from auth_server.revocation import revocations
 
-app = FastAPI()
 
-settings = get_settings()
+async def check_tables():
+    """Fails startup if tables needed by enabled features do not exist
+
+    Tables are created by `auth-cli db migrate`, not by workers.
+    """
+    settings = get_settings()
+    tables = []
+    if settings.verify_mode == VerifyMode.STATELESS:
+        tables.append("revoked_tokens")
+    if settings.refresh_token_expire_minutes:
+        tables.append("refresh_tokens")
+    if not tables:
+        return
+
+    engine = get_async_engine()
+    async with engine.connect() as conn:
+        missing = await conn.run_sync(migrations.missing_tables, *tables)
+    if missing:
+        # worker is not going to start, connections are bound to its loop
+        await engine.dispose()
+        raise RuntimeError(
+            f"Missing tables: {', '.join(missing)}; run `auth-cli db migrate`"
+        )
+
+
+async def load_revocations():
+    async with AsyncSession() as db_session:
+        await revocations.refresh(db_session)
+
+
+async def refresh_revocations():
+    while True:
+        await asyncio.sleep(get_settings().revocation_refresh_interval)
+        try:
+            async with AsyncSession() as db_session:
+                if await revocations.refresh(db_session):
+                    # cached outcomes may be stale now
+                    get_verify_cache().clear()
+        except Exception:
+            logger.exception("Failed to refresh token revocations")
+
+
+def worker_stats() -> dict[str, dict]:
+    """Usage of DB pool, caches and throttles of this worker since start"""
+    stats = {"db_pool": get_pool_stats(get_async_engine())}
+    for name, item in [
+        ("verify_cache", get_verify_cache()),
+        ("username_throttle", get_username_throttle()),
+        ("address_throttle", get_address_throttle()),
+    ]:
+        stats[name] = {**item.stats.as_dict(), "size": len(item)}
+
+    return stats
+
+
+async def log_stats():
+    while True:
+        await asyncio.sleep(get_settings().stats_log_interval)
+        logger.info("Worker %d stats: %s", os.getpid(), worker_stats())
+
+
+async def warm_up():
+    """Prepares worker for serving requests
+
+    Fills async DB pool, loads role -> scopes map, signing keys and
+    password hashing context. Failures are only logged: worker can still
+    serve requests, just the first ones take longer.
+    """
+    started = time.perf_counter()
+    settings = get_settings()
+    get_keyring()
+    passwords.get_context()
+    passwords.get_executor()
+    if settings.login_dummy_verify:
+        passwords.dummy_hash()
+
+    try:
+        if settings.db_pool_mode == PoolMode.QUEUE:
+            engine = get_async_engine()
+            # held at the same time, otherwise pool would hand out
+            # the same connection over and over
+            connections = await asyncio.gather(
+                *(engine.connect().start() for _ in range(settings.db_pool_size))
+            )
+            for connection in connections:
+                await connection.close()
+
+        async with AsyncSession() as db_session:
+            await async_api.load_role_scopes(db_session)
+    except Exception:
+        logger.exception("Failed to warm up DB connections")
+        return
+
+    elapsed = time.perf_counter() - started
+    logger.info("Worker warmed up in %.0f ms", elapsed * 1000)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = get_settings()
+    tasks = []
+    await check_tables()
+    if settings.warm_up:
+        await warm_up()
+    if settings.stats_log_interval:
+        tasks.append(asyncio.create_task(log_stats()))
+    if settings.verify_mode == VerifyMode.STATELESS:
+        await load_revocations()
+        tasks.append(asyncio.create_task(refresh_revocations()))
+
+    yield
+
+    for task in tasks:
+        task.cancel()
+    passwords.shutdown()
+    # pooled asyncpg connections are bound to the event loop
+    # which is about to be closed
+    await get_async_engine().dispose()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 logger = logging.getLogger(__name__)
 
+# DB is unreachable or fails; asyncpg raises connection errors (OSError,
+# TimeoutError) as they are, without wrapping them into DBAPIError
+DB_ERRORS = (DBAPIError, OSError, asyncio.TimeoutError)
+
+
+# state of the worker is created on first use, not on import, so that
+# importing the app does not require settings
+@lru_cache()
+def get_verify_cache() -> TTLCache:
+    """Outcomes of token checks, see `verify_cached`"""
+    settings = get_settings()
+
+    return TTLCache(maxsize=settings.verify_cache_size, ttl=settings.verify_cache_ttl)
+
+
+def login_throttle(max_attempts: int) -> LoginThrottle:
+    settings = get_settings()
+
+    return LoginThrottle(
+        max_attempts=max_attempts,
+        window=settings.login_throttle_window,
+        lockout=settings.login_throttle_lockout,
+        max_lockout=settings.login_throttle_max_lockout,
+        maxsize=settings.login_throttle_size,
+    )
+
+
+@lru_cache()
+def get_username_throttle() -> LoginThrottle:
+    return login_throttle(get_settings().login_throttle_attempts)
+
+
+@lru_cache()
+def get_address_throttle() -> LoginThrottle:
+    return login_throttle(get_settings().login_throttle_address_attempts)
 
-@app.post("/token")
+
+@lru_cache()
+def get_renewed_tokens() -> TTLCache:
+    """`jti` of tokens which were already renewed, see `renew_token`"""
+    settings = get_settings()
+
+    return TTLCache(
+        maxsize=settings.token_renew_cache_size,
+        ttl=settings.token_expire_minutes * 60,
+    )
+
+
+# tokens being verified right now, see `verify_token_once`
+verifying: dict[bytes, asyncio.Future] = {}
+
+
+def throttle_login(request: Request, username: str) -> None:
+    """Raises 429 if there were too many login attempts recently"""
+    retry_after = get_username_throttle().hit(username)
+    if request.client is not None:
+        address = request.client.host
+        retry_after = max(retry_after, get_address_throttle().hit(address))
+
+    if retry_after > 0:
+        logger.warning("Too many login attempts for '%s'", username)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+@app.post("/token", response_model=schema.Token)
 async def token_endpoint(
-    response: Response,
+    request: Request,
     creds: schema.UserCredentials,
-) -> schema.Token:
+) -> Response:
     """
     Retrieve JWT access token
     """
+    throttle_login(request, creds.username)
+
     try:
-        with Session() as db_session:
-            user: None | schema.User = authenticate(
+        async with AsyncSession() as db_session:
+            user: None | schema.User = await async_authenticate(
                 db_session, username=creds.username, password=creds.password
             )
+            refresh_token = None
+            if user is not None and get_settings().refresh_token_expire_minutes:
+                refresh_token = await async_api.create_refresh_token(
+                    db_session, user.id, refresh_token_expires_at()
+                )
     except ValueError as ex:
-        logger.debug(f"ValueError: {ex}")
+        logger.debug("ValueError: %s", ex)
         raise HTTPException(status_code=400, detail=str(ex)) from ex
+    except passwords.PasswordQueueFull as ex:
+        logger.warning("Password workers are saturated")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress",
+            headers={"Retry-After": "1"},
+        ) from ex
 
     if user is None:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    access_token = create_token(user)
+    get_username_throttle().reset(creds.username)
 
-    response.set_cookie("access_token", access_token)
-    response.headers["Authorization"] = f"Bearer {access_token}"
+    return issue_tokens(user, refresh_token)
 
-    return schema.Token(access_token=access_token)
 
+@app.post("/token/refresh", response_model=schema.Token)
+async def refresh_token_endpoint(body: schema.RefreshTokenRequest) -> Response:
+    """
+    Exchange refresh token for new access and refresh tokens
 
-@app.get("/verify")
-async def verify_endpoint(request: Request) -> Response:
+    Each refresh token can be exchanged only once.
     """
-    Returns 200 OK response if and only if JWT token is valid
+    if not get_settings().refresh_token_expire_minutes:
+        raise HTTPException(status_code=404, detail="Refresh tokens are disabled")
 
-    JWT token is read either from authorization header or from
-    cookie header. Token is considered valid if and only if both
-    of the following conditions are true:
-    - token was signed with PAPERMERGE__SECURITY__SECRET_KEY
-    - User with user_id from the token is present in database
+    try:
+        async with AsyncSession() as db_session:
+            user_id, refresh_token = await async_api.rotate_refresh_token(
+                db_session, body.refresh_token, refresh_token_expires_at()
+            )
+            user = await async_api.get_user_by_id(db_session, user_id)
+    except refresh_tokens.RefreshTokenReused as ex:
+        logger.warning("Reused refresh token, its family is revoked")
+        raise HTTPException(status_code=401, detail="Unauthorized") from ex
+    except (refresh_tokens.InvalidRefreshToken, NoResultFound) as ex:
+        raise HTTPException(status_code=401, detail="Unauthorized") from ex
+
+    return issue_tokens(user, refresh_token)
+
+
+def refresh_token_expires_at() -> datetime:
+    minutes = get_settings().refresh_token_expire_minutes
+
+    return datetime.now(UTC) + timedelta(minutes=minutes)
+
+
+def issue_tokens(user: schema.User, refresh_token: str | None = None) -> Response:
+    """Response with `schema.Token` body, access token also set as cookie
+
+    Body is rendered by orjson straight from dict, FastAPI does not
+    validate and encode it again as it would do with returned model.
     """
-    logger.debug("Verify endpoint")
-    token = utils.get_token(request)
+    access_token = create_token(user)
+    response = ORJSONResponse(
+        {
+            "access_token": access_token,
+            "token_type": "bearer",
+            "refresh_token": refresh_token,
+        },
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    response.set_cookie(get_settings().cookie_name, access_token)
 
-    if not token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated"
-        )
+    return response
+
+
+@app.get("/.well-known/jwks.json")
+async def jwks_endpoint() -> Response:
+    """
+    Public keys which access tokens can be verified with
+
+    Empty for HS* algorithms, as their key is secret.
+    """
+    return JSONResponse(
+        get_keyring().jwks,
+        headers={"Cache-Control": f"public, max-age={get_settings().jwks_max_age}"},
+    )
+
+
+class VerifiedToken(NamedTuple):
+    claims: dict
+    # reason why token is not accepted
+    error: str | None = None
+
+    def ttl(self) -> float | None:
+        """Number of seconds until token expires"""
+        if "exp" not in self.claims:
+            return None
+
+        return self.claims["exp"] - time.time()
+
+    def is_expired(self) -> bool:
+        ttl = self.ttl()
+        return ttl is not None and ttl <= 0
+
+
+async def verify_token(token: str) -> VerifiedToken:
+    """Decodes the token and checks that its user is present in DB
+
+    In stateless mode, instead of looking up the user in DB, the token is
+    checked against in-memory revocation list.
+
+    Raises 401 HTTPException if token cannot be decoded, or if DB
+    lookup cannot be performed.
+    """
+    stateless = get_settings().verify_mode == VerifyMode.STATELESS
+    keyring = get_keyring()
     try:
         decoded_token = jwt.decode(
             token,
-            settings.secret_key,
-            algorithms=[settings.token_algorithm],
+            keyring.verification_key(token),
+            algorithms=[keyring.algorithm],
+            options={"require": ["exp"]} if stateless else None,
+        )
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token expired",
         )
-    except jwt.DecodeError:
+    except jwt.InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token",
@@ -92,21 +384,169 @@ async def verify_endpoint(request: Request) -> Response:
             detail=f"user_id value is None",
         )
 
+    if stateless:
+        if revocations.is_revoked(decoded_token):
+            return VerifiedToken(claims=decoded_token, error="Token revoked")
+
+        return VerifiedToken(claims=decoded_token)
+
     try:
-        with Session() as db_session:
-            user = dbapi.get_user_uuid(db_session, UUID(user_id))
-    except OperationalError as exc:
+        async with AsyncSession() as db_session:
+            user_exists = await async_api.user_exists(db_session, UUID(user_id))
+    except DB_ERRORS as exc:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"DB operation error {exc}",
         )
-    except NoResultFound:
-        user = None
 
-    if user is None:
+    if not user_exists:
+        return VerifiedToken(
+            claims=decoded_token, error=f"User with ID {user_id} not found in DB"
+        )
+
+    return VerifiedToken(claims=decoded_token)
+
+
+async def verify_token_once(token: str, cache_key: bytes) -> VerifiedToken:
+    """Verifies the token, sharing the outcome with concurrent callers
+
+    Sub-requests of one page load arrive at the same time, before the first
+    of them had a chance to populate `verify_cache`; only one of them does
+    the actual work, the others wait for its result.
+    """
+    task = verifying.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(verify_token(token))
+        verifying[cache_key] = task
+        task.add_done_callback(lambda _: verifying.pop(cache_key, None))
+
+    return await asyncio.shield(task)
+
+
+async def verify_cached(token: str) -> VerifiedToken:
+    """Verifies the token, unless outcome of the check is in `verify_cache`
+
+    Outcome is remembered for `verify_cache_ttl` seconds (but never past
+    token's expiration time), so that all sub-requests of one page load
+    cost one decode and one DB lookup.
+
+    Raises 401 HTTPException same as `verify_token`.
+    """
+    cache_key = token_key(token)
+    verify_cache = get_verify_cache()
+    verified: VerifiedToken | None = verify_cache.get(cache_key)
+    if verified is None:
+        verified = await verify_token_once(token, cache_key)
+        verify_cache.set(cache_key, verified, ttl=verified.ttl())
+    elif verified.is_expired():
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"User with ID {user_id} not found in DB",
+            detail="Token expired",
         )
 
-    return Response(status_code=status.HTTP_200_OK)
+    return verified
+
+
+async def renew_token(cache_key: bytes, verified: VerifiedToken) -> str | None:
+    """Issues fresh token in place of the one which expires soon
+
+    Token is renewed once per worker process: concurrent and later requests
+    with the same token (same `jti`) get None. Other workers do not know
+    about it, so with several workers one token may be renewed once by each
+    of them; tokens issued that way are all valid, the browser keeps the
+    last cookie it gets.
+
+    User is read from DB, so that the fresh token carries user's current
+    scopes. In stateless mode the claims of the token are signed anew
+    instead, without DB round-trip.
+    """
+    settings = get_settings()
+    ttl = verified.ttl()
+    if ttl is None or ttl > settings.token_renew_before_minutes * 60:
+        return None
+
+    renewed_tokens = get_renewed_tokens()
+    key = verified.claims.get("jti", cache_key)
+    if renewed_tokens.get(key):
+        return None
+    # marked before the first await, concurrent requests see it
+    renewed_tokens.set(key, True, ttl=ttl)
+
+    if settings.verify_mode == VerifyMode.STATELESS:
+        return reissue_token(verified.claims)
+
+    try:
+        async with AsyncSession() as db_session:
+            user = await async_api.get_user_by_id(
+                db_session, UUID(verified.claims["sub"])
+            )
+    except (NoResultFound, *DB_ERRORS) as exc:
+        logger.warning("Token not renewed: %s", exc)
+        return None
+
+    return create_token(user)
+
+
+@app.get("/verify")
+async def verify_endpoint(request: Request) -> Response:
+    """
+    Returns 200 OK response if and only if JWT token is valid
+
+    JWT token is read either from authorization header or from
+    cookie header. Token is considered valid if and only if both
+    of the following conditions are true:
+    - token was signed with PM_SECRET_KEY (or, for RS*/ES* algorithms,
+      with one of the configured private keys)
+    - User with user_id from the token is present in database
+      (in stateless mode: token is not revoked)
+
+    With `verify_identity_headers` enabled, response carries user ID,
+    username and scopes from the token, so that upstream services behind
+    nginx do not need to decode the token again.
+
+    Outcome of the check is cached, see `verify_cached`. With
+    `verify_fast_path` enabled, requests are answered by
+    `auth_server.fast_verify.VerifyFastPath` instead.
+
+    With `token_renew_before_minutes` enabled, token read from the cookie
+    which is about to expire is replaced by a fresh one via `Set-Cookie`.
+    """
+    settings = get_settings()
+    logger.debug("Verify endpoint")
+    token = utils.get_token(request)
+
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated"
+        )
+
+    verified = await verify_cached(token)
+    if verified.error:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=verified.error,
+        )
+
+    response = Response(status_code=status.HTTP_200_OK)
+    if settings.verify_identity_headers:
+        response.headers.update(utils.identity_headers(verified.claims))
+
+    # only cookie can be replaced via response; nginx passes it on
+    if settings.token_renew_before_minutes and utils.from_cookie(request) == token:
+        fresh_token = await renew_token(token_key(token), verified)
+        if fresh_token is not None:
+            response.set_cookie(settings.cookie_name, fresh_token)
+
+    return response
+
+
+# outermost middleware, sees requests before routing
+app.add_middleware(VerifyFastPath, verify=verify_cached)
+
+
+def __getattr__(name: str):
+    # `settings` used to be read on import
+    if name == "settings":
+        return get_settings()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
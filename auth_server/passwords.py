@@ -0,0 +1,212 @@
+"""Password hashing and verification
+
+Hashing is CPU heavy by design. HTTP endpoints run it via
+`verify_password_async` and `hash_password_async` in a bounded pool of
+workers, so that the event loop keeps serving other requests (e.g. `/verify`)
+meanwhile. When there are already `password_queue_size` jobs waiting or
+running, `PasswordQueueFull` is raised right away instead of queueing more
+work.
+
+Hashing policy (scheme and cost) comes from `password_*` settings. Stored
+hashes of any known scheme are accepted; `verify_and_update` tells when
+a hash does not match the policy anymore, so that it can be replaced
+while the plain password is at hand i.e. on login.
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+from functools import lru_cache
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+from passlib.context import CryptContext
+from passlib.registry import get_crypt_handler
+
+from auth_server.config import (
+    get_settings,
+    Settings,
+    PasswordExecutor,
+    PasswordScheme,
+)
+
+logger = logging.getLogger(__name__)
+
+_executor: Executor | None = None
+# jobs submitted to the executor and not finished yet
+_pending = 0
+
+
+class PasswordQueueFull(Exception):
+    """Raised when too many password jobs are waiting for a worker"""
+
+
+# schemes whose cost grows exponentially with `rounds`
+LOG_ROUNDS_SCHEMES = {PasswordScheme.BCRYPT}
+# smallest `rounds` per scheme, benchmark starts with them
+MIN_ROUNDS = {
+    PasswordScheme.PBKDF2_SHA256: 1000,
+    PasswordScheme.ARGON2: 1,
+    PasswordScheme.BCRYPT: 4,
+}
+
+
+def context_options(settings: Settings) -> dict:
+    scheme = settings.password_scheme.value
+    options = {
+        "schemes": [scheme] + [s.value for s in PasswordScheme if s.value != scheme],
+        "default": scheme,
+        # all but the default scheme
+        "deprecated": "auto",
+    }
+    if settings.password_rounds is not None:
+        # hashes with either higher or lower cost are updated
+        options[f"{scheme}__default_rounds"] = settings.password_rounds
+        options[f"{scheme}__min_desired_rounds"] = settings.password_rounds
+        options[f"{scheme}__max_desired_rounds"] = settings.password_rounds
+    if settings.password_memory_cost is not None:
+        if settings.password_scheme != PasswordScheme.ARGON2:
+            raise ValueError("password_memory_cost applies to argon2 scheme only")
+        options[f"{scheme}__memory_cost"] = settings.password_memory_cost
+
+    return options
+
+
+@lru_cache()
+def get_context() -> CryptContext:
+    return CryptContext(**context_options(get_settings()))
+
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    return get_context().verify(password, hashed_password)
+
+
+def verify_and_update(password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Verifies password against the hash
+
+    Returns whether password is valid and, if the hash does not match
+    hashing policy anymore, new hash of the password (None otherwise).
+    """
+    return get_context().verify_and_update(password, hashed_password)
+
+
+def hash_password(password: str) -> str:
+    return get_context().hash(password)
+
+
+@lru_cache()
+def dummy_hash() -> str:
+    """Hash of random password, with the same cost as hashes of real ones"""
+    return hash_password(os.urandom(16).hex())
+
+
+def verify_dummy(password: str) -> bool:
+    """Costs as much as verification of a real password, always fails"""
+    verify_password(password, dummy_hash())
+
+    return False
+
+
+def hash_time(
+    scheme: PasswordScheme,
+    rounds: int,
+    memory_cost: int | None = None,
+    samples: int = 3,
+) -> float:
+    """Returns seconds it takes to hash a password with given cost"""
+    options = {"rounds": rounds}
+    if memory_cost is not None:
+        options["memory_cost"] = memory_cost
+    handler = get_crypt_handler(scheme.value).using(**options)
+
+    elapsed = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        handler.hash("benchmark password")
+        elapsed.append(time.perf_counter() - start)
+
+    return min(elapsed)
+
+
+def calibrate(
+    scheme: PasswordScheme,
+    target: float,
+    memory_cost: int | None = None,
+) -> tuple[int, float]:
+    """Finds `rounds` for which hashing takes about `target` seconds
+
+    Returns the rounds and measured hashing time with them.
+    """
+    rounds = MIN_ROUNDS[scheme]
+    elapsed = hash_time(scheme, rounds, memory_cost)
+    # second pass corrects for fixed per hash overhead, which dominates
+    # the first measurement
+    for _ in range(2):
+        if scheme in LOG_ROUNDS_SCHEMES:
+            estimate = rounds + round(math.log2(target / elapsed))
+        else:
+            estimate = round(rounds * target / elapsed)
+        estimate = max(estimate, MIN_ROUNDS[scheme])
+        if estimate == rounds:
+            break
+        rounds = estimate
+        elapsed = hash_time(scheme, rounds, memory_cost)
+
+    return rounds, elapsed
+
+
+def get_executor() -> Executor:
+    global _executor
+
+    if _executor is None:
+        settings = get_settings()
+        workers = settings.password_workers or os.cpu_count() or 1
+        if settings.password_executor == PasswordExecutor.PROCESS:
+            _executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            # hashlib's pbkdf2 releases the GIL, threads use all cores
+            _executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="passwords"
+            )
+
+    return _executor
+
+
+def shutdown() -> None:
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _run(func, *args):
+    global _pending
+
+    if _pending >= get_settings().password_queue_size:
+        raise PasswordQueueFull()
+
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), func, *args)
+    finally:
+        _pending -= 1
+
+
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    return await _run(verify_password, password, hashed_password)
+
+
+async def verify_and_update_async(
+    password: str, hashed_password: str
+) -> tuple[bool, str | None]:
+    return await _run(verify_and_update, password, hashed_password)
+
+
+async def verify_dummy_async(password: str) -> bool:
+    return await _run(verify_dummy, password)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run(hash_password, password)
@@ -0,0 +1,30 @@
+"""Refresh tokens
+
+Refresh tokens are random strings, not JWTs. They are looked up by their
+HMAC-SHA256 (keyed with `secret_key`), which is cheap to compute, unlike
+password hash; a leaked `refresh_tokens` table does not reveal usable
+tokens either.
+"""
+import hashlib
+import hmac
+import secrets
+
+from auth_server.config import get_settings
+
+
+class InvalidRefreshToken(Exception):
+    """Refresh token is unknown, expired or revoked"""
+
+
+class RefreshTokenReused(InvalidRefreshToken):
+    """Refresh token was already exchanged for a new one"""
+
+
+def new_token() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def token_hash(token: str) -> str:
+    key = get_settings().secret_key.encode()
+
+    return hmac.new(key, token.encode(), hashlib.sha256).hexdigest()
@@ -0,0 +1,100 @@
+"""Revoked tokens, kept in memory for `/verify` in stateless mode
+
+In stateless mode `/verify` trusts token's signature and `exp` claim and,
+instead of looking up the user in DB, checks the token against this list.
+The list is loaded in bulk on startup and then refreshed incrementally in
+background i.e. only `revoked_tokens` rows added since the previous refresh
+are fetched, by ID; writers lock the table until commit (see
+`db.api.lock_revocations`), so rows are committed in order of their IDs and
+none is skipped. Revocations are dropped once all tokens they revoke are
+expired.
+
+`iat` claim has one-second resolution, so revocation time is truncated to
+whole seconds as well: revoking all tokens of the user revokes the ones
+issued up to and including that second. A token issued in the same second
+may be a fresh login, but also one issued just before the revocation, so
+it is revoked too.
+"""
+import logging
+import math
+import time
+from datetime import datetime
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth_server.db import async_api
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationList:
+    def __init__(self):
+        # jti -> when the revocation expires
+        self.jtis: dict[str, float] = {}
+        # user ID -> (second, expiry); user's tokens issued until then are revoked
+        self.users: dict[str, tuple[int, float]] = {}
+        # highest `revoked_tokens.id` seen so far
+        self.last_id = 0
+
+    def add(
+        self,
+        jti: str | None,
+        user_id: str | None,
+        revoked_at: datetime,
+        expires_at: datetime | None = None,
+    ):
+        expires = expires_at.timestamp() if expires_at else math.inf
+        if jti is not None:
+            self.jtis[jti] = max(expires, self.jtis.get(jti, expires))
+
+        if user_id is not None:
+            second = int(revoked_at.timestamp())
+            old_second, old_expires = self.users.get(user_id, (second, expires))
+            self.users[user_id] = (max(second, old_second), max(expires, old_expires))
+
+    def is_revoked(self, claims: dict) -> bool:
+        if claims.get("jti") in self.jtis:
+            return True
+
+        revoked = self.users.get(claims.get("sub"))
+        if revoked is None:
+            return False
+
+        # tokens without `iat` were issued before revocation list existed
+        return claims.get("iat", 0) <= revoked[0]
+
+    def prune(self, now: float | None = None) -> None:
+        """Drops revocations of tokens which are expired by now"""
+        if now is None:
+            now = time.time()
+        self.jtis = {jti: exp for jti, exp in self.jtis.items() if exp > now}
+        self.users = {
+            user_id: revoked
+            for user_id, revoked in self.users.items()
+            if revoked[1] > now
+        }
+
+    async def refresh(self, session: AsyncSession) -> int:
+        """Fetches revocations added since last refresh
+
+        Returns number of fetched revocations.
+        """
+        rows = await async_api.get_revoked_tokens(session, after_id=self.last_id)
+        for row in rows:
+            user_id = str(row.user_id) if row.user_id else None
+            self.add(row.jti, user_id, row.revoked_at, row.expires_at)
+            self.last_id = max(self.last_id, row.id)
+        self.prune()
+
+        if rows:
+            logger.info("Fetched %d token revocation(s)", len(rows))
+
+        return len(rows)
+
+    def clear(self):
+        self.jtis.clear()
+        self.users.clear()
+        self.last_id = 0
+
+
+revocations = RevocationList()
@@ -1,6 +1,6 @@
 from uuid import UUID
 from enum import Enum
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, field_validator
 
 
 class User(BaseModel):
@@ -11,23 +11,51 @@ class User(BaseModel):
     home_folder_id: UUID | None = None
     inbox_folder_id: UUID | None = None
     is_superuser: bool = False
-    scopes: list[str] = []
+    scopes: frozenset[str] = frozenset()
 
     model_config = ConfigDict(from_attributes=True)
 
 
+class NewUser(BaseModel):
+    """User to be created by bulk import"""
+
+    username: str
+    email: str
+    password: str
+    first_name: str = " "
+    last_name: str = " "
+    is_superuser: bool = False
+    is_active: bool = True
+    # names of user's roles
+    roles: list[str] = []
+
+    @field_validator("roles", mode="before")
+    @classmethod
+    def split_roles(cls, value):
+        # CSV cell with space separated role names
+        if isinstance(value, str):
+            return value.split()
+        return value
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    # issued only if refresh tokens are enabled
+    refresh_token: str | None = None
 
     model_config = ConfigDict(from_attributes=True)
 
 
 class TokenData(BaseModel):
+    """Claims of access tokens; `auth.create_token` builds them as dict"""
+
     sub: str  # same as `user_id`
     preferred_username: str  # standard claim for `username`
     email: str
-    scopes: list[str] = []
+    scopes: list[str] | None = []
+    # scopes as bitmask, used instead of `scopes` in compact tokens
+    scm: str | None = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -39,6 +67,10 @@ class UserCredentials(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+
 class Group(BaseModel):
     id: UUID
     name: str
@@ -62,3 +94,14 @@ class Permission(BaseModel):
 
     # Config
     model_config = ConfigDict(from_attributes=True)
+
+
+class PermsSync(BaseModel):
+    """Outcome of syncing permissions table with scopes"""
+
+    added: list[str] = []  # codenames
+    removed: list[str] = []
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.removed)
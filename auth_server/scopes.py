@@ -53,3 +53,86 @@ SCOPES = {
     PAGE_MOVE: "Move pages from one document to another",
     PAGE_EXTRACT: "Extract pages",
 }
+
+# Compact encoding of scopes as bitmask: bit N of the mask stands for
+# SCOPE_BITS[version][N]. Published orderings must never change - to add,
+# remove or reorder scopes append a new version and bump SCOPE_BITS_VERSION.
+SCOPE_BITS_VERSION = 1
+SCOPE_BITS = {
+    1: (
+        NODE_CREATE,
+        NODE_VIEW,
+        NODE_UPDATE,
+        NODE_DELETE,
+        NODE_MOVE,
+        DOCUMENT_UPLOAD,
+        DOCUMENT_DOWNLOAD,
+        TAG_CREATE,
+        TAG_VIEW,
+        TAG_UPDATE,
+        TAG_DELETE,
+        USER_CREATE,
+        USER_VIEW,
+        USER_UPDATE,
+        USER_DELETE,
+        USER_ME,
+        GROUP_CREATE,
+        GROUP_VIEW,
+        GROUP_UPDATE,
+        GROUP_DELETE,
+        TASK_OCR,
+        OCRLANG_VIEW,
+        PAGE_VIEW,
+        PAGE_UPDATE,
+        PAGE_MOVE,
+        PAGE_EXTRACT,
+    ),
+}
+SCOPE_POSITIONS = {
+    version: {scope: index for index, scope in enumerate(ordering)}
+    for version, ordering in SCOPE_BITS.items()
+}
+
+
+def encode_mask(scopes, version: int = SCOPE_BITS_VERSION) -> int:
+    positions = SCOPE_POSITIONS[version]
+    mask = 0
+    for scope in scopes:
+        mask |= 1 << positions[scope]
+
+    return mask
+
+
+def decode_mask(mask: int, version: int = SCOPE_BITS_VERSION) -> frozenset[str]:
+    ordering = SCOPE_BITS[version]
+
+    return frozenset(
+        scope for index, scope in enumerate(ordering) if mask & (1 << index)
+    )
+
+
+def has_scope(mask: int, scope: str, version: int = SCOPE_BITS_VERSION) -> bool:
+    return bool(mask & (1 << SCOPE_POSITIONS[version][scope]))
+
+
+def encode_claim(scopes) -> str:
+    """Encodes scopes as value of compact `scm` token claim
+
+    Value has format "<version>:<hex mask>" e.g. "1:3ffffff".
+    """
+    return f"{SCOPE_BITS_VERSION}:{encode_mask(scopes):x}"
+
+
+def decode_claim(value: str) -> frozenset[str]:
+    """Decodes value of `scm` token claim, see `encode_claim`"""
+    version, mask = value.split(":")
+
+    return decode_mask(int(mask, 16), int(version))
+
+
+def from_claims(claims: dict) -> list[str] | frozenset[str]:
+    """Returns scopes of decoded token, in either encoding"""
+    if "scm" in claims:
+        return decode_claim(claims["scm"])
+
+    return claims.get("scopes", [])
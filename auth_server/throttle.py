@@ -0,0 +1,148 @@
+"""Throttling of login attempts
+
+Every login attempt is checked against a sliding window of recent attempts
+with the same key (username, client address). Once a key reaches the
+limit, it is locked out; consecutive lockouts of the same key last twice
+as long as the previous one, up to `max_lockout`. Checks happen before
+any DB lookup or password hash work, so rejected attempts are cheap.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, asdict
+from typing import Hashable
+
+
+@dataclass
+class ThrottleStats:
+    allowed: int = 0
+    rejected: int = 0
+    lockouts: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+@dataclass
+class Attempts:
+    times: deque[float] = field(default_factory=deque)
+    locked_until: float = 0
+    # consecutive lockouts, determines length of the next one
+    lockouts: int = 0
+
+
+class LoginThrottle:
+    """Sliding window limiter of attempts per key
+
+    Throttle with `max_attempts` equal to zero is disabled i.e. it allows
+    everything. At most `maxsize` keys are tracked, least recently used
+    ones are forgotten first. Keys which are locked out are forgotten only
+    when all tracked keys are locked out, so that lockouts are not flushed
+    by attempts with a few other keys. Attempts with new keys are never
+    rejected: a spray over more keys than `maxsize` may lift lockouts, but
+    cannot lock out users who did not try yet.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int,
+        window: float,
+        lockout: float,
+        max_lockout: float,
+        maxsize: int,
+    ):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.lockout = lockout
+        self.max_lockout = max_lockout
+        self.maxsize = maxsize
+        self.stats = ThrottleStats()
+        self._data: OrderedDict[Hashable, Attempts] = OrderedDict()
+        # all tracked keys were locked out, at least until then
+        self._full_until: float = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_attempts > 0 and self.maxsize > 0
+
+    def hit(self, key: Hashable) -> float:
+        """Records an attempt with given key
+
+        Returns zero if attempt is allowed, otherwise number of seconds
+        to wait before the next attempt.
+        """
+        if not self.enabled:
+            return 0
+
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._data.get(key)
+            if attempts is None:
+                if len(self._data) >= self.maxsize:
+                    self._make_room(now)
+                attempts = self._data[key] = Attempts()
+            self._data.move_to_end(key)
+
+            if attempts.locked_until > now:
+                self.stats.rejected += 1
+                return attempts.locked_until - now
+
+            while attempts.times and attempts.times[0] <= now - self.window:
+                attempts.times.popleft()
+
+            if not attempts.times and attempts.locked_until <= now - self.window:
+                # quiet for a whole window since the last lockout
+                attempts.lockouts = 0
+
+            if len(attempts.times) >= self.max_attempts:
+                attempts.lockouts += 1
+                delay = min(
+                    self.lockout * 2 ** (attempts.lockouts - 1), self.max_lockout
+                )
+                attempts.locked_until = now + delay
+                attempts.times.clear()
+                self.stats.lockouts += 1
+                self.stats.rejected += 1
+                return delay
+
+            attempts.times.append(now)
+            self.stats.allowed += 1
+
+        return 0
+
+    def _make_room(self, now: float) -> None:
+        """Forgets least recently used key, preferably one not locked out
+
+        If all keys are locked out, the least recently used one is
+        forgotten, and so is on further calls until the first lockout
+        ends, without looking for unlocked keys again. Called with the
+        lock held.
+        """
+        if now >= self._full_until:
+            for _ in range(len(self._data)):
+                key, attempts = next(iter(self._data.items()))
+                if attempts.locked_until <= now:
+                    del self._data[key]
+                    return
+                # skipped on the next call too
+                self._data.move_to_end(key)
+
+            self._full_until = min(
+                item.locked_until for item in self._data.values()
+            )
+
+        self._data.popitem(last=False)
+
+    def reset(self, key: Hashable) -> None:
+        """Forgets attempts with given key e.g. after successful login"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._full_until = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
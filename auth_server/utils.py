@@ -1,10 +1,10 @@
-from fastapi import Request, FastAPI
-from fastapi.security.utils import get_authorization_scheme_param
+from urllib.parse import quote
 
-from .config import Settings
+from fastapi import Request
+from fastapi.security.utils import get_authorization_scheme_param
 
-app = FastAPI()
-settings = Settings()
+from . import scopes
+from .config import get_settings
 
 
 def raise_on_empty(**kwargs):
@@ -29,9 +29,22 @@ def from_header(request: Request) -> str | None:
 
 
 def from_cookie(request: Request) -> str | None:
-    cookie_name = settings.cookie_name
+    cookie_name = get_settings().cookie_name
     return request.cookies.get(cookie_name, None)
 
 
 def get_token(request: Request) -> str | None:
     return from_cookie(request) or from_header(request)
+
+
+def identity_headers(claims: dict) -> dict[str, str]:
+    """Headers describing the user token was issued to
+
+    Username is percent-encoded, as header values are limited to latin-1;
+    scopes are separated by space.
+    """
+    return {
+        "X-Auth-User-Id": claims["sub"],
+        "X-Auth-Username": quote(claims.get("preferred_username", ""), safe="@+"),
+        "X-Auth-Scopes": " ".join(sorted(scopes.from_claims(claims))),
+    }
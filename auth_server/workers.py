@@ -0,0 +1,60 @@
+"""Running the app in several worker processes
+
+Workers are uvicorn servers started, watched and restarted by uvicorn's
+multiprocess supervisor; see `auth-cli serve`.
+"""
+import importlib.util
+import math
+import os
+import random
+from pathlib import Path
+
+import uvicorn
+
+from auth_server import logs
+
+APP = "auth_server.main:app"
+# cgroup v2 CPU quota, e.g. "200000 100000" means two CPUs
+CGROUP_CPU_MAX = Path("/sys/fs/cgroup/cpu.max")
+
+
+def available_cpus(cpu_max: Path = CGROUP_CPU_MAX) -> int:
+    """Number of CPUs this process may use
+
+    Unlike `os.cpu_count`, takes into account CPU quota of the container,
+    so that it does not start a worker per CPU of the host.
+    """
+    count = os.process_cpu_count() or 1
+    try:
+        quota, period = cpu_max.read_text().split()
+        return max(1, min(count, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        # no cgroup v2 or quota is "max"
+        return count
+
+
+class WorkerConfig(uvicorn.Config):
+    """uvicorn config which spreads recycling of workers
+
+    Each worker loads the config on its own, so each one ends up with
+    a slightly different `limit_max_requests` and workers started together
+    are not recycled all at once. Likewise, each worker configures logging
+    and starts its own queue listeners, see `auth_server.logs`.
+    """
+
+    def __init__(self, *args, max_requests_jitter: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_requests_jitter = max_requests_jitter
+
+    def load(self) -> None:
+        if self.limit_max_requests and self.max_requests_jitter:
+            self.limit_max_requests += random.randint(0, self.max_requests_jitter)
+        super().load()
+
+    def configure_logging(self) -> None:
+        super().configure_logging()
+        logs.start_listeners()
+
+
+def best_available(module: str, fallback: str) -> str:
+    return module if importlib.util.find_spec(module) else fallback
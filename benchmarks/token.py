@@ -0,0 +1,221 @@
+"""Cost of the steps of `POST /token`, other than password hashing
+
+* lookup: user with role IDs read from DB and mapped into `schema.User`
+* create_token: claims built from the user and signed
+* render: token response body serialized
+* endpoint: whole request handled in-process (credentials parsed and
+  validated, token created, response serialized), with the lookup and
+  password check stubbed out
+
+Each step is measured side by side with a baseline, the way it was done
+before (or would be done with stdlib `json`):
+
+* lookup: `orm.User` with special folders joined, validated by pydantic
+* create_token: claims built as `schema.TokenData` and dumped
+* render: returned `schema.Token` validated and encoded by FastAPI into
+  stdlib `JSONResponse`, as with `response_model`; current `ORJSONResponse`
+  is also compared with `JSONResponse` rendering the same dict
+* endpoint: `JSONResponse` in place of `ORJSONResponse`
+
+For each, time per call and peak of memory allocated during one call are
+reported; ratio is time of the current code over time of the baseline.
+Note that orjson allocates its output buffer (~8 KiB) up front, so render
+and endpoint peak higher than with `json` even though the buffer is freed
+right away; what orjson saves is time, not allocations. Needs the same
+PM_* variables as the server and a database with at least one active user
+(lookup uses the first one).
+
+    $ uv run task bench-token
+"""
+import asyncio
+import inspect
+import json
+import time
+import tracemalloc
+from datetime import datetime, timedelta, UTC
+from unittest import mock
+
+import jwt
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from auth_server import schema
+from auth_server.auth import create_token
+from auth_server.config import get_settings
+from auth_server.db import api as dbapi
+from auth_server.db import orm
+from auth_server.db.engine import Session
+from auth_server.db.role_scopes import get_role_scopes
+from auth_server.keys import get_keyring
+from auth_server.main import app
+
+REQUESTS = 2_000
+
+
+async def measure(func, requests: int) -> tuple[float, float]:
+    """Returns seconds per call and KiB allocated at peak of one call"""
+
+    async def call():
+        result = func()
+        if inspect.isawaitable(result):
+            await result
+
+    await call()  # warm up
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        await call()
+    elapsed = (time.perf_counter() - started) / requests
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    await call()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    return elapsed, peak / 1024
+
+
+def lookup_orm(session, username: str) -> schema.User:
+    """Baseline of `dbapi.get_user_by_username`: ORM object validated"""
+    stmt = (
+        select(orm.User, dbapi.user_role_ids_column())
+        .where(orm.User.username == username)
+        .options(joinedload(orm.User.special_folders))
+    )
+    db_user, role_ids = session.execute(stmt).unique().one()
+    dbapi.load_role_scopes(session, role_ids or ())
+    user = schema.User.model_validate(db_user)
+    user.scopes = get_role_scopes().scopes_for(role_ids or ())
+
+    return user
+
+
+def create_token_pydantic(user: schema.User) -> str:
+    """Baseline of `create_token`: claims as `schema.TokenData`"""
+    data = schema.TokenData(
+        sub=str(user.id),
+        preferred_username=user.username,
+        email=user.email,
+        scopes=sorted(user.scopes),
+    )
+    claims = data.model_dump(exclude_none=True)
+    now = datetime.now(UTC)
+    expires = now + timedelta(minutes=get_settings().token_expire_minutes)
+    claims.update({"exp": expires, "iat": now, "jti": "0" * 32})
+    keyring = get_keyring()
+
+    return jwt.encode(
+        claims,
+        keyring.signing_key,
+        algorithm=keyring.algorithm,
+        headers=keyring.headers,
+    )
+
+
+def render_model(body: dict) -> JSONResponse:
+    """Baseline of rendering: returned model validated and encoded"""
+    token = schema.Token.model_validate(body)
+
+    return JSONResponse(jsonable_encoder(token))
+
+
+async def post_token(body: bytes) -> int:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/token",
+        "raw_path": b"/token",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        # no client address, address throttle is skipped
+        "client": None,
+        "server": ("127.0.0.1", 8000),
+    }
+    status = 0
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def main():
+    # step -> (current, baseline); (seconds per call, peak KiB) each
+    results = {}
+    with Session() as db_session:
+        username = db_session.scalar(
+            select(orm.User.username).where(orm.User.is_active).limit(1)
+        )
+        if username is None:
+            raise SystemExit("No users in DB")
+
+        results["lookup"] = (
+            await measure(
+                lambda: dbapi.get_user_by_username(db_session, username), REQUESTS
+            ),
+            await measure(lambda: lookup_orm(db_session, username), REQUESTS),
+        )
+        user = dbapi.get_user_by_username(db_session, username)
+
+    results["create_token"] = (
+        await measure(lambda: create_token(user), REQUESTS),
+        await measure(lambda: create_token_pydantic(user), REQUESTS),
+    )
+
+    token = {
+        "access_token": create_token(user),
+        "token_type": "bearer",
+        "refresh_token": None,
+    }
+    render_orjson = await measure(lambda: ORJSONResponse(token), REQUESTS)
+    results["render"] = (
+        render_orjson,
+        await measure(lambda: render_model(token), REQUESTS),
+    )
+    results["render json"] = (
+        render_orjson,
+        await measure(lambda: JSONResponse(token), REQUESTS),
+    )
+
+    async def authenticate(session, username, password) -> schema.User:
+        return user
+
+    body = json.dumps({"username": username, "password": "secret"}).encode()
+    with mock.patch("auth_server.main.async_authenticate", authenticate):
+        assert await post_token(body) == 200
+        endpoint = await measure(lambda: post_token(body), REQUESTS)
+        with mock.patch("auth_server.main.ORJSONResponse", JSONResponse):
+            assert await post_token(body) == 200
+            results["endpoint"] = (
+                endpoint,
+                await measure(lambda: post_token(body), REQUESTS),
+            )
+
+    print(f"{'':14}{'current':>25}{'baseline':>25}{'ratio':>8}")
+    for name, ((elapsed, peak), (base_elapsed, base_peak)) in results.items():
+        print(
+            f"{name:14}"
+            f"{elapsed * 1e6:>9.1f} us{peak:>9.1f} KiB"
+            f"{base_elapsed * 1e6:>9.1f} us{base_peak:>9.1f} KiB"
+            f"{elapsed / base_elapsed:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
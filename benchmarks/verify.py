@@ -0,0 +1,96 @@
+"""Per-request overhead of `/verify`: FastAPI route vs ASGI fast path
+
+The app is called in-process, without server and network. Tokens are
+verified in stateless mode and outcome of the check is cached after the
+first request (as it is for all but the first sub-request of a page load),
+so what is measured is mostly the work done around the check, which is
+what the fast path saves.
+
+Needs the same PM_* variables as the server; DB is not used.
+
+    $ uv run task bench-verify
+"""
+import asyncio
+import time
+import uuid
+
+from auth_server import schema
+from auth_server.auth import create_token
+from auth_server.config import VerifyMode, get_settings
+from auth_server.main import app
+
+REQUESTS = 20_000
+
+
+def make_scope(headers: list[tuple[bytes, bytes]]) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/verify",
+        "raw_path": b"/verify",
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000),
+    }
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def run(scope: dict, requests: int) -> tuple[float, int]:
+    """Returns seconds per request and status of the last response"""
+    status = 0
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app(scope, receive, send)
+
+    return (time.perf_counter() - started) / requests, status
+
+
+async def main():
+    settings = get_settings()
+    settings.verify_mode = VerifyMode.STATELESS
+    user = schema.User(
+        id=uuid.uuid4(), username="bench", password="", email="bench@example.com"
+    )
+    token = create_token(user).encode()
+    cases = {
+        "valid token (header)": [(b"authorization", b"Bearer " + token)],
+        "valid token (cookie)": [
+            (b"cookie", settings.cookie_name.encode() + b"=" + token)
+        ],
+        "invalid token": [(b"authorization", b"Bearer not.a.jwt")],
+        "no token": [],
+    }
+
+    print(f"{'':24}{'route':>12}{'fast path':>12}{'speedup':>10}")
+    for name, headers in cases.items():
+        scope = make_scope(headers)
+        results = []
+        for fast_path in (False, True):
+            settings.verify_fast_path = fast_path
+            await run(scope, REQUESTS // 10)  # warm up, fills verify cache
+            elapsed, status = await run(scope, REQUESTS)
+            results.append(elapsed)
+
+        route, fast = results
+        print(
+            f"{name:24}{route * 1e6:>9.1f} us{fast * 1e6:>9.1f} us"
+            f"{route / fast:>9.1f}x  ({status})"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,12 +4,18 @@ import httpx
 import pytest
 
 from fastapi.testclient import TestClient
-from sqlalchemy import Engine, text, select
+from sqlalchemy import Engine, event, text, select
 
 from auth_server.db.base import Base
-from auth_server.main import app
-from auth_server.db.engine import engine, Session
+from auth_server.main import (
+    app,
+    get_username_throttle,
+    get_address_throttle,
+    get_renewed_tokens,
+)
+from auth_server.db.engine import engine, get_async_engine, Session
 from auth_server.db import orm
+from auth_server.db import api as dbapi
 from auth_server import const
 
 
@@ -63,9 +69,32 @@ def db_session():
 
 @pytest.fixture()
 def client() -> httpx.Client:
-    return TestClient(app)
+    # context manager runs app's lifespan, all requests share one event loop
+    with TestClient(app) as test_client:
+        yield test_client
+    # created again, with settings of the next test
+    get_username_throttle.cache_clear()
+    get_address_throttle.cache_clear()
+    get_renewed_tokens.cache_clear()
+    dbapi.get_unknown_usernames.cache_clear()
 
 
 @pytest.fixture()
 def db_engine() -> Engine:
     return engine
+
+
+@pytest.fixture()
+def statements(db_engine) -> list[str]:
+    """SQL statements executed via `db_engine` while the test runs"""
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        executed.append(statement)
+
+    engines = [db_engine, get_async_engine().sync_engine]
+    for item in engines:
+        event.listen(item, "before_cursor_execute", before_cursor_execute)
+    yield executed
+    for item in engines:
+        event.remove(item, "before_cursor_execute", before_cursor_execute)
@@ -1,9 +1,37 @@
+import uuid
+
+import jwt
 from passlib.hash import pbkdf2_sha256
 
-from auth_server.auth import verify_password
+from auth_server import schema
+from auth_server.auth import create_token, verify_password
+from auth_server.config import get_settings
 
 
 def test_verify_password():
     password = "123"
     hashed_password = pbkdf2_sha256.hash("123")
     assert verify_password(password, hashed_password)
+
+
+def test_token_claims():
+    user = schema.User(
+        id=uuid.uuid4(),
+        username="socrates",
+        password="-",
+        email="socrates@mail.com",
+        scopes=frozenset({"user.view", "node.view"}),
+    )
+
+    claims = jwt.decode(create_token(user), options={"verify_signature": False})
+
+    assert set(claims) == {
+        "sub", "preferred_username", "email", "scopes", "exp", "iat", "jti"
+    }
+    assert schema.TokenData.model_validate(claims) == schema.TokenData(
+        sub=str(user.id),
+        preferred_username="socrates",
+        email="socrates@mail.com",
+        scopes=["node.view", "user.view"],
+    )
+    assert claims["exp"] - claims["iat"] == get_settings().token_expire_minutes * 60
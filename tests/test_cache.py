@@ -0,0 +1,57 @@
+from unittest import mock
+
+from auth_server.cache import TTLCache, token_key
+
+
+def test_token_key_does_not_contain_raw_token():
+    key = token_key("some.jwt.token")
+
+    assert key == token_key("some.jwt.token")
+    assert b"some.jwt.token" not in key
+
+
+def test_cache_evicts_least_recently_used_entry():
+    cache = TTLCache(maxsize=2, ttl=60)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # now "b" is least recently used
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats.evictions == 1
+
+
+def test_cache_entry_expires():
+    cache = TTLCache(maxsize=10, ttl=60)
+
+    with mock.patch("auth_server.cache.time.monotonic", return_value=100):
+        cache.set("a", 1)
+        # per entry ttl can only shorten cache wide ttl
+        cache.set("b", 2, ttl=5)
+        cache.set("c", 3, ttl=600)
+
+    with mock.patch("auth_server.cache.time.monotonic", return_value=110):
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+
+    with mock.patch("auth_server.cache.time.monotonic", return_value=161):
+        assert cache.get("c") is None
+
+    assert cache.stats.as_dict() == {
+        "hits": 1,
+        "misses": 2,
+        "evictions": 0,
+        "expirations": 2,
+    }
+
+
+def test_disabled_cache_stores_nothing():
+    cache = TTLCache(maxsize=10, ttl=0)
+
+    cache.set("a", 1)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
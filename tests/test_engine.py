@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+from sqlalchemy.pool import NullPool
+
+from auth_server.config import Settings
+from auth_server.db.engine import (
+    InstrumentedQueuePool,
+    PoolStats,
+    async_url,
+    engine_options,
+    get_pool_stats,
+)
+
+
+def test_engine_options_null_pool():
+    settings = Settings(db_pool_mode="null")
+
+    assert engine_options(settings) == {"poolclass": NullPool}
+
+
+def test_engine_options_queue_pool():
+    settings = Settings(db_pool_mode="queue", db_pool_size=3, db_pool_max_overflow=0)
+
+    options = engine_options(settings)
+
+    assert options["poolclass"] is InstrumentedQueuePool
+    assert options["pool_size"] == 3
+    assert options["max_overflow"] == 0
+
+
+def test_async_url_translates_libpq_params(caplog):
+    url, connect_args = async_url(
+        "postgresql://pm:secret@db:5432/pmdb?sslmode=require&connect_timeout=5"
+        "&application_name=auth&target_session_attrs=read-write&keepalives=1"
+    )
+
+    assert url.drivername == "postgresql+asyncpg"
+    assert url.password == "secret"
+    assert dict(url.query) == {"target_session_attrs": "read-write"}
+    assert connect_args == {
+        "ssl": "require",
+        "timeout": 5.0,
+        "server_settings": {"application_name": "auth"},
+    }
+    assert "keepalives" in caplog.text
+
+
+def test_async_url_without_params():
+    url, connect_args = async_url("postgresql://pm:secret@db:5432/pmdb")
+
+    assert url.render_as_string(hide_password=False) == (
+        "postgresql+asyncpg://pm:secret@db:5432/pmdb"
+    )
+    assert connect_args == {}
+
+
+def test_pool_stats_count_checkouts(db_engine):
+    before = get_pool_stats()["checkouts"]
+
+    with db_engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        stats = get_pool_stats()
+        assert stats["checked_out"] >= 1
+
+    stats = get_pool_stats()
+    assert stats["checkouts"] == before + 1
+    assert stats["wait_max"] >= 0
+
+
+def test_pool_stats_survive_dispose(db_engine):
+    with db_engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    before = get_pool_stats(db_engine)["checkouts"]
+
+    db_engine.dispose()
+
+    assert get_pool_stats(db_engine)["checkouts"] == before
+
+
+def test_pool_stats_are_thread_safe():
+    stats = PoolStats()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for _ in range(8):
+            executor.submit(lambda: [stats.record(0.001) for _ in range(10_000)])
+
+    assert stats.as_dict()["checkouts"] == 80_000
@@ -0,0 +1,131 @@
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+from auth_server.config import Settings
+from auth_server.keys import KeyRing
+
+
+def write_private_key(path, private_key):
+    path.write_bytes(
+        private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+    )
+    return path
+
+
+def write_public_key(path, private_key):
+    path.write_bytes(
+        private_key.public_key().public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+    )
+    return path
+
+
+def sign(keyring: KeyRing, payload: dict) -> str:
+    return jwt.encode(
+        payload,
+        keyring.signing_key,
+        algorithm=keyring.algorithm,
+        headers=keyring.headers,
+    )
+
+
+def verify(keyring: KeyRing, token: str) -> dict:
+    return jwt.decode(
+        token, keyring.verification_key(token), algorithms=[keyring.algorithm]
+    )
+
+
+def test_symmetric_keyring():
+    keyring = KeyRing.from_settings(Settings(token_algorithm="HS256"))
+
+    token = sign(keyring, {"sub": "1"})
+
+    assert keyring.headers is None
+    assert verify(keyring, token) == {"sub": "1"}
+    assert keyring.jwks == {"keys": []}
+
+
+@pytest.mark.parametrize(
+    "algorithm,private_key",
+    [
+        ("RS256", rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+        ("ES256", ec.generate_private_key(ec.SECP256R1())),
+    ],
+)
+def test_asymmetric_keyring(tmp_path, algorithm, private_key):
+    settings = Settings(
+        token_algorithm=algorithm,
+        private_key_file=write_private_key(tmp_path / "key.pem", private_key),
+    )
+    keyring = KeyRing.from_settings(settings)
+
+    token = sign(keyring, {"sub": "1"})
+
+    assert jwt.get_unverified_header(token)["kid"] == keyring.kid
+    assert verify(keyring, token) == {"sub": "1"}
+    [jwk] = keyring.jwks["keys"]
+    assert jwk["kid"] == keyring.kid
+    assert jwk["alg"] == algorithm
+    assert "d" not in jwk  # only public part is published
+    # token can be verified with published key alone
+    public_key = jwt.PyJWK(jwk).key
+    assert jwt.decode(token, public_key, algorithms=[algorithm]) == {"sub": "1"}
+
+
+def test_tokens_signed_with_rotated_out_key_are_accepted(tmp_path):
+    old_private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    new_private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    old_keyring = KeyRing.from_settings(
+        Settings(
+            token_algorithm="RS256",
+            private_key_file=write_private_key(tmp_path / "old.pem", old_private_key),
+        )
+    )
+    keyring = KeyRing.from_settings(
+        Settings(
+            token_algorithm="RS256",
+            private_key_file=write_private_key(tmp_path / "new.pem", new_private_key),
+            public_key_files=[write_public_key(tmp_path / "old.pub", old_private_key)],
+        )
+    )
+    old_token = sign(old_keyring, {"sub": "1"})
+
+    assert verify(keyring, old_token) == {"sub": "1"}
+    assert len(keyring.jwks["keys"]) == 2
+    assert old_keyring.kid != keyring.kid
+
+    # token signed with old key, but claiming new key's kid
+    forged = jwt.encode(
+        {"sub": "1"}, old_private_key, algorithm="RS256", headers=keyring.headers
+    )
+    with pytest.raises(jwt.InvalidSignatureError):
+        verify(keyring, forged)
+
+
+def test_unknown_kid_is_rejected(tmp_path):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    keyring = KeyRing.from_settings(
+        Settings(
+            token_algorithm="RS256",
+            private_key_file=write_private_key(tmp_path / "key.pem", private_key),
+        )
+    )
+    token = jwt.encode(
+        {"sub": "1"}, private_key, algorithm="RS256", headers={"kid": "unknown"}
+    )
+
+    with pytest.raises(jwt.InvalidTokenError):
+        verify(keyring, token)
+
+
+def test_asymmetric_algorithm_requires_private_key():
+    with pytest.raises(ValueError):
+        KeyRing.from_settings(Settings(token_algorithm="RS256"))
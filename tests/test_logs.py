@@ -0,0 +1,111 @@
+import logging
+import queue
+from unittest import mock
+
+import yaml
+
+from auth_server import logs
+
+
+def make_record(msg="Authentication failed for '%s'", args=("alice",), name="test"):
+    return logging.makeLogRecord({"name": name, "msg": msg, "args": args})
+
+
+def test_rate_limit_filter():
+    rate_limit = logs.RateLimitFilter(rate=2, per=1)
+
+    with mock.patch("time.monotonic", return_value=100):
+        passed = [rate_limit.filter(make_record(args=(i,))) for i in range(5)]
+        # other events are counted on their own
+        assert rate_limit.filter(make_record(msg="User %s not found"))
+        assert rate_limit.filter(make_record(name="other"))
+
+    assert [bool(record) for record in passed] == [True, True, False, False, False]
+
+    with mock.patch("time.monotonic", return_value=101):
+        record = rate_limit.filter(make_record(args=("bob",)))
+        assert record.getMessage() == (
+            "Authentication failed for 'bob' (3 similar suppressed)"
+        )
+        # suppressed records are reported once
+        record = rate_limit.filter(make_record(args=("carol",)))
+        assert record.getMessage() == "Authentication failed for 'carol'"
+
+
+def test_rate_limit_filter_forgets_events():
+    rate_limit = logs.RateLimitFilter(rate=1, per=1, maxsize=3)
+
+    for i in range(10):
+        assert rate_limit.filter(make_record(msg=f"Event {i}"))
+
+    assert len(rate_limit._events) <= 3
+
+
+def test_queue_handler_does_not_format():
+    handler = logs.QueueHandler(queue.Queue())
+    args = {"username": "alice"}
+    record = make_record(msg="%(username)s logged in", args=args)
+    handler.handle(record)
+
+    queued = handler.queue.get_nowait()
+    assert queued is record
+    assert queued.msg == "%(username)s logged in"
+    assert queued.args == args
+
+
+def test_queue_handler_drops_when_full():
+    handler = logs.QueueHandler(queue.Queue(maxsize=1))
+    for _ in range(3):
+        handler.handle(make_record())
+
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 2
+
+
+def test_configure_starts_listener(tmp_path):
+    path = tmp_path / "logging.yml"
+    path.write_text(
+        yaml.safe_dump(
+            {
+                "version": 1,
+                "disable_existing_loggers": False,
+                "handlers": {
+                    "buffer": {
+                        "class": "logging.handlers.BufferingHandler",
+                        "capacity": 100,
+                    },
+                    "test_queue": {
+                        "class": "auth_server.logs.QueueHandler",
+                        "handlers": ["buffer"],
+                    },
+                },
+                "loggers": {
+                    "test_logs": {
+                        "handlers": ["test_queue"],
+                        "level": "INFO",
+                        "propagate": False,
+                    }
+                },
+            }
+        )
+    )
+
+    logs.configure(path)
+    handler = logging.getHandlerByName("test_queue")
+    try:
+        logging.getLogger("test_logs").info("User %s logged in", "alice")
+    finally:
+        handler.listener.stop()
+
+    buffer = logging.getHandlerByName("buffer")
+    assert [record.getMessage() for record in buffer.buffer] == [
+        "User alice logged in"
+    ]
+    logging.getLogger("test_logs").handlers.clear()
+
+
+def test_default_config():
+    config = logs.load_config()
+
+    assert config["root"]["handlers"] == ["queue"]
+    assert config["handlers"]["queue"]["class"] == "auth_server.logs.QueueHandler"
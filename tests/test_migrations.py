@@ -0,0 +1,102 @@
+import pytest
+from sqlalchemy import text, select
+
+from auth_server import const
+from auth_server.db import api as dbapi
+from auth_server.db import migrations, orm
+from auth_server.db.api import select_user_row
+
+
+def explain(conn, stmt) -> str:
+    compiled = stmt.compile(dialect=conn.dialect)
+    rows = conn.exec_driver_sql(f"EXPLAIN {compiled}", compiled.params)
+
+    return "\n".join(row[0] for row in rows)
+
+
+def test_migrate_is_idempotent(db_session, db_engine):
+    with db_engine.connect() as conn:
+        applied = migrations.migrate(conn)
+        assert [m.version for m in applied] == [m.version for m in migrations.MIGRATIONS]
+        assert migrations.migrate(conn) == []
+        assert migrations.current_version(conn) == migrations.MIGRATIONS[-1].version
+
+
+def test_migrate_legacy_schema(db_session, db_engine, system_user):
+    dbapi.sync_perms(db_session)
+    role, _ = dbapi.create_role(db_session, name="r1", scopes=["node.view"])
+    user = dbapi.create_user(
+        db_session,
+        username="erasmus",
+        email="erasmus@mail.com",
+        password="freewill41",
+        role_names=["r1"],
+    )
+    user_id, role_id = user.id, role.id
+    db_session.close()  # DDL below must not wait on session's locks
+
+    with db_engine.connect() as conn:
+        # schema as it was before keys and indexes were introduced
+        conn.execute(text("DROP INDEX ix_users_username"))
+        conn.execute(text("DROP INDEX ix_users_email"))
+        conn.execute(text("ALTER TABLE users_roles DROP CONSTRAINT users_roles_pkey"))
+        conn.execute(
+            text("INSERT INTO users_roles (user_id, role_id) VALUES (:u, :r)"),
+            {"u": user_id, "r": role_id},
+        )
+        conn.commit()
+
+        migrations.migrate(conn)
+
+        rows = conn.execute(text("SELECT count(*) FROM users_roles")).scalar()
+        indexes = conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = 'users'")
+        ).scalars()
+        assert rows == 1  # duplicate removed
+        assert {"ix_users_username", "ix_users_email"} <= set(indexes)
+
+
+def test_migrate_reports_duplicate_usernames(db_session, db_engine, system_user):
+    db_session.execute(text("DROP INDEX ix_users_username"))
+    db_session.commit()
+    for email in ["john@a.com", "john@b.com"]:
+        dbapi.create_user(db_session, username="john", email=email, password="-")
+    db_session.close()
+
+    with db_engine.connect() as conn:
+        with pytest.raises(migrations.MigrationError, match="shared .*: john$"):
+            migrations.migrate(conn)
+
+        assert migrations.current_version(conn) == 0
+
+
+def test_migrate_creates_token_tables(db_session, db_engine):
+    db_session.close()
+    with db_engine.connect() as conn:
+        conn.execute(text("DROP TABLE revoked_tokens"))
+        conn.commit()
+        assert migrations.missing_tables(conn, "revoked_tokens", "users") == [
+            "revoked_tokens"
+        ]
+
+        migrations.migrate(conn)
+
+        assert migrations.missing_tables(conn, "revoked_tokens") == []
+
+
+@pytest.mark.parametrize(
+    "stmt",
+    [
+        select_user_row(orm.User.username == "erasmus"),
+        select_user_row(orm.User.email == "erasmus@mail.com"),
+        select(orm.User.id).where(orm.User.id == const.SYSTEM_USER_ID),
+    ],
+)
+def test_hot_lookups_do_not_scan_tables(db_session, db_engine, stmt):
+    with db_engine.connect() as conn:
+        # tables are tiny, without this planner prefers sequential scans;
+        # with it, sequential scan is chosen only if there is no index to use
+        conn.execute(text("SET enable_seqscan = off"))
+        plan = explain(conn, stmt)
+
+    assert "Seq Scan" not in plan, plan
@@ -0,0 +1,85 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from auth_server import passwords
+from auth_server.config import Settings, PasswordScheme
+
+
+def test_verify_password_async():
+    hashed_password = passwords.hash_password("secret")
+
+    assert asyncio.run(passwords.verify_password_async("secret", hashed_password))
+    assert not asyncio.run(passwords.verify_password_async("wrong", hashed_password))
+
+
+def test_full_queue_rejects_job_right_away():
+    settings = Settings(password_queue_size=2)
+
+    with (
+        mock.patch("auth_server.passwords.get_settings", return_value=settings),
+        mock.patch("auth_server.passwords._pending", 2),
+    ):
+        with pytest.raises(passwords.PasswordQueueFull):
+            asyncio.run(passwords.hash_password_async("secret"))
+
+
+@pytest.fixture()
+def policy():
+    """Sets hashing policy for the duration of the test"""
+
+    def set_policy(**kwargs):
+        settings = Settings(**kwargs)
+        patcher = mock.patch(
+            "auth_server.passwords.get_settings", return_value=settings
+        )
+        patcher.start()
+        patches.append(patcher)
+        passwords.get_context.cache_clear()
+
+    patches = []
+    yield set_policy
+    for patcher in reversed(patches):
+        patcher.stop()
+    passwords.get_context.cache_clear()
+
+
+def test_hash_with_other_cost_is_updated(policy):
+    policy(password_rounds=1000)
+    hashed_password = passwords.hash_password("secret")
+    assert passwords.verify_and_update("secret", hashed_password) == (True, None)
+
+    policy(password_rounds=2000)
+    valid, new_hash = passwords.verify_and_update("secret", hashed_password)
+
+    assert valid
+    assert new_hash.startswith("$pbkdf2-sha256$2000$")
+    assert passwords.verify_and_update("wrong", hashed_password) == (False, None)
+
+
+def test_hash_of_other_scheme_is_updated(policy):
+    pytest.importorskip("argon2")
+    policy(password_rounds=1000)
+    hashed_password = passwords.hash_password("secret")
+
+    policy(password_scheme="argon2", password_rounds=1, password_memory_cost=1024)
+    valid, new_hash = passwords.verify_and_update("secret", hashed_password)
+
+    assert valid
+    assert new_hash.startswith("$argon2id$")
+    assert "m=1024,t=1" in new_hash
+
+
+def test_memory_cost_requires_argon2(policy):
+    policy(password_memory_cost=1024)
+
+    with pytest.raises(ValueError):
+        passwords.get_context()
+
+
+def test_calibrate():
+    rounds, elapsed = passwords.calibrate(PasswordScheme.PBKDF2_SHA256, target=0.01)
+
+    assert rounds >= passwords.MIN_ROUNDS[PasswordScheme.PBKDF2_SHA256]
+    assert 0.001 < elapsed < 0.1
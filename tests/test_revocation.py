@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta, UTC
+from unittest import mock
+
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
+
+from auth_server.db import api as dbapi
+from auth_server.db import orm
+from auth_server.revocation import RevocationList
+
+
+def test_token_revoked_by_jti():
+    revocations = RevocationList()
+    revocations.add(jti="abc", user_id=None, revoked_at=datetime.now(UTC))
+
+    assert revocations.is_revoked({"sub": "u1", "jti": "abc", "iat": 1})
+    assert not revocations.is_revoked({"sub": "u1", "jti": "xyz", "iat": 1})
+
+
+def test_user_tokens_issued_before_revocation_are_revoked():
+    revoked_at = datetime(2025, 1, 1, tzinfo=UTC)
+    revocations = RevocationList()
+    revocations.add(jti=None, user_id="u1", revoked_at=revoked_at)
+
+    issued_before = revoked_at.timestamp() - 60
+    issued_after = revoked_at.timestamp() + 60
+
+    assert revocations.is_revoked({"sub": "u1", "iat": issued_before})
+    # tokens without `iat` claim are considered issued before
+    assert revocations.is_revoked({"sub": "u1"})
+    assert not revocations.is_revoked({"sub": "u1", "iat": issued_after})
+    assert not revocations.is_revoked({"sub": "u2", "iat": issued_before})
+
+
+def test_token_issued_in_the_second_of_revocation_is_revoked():
+    revoked_at = datetime(2025, 1, 1, 0, 0, 0, 700_000, tzinfo=UTC)
+    revocations = RevocationList()
+    revocations.add(jti=None, user_id="u1", revoked_at=revoked_at)
+    second = int(revoked_at.timestamp())
+
+    assert revocations.is_revoked({"sub": "u1", "iat": second - 1})
+    # e.g. stolen token issued just before revocation of all sessions
+    assert revocations.is_revoked({"sub": "u1", "iat": second})
+    assert not revocations.is_revoked({"sub": "u1", "iat": second + 1})
+
+
+def test_expired_revocations_are_pruned():
+    now = datetime(2025, 1, 1, tzinfo=UTC)
+    later = datetime(2025, 1, 2, tzinfo=UTC)
+    revocations = RevocationList()
+    revocations.add(jti="abc", user_id=None, revoked_at=now, expires_at=now)
+    revocations.add(jti="xyz", user_id=None, revoked_at=now, expires_at=later)
+    revocations.add(jti=None, user_id="u1", revoked_at=now, expires_at=now)
+    revocations.add(jti=None, user_id="u2", revoked_at=now)
+
+    revocations.prune(now.timestamp() + 1)
+
+    assert set(revocations.jtis) == {"xyz"}
+    # revocations without expiration time are kept
+    assert set(revocations.users) == {"u2"}
+
+
+def test_revocations_expire_with_tokens(db_session):
+    expired = dbapi.revoke_token(
+        db_session, "old", expires_at=datetime.now(UTC) - timedelta(minutes=1)
+    )
+    expired_id = expired.id
+
+    revoked = dbapi.revoke_token(db_session, "abc")
+
+    # kept as long as any token issued so far may be valid
+    assert revoked.expires_at > datetime.now(UTC) + timedelta(minutes=1)
+    jtis = db_session.scalars(select(orm.RevokedToken.jti)).all()
+    assert jtis == ["abc"]
+    assert db_session.get(orm.RevokedToken, expired_id) is None
+
+
+def test_revocation_locks_table_until_commit(db_session, db_engine):
+    """Otherwise a revocation committed after one with a higher ID would be
+    skipped by refresh, which fetches rows by ID
+    """
+    commit = db_session.commit
+
+    def commit_when_locked():
+        with db_engine.connect() as conn:
+            with pytest.raises(OperationalError, match="could not obtain lock"):
+                conn.execute(
+                    text("LOCK TABLE revoked_tokens IN ROW EXCLUSIVE MODE NOWAIT")
+                )
+        commit()
+
+    with mock.patch.object(db_session, "commit", commit_when_locked):
+        dbapi.revoke_token(db_session, "abc")
+
+    with db_engine.connect() as conn:
+        conn.execute(text("LOCK TABLE revoked_tokens IN ROW EXCLUSIVE MODE NOWAIT"))
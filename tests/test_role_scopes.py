@@ -0,0 +1,51 @@
+import uuid
+from unittest import mock
+
+from auth_server.db.role_scopes import RoleScopes
+
+
+def test_scopes_for_roles_combination():
+    r1, r2, r3 = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    role_scopes = RoleScopes(ttl=60)
+    role_scopes.load(
+        [
+            (r1, "node.view"),
+            (r1, "node.create"),
+            (r2, "node.view"),
+            (r3, "node.view"),
+            (r3, "node.create"),
+        ]
+    )
+
+    assert role_scopes.scopes_for([r1, r2]) == {"node.view", "node.create"}
+    assert role_scopes.scopes_for([]) == frozenset()
+    assert role_scopes.scopes_for([uuid.uuid4()]) == frozenset()
+    # equal scope sets are one object
+    assert role_scopes.scopes_for([r1]) is role_scopes.scopes_for([r3])
+    assert role_scopes.scopes_for([r1, r2]) is role_scopes.scopes_for([r3])
+
+
+def test_role_scopes_become_stale():
+    role_scopes = RoleScopes(ttl=60)
+    assert role_scopes.is_stale()
+
+    with mock.patch("auth_server.db.role_scopes.time.monotonic", return_value=100):
+        role_scopes.load([])
+        assert not role_scopes.is_stale()
+
+    with mock.patch("auth_server.db.role_scopes.time.monotonic", return_value=161):
+        assert role_scopes.is_stale()
+
+    role_scopes.load([])
+    role_scopes.invalidate()
+    assert role_scopes.is_stale()
+
+
+def test_roles_without_permissions_are_known():
+    r1, r2 = uuid.uuid4(), uuid.uuid4()
+    role_scopes = RoleScopes(ttl=60)
+    role_scopes.load([(r1, "node.view"), (r2, None)])
+
+    assert role_scopes.knows([r1, r2])
+    assert not role_scopes.knows([r1, uuid.uuid4()])
+    assert role_scopes.scopes_for([r2]) == frozenset()
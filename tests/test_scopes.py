@@ -0,0 +1,32 @@
+from auth_server import scopes
+
+
+def test_latest_scope_bits_cover_all_scopes():
+    ordering = scopes.SCOPE_BITS[scopes.SCOPE_BITS_VERSION]
+
+    assert len(ordering) == len(set(ordering))
+    assert set(ordering) == set(scopes.SCOPES)
+
+
+def test_encode_decode_claim():
+    user_scopes = {scopes.NODE_VIEW, scopes.TAG_VIEW, scopes.PAGE_EXTRACT}
+
+    claim = scopes.encode_claim(user_scopes)
+
+    assert scopes.decode_claim(claim) == user_scopes
+    assert scopes.from_claims({"scm": claim}) == user_scopes
+
+
+def test_superuser_claim_is_compact():
+    claim = scopes.encode_claim(scopes.SCOPES)
+
+    assert claim == "1:3ffffff"
+    assert scopes.decode_claim(claim) == set(scopes.SCOPES)
+
+
+def test_has_scope():
+    mask = scopes.encode_mask([scopes.NODE_VIEW, scopes.TAG_CREATE])
+
+    assert scopes.has_scope(mask, scopes.NODE_VIEW)
+    assert scopes.has_scope(mask, scopes.TAG_CREATE)
+    assert not scopes.has_scope(mask, scopes.NODE_DELETE)
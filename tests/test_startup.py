@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+def imported_modules(code: str, env: dict[str, str]) -> set[str]:
+    """Runs code in fresh interpreter, returns top level modules it imported"""
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            f"{code}\nimport sys\nprint(' '.join({{m.split('.')[0] for m in sys.modules}}))",
+        ],
+        env=env,
+        text=True,
+    )
+    return set(output.split())
+
+
+@pytest.fixture
+def bare_env():
+    """Environment without any of auth server settings"""
+    return {k: v for k, v in os.environ.items() if not k.upper().startswith("PM_")}
+
+
+def test_cli_import_is_lazy(bare_env):
+    modules = imported_modules("import auth_server.cli.cli", bare_env)
+
+    heavy = {
+        "sqlalchemy",
+        "fastapi",
+        "uvicorn",
+        "passlib",
+        "jwt",
+        "asyncpg",
+        "psycopg2",
+        "rich",
+    }
+    assert modules & heavy == set()
+
+
+def test_cli_help_without_settings(bare_env):
+    result = subprocess.run(
+        [sys.executable, "-m", "auth_server.cli.cli", "users", "--help"],
+        env=bare_env,
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert "import" in result.stdout
+
+
+def test_app_import_does_not_connect():
+    modules = imported_modules("import auth_server.main", dict(os.environ))
+
+    # engines, and with them DB drivers, are created on first use
+    assert "asyncpg" not in modules
+    assert "psycopg2" not in modules
+
+
+def test_app_import_without_settings(bare_env):
+    # settings are read when worker state is first used
+    modules = imported_modules("import auth_server.main, auth_server.db.api", bare_env)
+
+    assert "auth_server" in modules
@@ -0,0 +1,119 @@
+from unittest import mock
+
+import pytest
+
+from auth_server.throttle import LoginThrottle
+
+
+@pytest.fixture()
+def clock():
+    now = [1000.0]
+    with mock.patch("auth_server.throttle.time.monotonic", side_effect=lambda: now[0]):
+        yield now
+
+
+def make_throttle(**kwargs) -> LoginThrottle:
+    options = dict(max_attempts=3, window=60, lockout=30, max_lockout=100, maxsize=10)
+    options.update(kwargs)
+
+    return LoginThrottle(**options)
+
+
+def test_attempts_above_limit_are_rejected(clock):
+    throttle = make_throttle()
+
+    assert [throttle.hit("alice") for _ in range(3)] == [0, 0, 0]
+    assert throttle.hit("alice") == 30
+    # other keys are not affected
+    assert throttle.hit("bob") == 0
+
+    clock[0] += 10
+    assert throttle.hit("alice") == 20
+    assert throttle.stats.as_dict() == {"allowed": 4, "rejected": 2, "lockouts": 1}
+
+
+def test_window_slides(clock):
+    throttle = make_throttle()
+
+    throttle.hit("alice")
+    clock[0] += 40
+    throttle.hit("alice")
+    throttle.hit("alice")
+    clock[0] += 21  # first attempt is out of the window now
+
+    assert throttle.hit("alice") == 0
+
+
+def test_consecutive_lockouts_back_off(clock):
+    throttle = make_throttle()
+
+    delays = []
+    for _ in range(4):
+        for _ in range(4):
+            delay = throttle.hit("alice")
+        delays.append(delay)
+        clock[0] += delay
+
+    assert delays == [30, 60, 100, 100]
+
+    # quiet for a whole window, back-off starts over
+    clock[0] += 60
+    for _ in range(4):
+        delay = throttle.hit("alice")
+    assert delay == 30
+
+
+def test_reset(clock):
+    throttle = make_throttle()
+    for _ in range(4):
+        throttle.hit("alice")
+
+    throttle.reset("alice")
+
+    assert throttle.hit("alice") == 0
+
+
+def test_least_recently_used_keys_are_forgotten(clock):
+    throttle = make_throttle(maxsize=2)
+
+    throttle.hit("alice")
+    throttle.hit("bob")
+    throttle.hit("carol")
+
+    assert len(throttle) == 2
+
+
+def test_locked_out_keys_are_not_forgotten(clock):
+    throttle = make_throttle(maxsize=3)
+    for _ in range(4):
+        throttle.hit("alice")
+
+    # spraying other keys does not lift the lockout
+    for index in range(10):
+        assert throttle.hit(f"user{index}") == 0
+    assert len(throttle) == 3
+    assert throttle.hit("alice") == 30
+
+
+def test_new_key_is_admitted_when_all_keys_are_locked_out(clock):
+    throttle = make_throttle(maxsize=2)
+    # sprayed keys lock themselves out
+    for key in ["spray1", "spray2"]:
+        for _ in range(4):
+            throttle.hit(key)
+
+    # first attempts of users who did not try yet
+    assert throttle.hit("alice") == 0
+    assert throttle.hit("bob") == 0
+    assert len(throttle) == 2
+    # their attempts are still counted
+    for _ in range(2):
+        throttle.hit("alice")
+    assert throttle.hit("alice") == 30
+
+
+def test_disabled_throttle_allows_everything(clock):
+    throttle = make_throttle(max_attempts=0)
+
+    assert all(throttle.hit("alice") == 0 for _ in range(100))
+    assert len(throttle) == 0
@@ -1,8 +1,15 @@
+import asyncio
+import json
 import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
 import pytest
-from sqlalchemy import select
+from sqlalchemy import select, func
 from sqlalchemy.exc import NoResultFound
+from typer.testing import CliRunner
 
 
 from auth_server.db.orm import (
@@ -10,9 +17,16 @@ from auth_server.db.orm import (
     SpecialFolder,
     FolderType,
     OwnerType,
+    Ownership,
+    Permission,
 )
 from auth_server.db import api as dbapi
-from auth_server import scopes
+from auth_server.db import async_api
+from auth_server.db.engine import AsyncSession, get_async_engine, Session
+from auth_server import scopes, auth, passwords, schema, types
+from auth_server.config import Settings
+from auth_server.cli.cli import app as cli_app
+from auth_server.db.role_scopes import get_role_scopes
 
 
 logger = logging.getLogger(__name__)
@@ -69,11 +83,54 @@ def test_get_user_by_username(db_session, system_user):
     assert user.username == "eugen"
 
 
+def test_get_user_by_username_maps_special_folders(db_session, system_user):
+    created = dbapi.create_user(
+        db_session, username="eugen", password="1234", email="eugen@mail.com"
+    )
+
+    user = dbapi.get_user_by_username(db_session, "eugen")
+
+    assert user.home_folder_id is not None
+    assert user.inbox_folder_id is not None
+    assert (user.id, user.home_folder_id, user.inbox_folder_id) == (
+        created.id,
+        created.home_folder_id,
+        created.inbox_folder_id,
+    )
+
+
 def test_get_user_by_username_raises_correct_exception(db_session, system_user):
     with pytest.raises(NoResultFound):
         dbapi.get_user_by_username(db_session, "no_such_user")
 
 
+def test_users_from_emails_with_same_local_part(db_session, system_user):
+    first = dbapi.get_or_create_user_by_email(db_session, "john@a.com")
+    second = dbapi.get_or_create_user_by_email(db_session, "john@b.com")
+    third = dbapi.get_or_create_user_by_email(db_session, "john@c.com")
+
+    assert [first.username, second.username, third.username] == [
+        "john",
+        "john2",
+        "john3",
+    ]
+    assert dbapi.get_user_by_email(db_session, "john@b.com").id == second.id
+
+
+def test_get_or_create_user_by_email_recovers_from_failed_insert(
+    db_session, system_user
+):
+    with mock.patch.object(
+        dbapi, "create_special_folders_for_user", side_effect=RuntimeError
+    ):
+        user = dbapi.get_or_create_user_by_email(db_session, "mila@lol.com")
+
+    assert user is None
+    # session is usable again
+    user = dbapi.get_or_create_user_by_email(db_session, "mila@lol.com")
+    assert user.username == "mila"
+
+
 def test_get_user_by_email(db_session, system_user):
     dbapi.create_user_from_email(db_session, "john@mail.com")
     user = dbapi.get_user_by_email(db_session, "john@mail.com")
@@ -110,6 +167,103 @@ def test_user_inherits_from_roles(db_session, system_user):
     assert actual_scopes == expected_scopes
 
 
+@pytest.mark.parametrize("roles_count", [1, 5])
+def test_get_user_by_username_is_one_statement(
+    db_session, system_user, statements, roles_count
+):
+    dbapi.sync_perms(db_session)
+    role_names = []
+    for index in range(roles_count):
+        name = f"role{index}"
+        dbapi.create_role(db_session, name=name, scopes=["node.view", "tag.view"])
+        role_names.append(name)
+    dbapi.create_user(
+        db_session,
+        username="erasmus",
+        email="erasmus@mail.com",
+        password="freewill41",
+        is_superuser=False,
+        role_names=role_names,
+    )
+    db_session.expunge_all()
+    # role -> scopes map is loaded once, not per lookup
+    dbapi.load_role_scopes(db_session)
+    statements.clear()
+
+    user = dbapi.get_user_by_username(db_session, "erasmus")
+    user_by_email = dbapi.get_user_by_email(db_session, "erasmus@mail.com")
+
+    assert len(statements) == 2  # one per lookup
+    assert sorted(user.scopes) == ["node.view", "tag.view"]
+    assert user.home_folder_id and user.inbox_folder_id
+    assert user_by_email.scopes == user.scopes
+
+
+def test_users_with_same_roles_share_scopes(db_session, system_user):
+    dbapi.sync_perms(db_session)
+    dbapi.create_role(db_session, name="r1", scopes=["node.create", "node.view"])
+    for username in ("erasmus", "thomas"):
+        dbapi.create_user(
+            db_session,
+            username=username,
+            email=f"{username}@mail.com",
+            password="freewill41",
+            is_superuser=False,
+            role_names=["r1"],
+        )
+
+    erasmus = dbapi.get_user_by_username(db_session, "erasmus")
+    thomas = dbapi.get_user_by_username(db_session, "thomas")
+
+    assert erasmus.scopes == {"node.create", "node.view"}
+    assert erasmus.scopes is thomas.scopes
+
+    # new role is picked up right away
+    dbapi.create_role(db_session, name="r2", scopes=["tag.view"])
+    dbapi.create_user(
+        db_session,
+        username="martin",
+        email="martin@mail.com",
+        password="95theses",
+        is_superuser=False,
+        role_names=["r1", "r2"],
+    )
+    martin = dbapi.get_user_by_username(db_session, "martin")
+
+    assert martin.scopes == {"node.create", "node.view", "tag.view"}
+
+
+def test_role_created_by_other_process_is_resolved(db_session, system_user):
+    dbapi.sync_perms(db_session)
+    dbapi.load_role_scopes(db_session)
+    # other process does not invalidate map of this one
+    with mock.patch("auth_server.db.role_scopes.RoleScopes.invalidate"):
+        dbapi.create_role(db_session, name="r1", scopes=["tag.view"])
+    dbapi.create_user(
+        db_session,
+        username="leto",
+        email="leto@mail.com",
+        password="golden-path",
+        is_superuser=False,
+        role_names=["r1"],
+    )
+
+    leto = dbapi.get_user_by_username(db_session, "leto")
+
+    assert leto.scopes == {"tag.view"}
+
+
+def test_failed_role_creation_keeps_role_scopes(db_session, system_user):
+    dbapi.sync_perms(db_session)
+    dbapi.load_role_scopes(db_session)
+
+    with mock.patch.object(db_session, "commit", side_effect=Exception("boom")):
+        role, error = dbapi.create_role(db_session, name="r1", scopes=["tag.view"])
+
+    assert role is None and error == "boom"
+    assert not get_role_scopes().is_stale()
+
+
 def test_get_user_by_email_for_superuser(db_session, system_user):
     """
     `get_user_by_email` return user with correct scopes
@@ -156,3 +310,266 @@ def test_get_user_by_email_for_non_superuser(db_session, system_user):
     # user is not superuser and does not have any
     # group/perms associated
     assert len(user.scopes) == 0
+
+
+def test_async_get_user_by_username(db_session, system_user):
+    dbapi.sync_perms(db_session)
+    dbapi.create_role(db_session, name="r1", scopes=["node.create", "node.view"])
+    dbapi.create_user(
+        db_session,
+        username="erasmus",
+        email="erasmus@mail.com",
+        password="freewill41",
+        is_superuser=False,
+        role_names=["r1"],
+    )
+
+    async def get_user():
+        async with AsyncSession() as session:
+            user = await async_api.get_user_by_username(session, "erasmus")
+            with pytest.raises(NoResultFound):
+                await async_api.get_user_by_username(session, "no_such_user")
+        await get_async_engine().dispose()
+        return user
+
+    user = asyncio.run(get_user())
+
+    assert user.username == "erasmus"
+    assert user.home_folder_id
+    assert set(user.scopes) == {"node.create", "node.view"}
+
+
+def test_outdated_password_hash_is_replaced_on_login(db_session, system_user):
+    user = dbapi.create_user(
+        db_session, username="leto", email="leto@mail.com", password="golden-path"
+    )
+    old_hash = user.password
+    settings = Settings(password_rounds=1000)
+
+    with mock.patch("auth_server.passwords.get_settings", return_value=settings):
+        passwords.get_context.cache_clear()
+        try:
+            assert auth.db_auth(db_session, "leto", "golden-path")
+        finally:
+            passwords.get_context.cache_clear()
+
+    db_session.expire_all()
+    new_hash = dbapi.get_user_by_username(db_session, "leto").password
+    assert new_hash != old_hash
+    assert new_hash.startswith("$pbkdf2-sha256$1000$")
+    # login with current hash does not write it again
+    assert auth.db_auth(db_session, "leto", "golden-path")
+
+
+def test_split_new_users(db_session, system_user):
+    dbapi.sync_perms(db_session)
+    dbapi.create_role(db_session, name="editor", scopes=["node.view"])
+    dbapi.create_user(
+        db_session, username="paul", email="paul@mail.com", password="muaddib"
+    )
+    users = [
+        schema.NewUser(username="paul", email="paul@mail.com", password="x"),
+        schema.NewUser(username="alia", email="alia@mail.com", password="x"),
+        schema.NewUser(username="alia", email="alia2@mail.com", password="x"),
+        schema.NewUser(
+            username="irulan", email="irulan@mail.com", password="x", roles="scribe"
+        ),
+    ]
+
+    new, existing, invalid = dbapi.split_new_users(db_session, users)
+
+    assert [user.username for user in new] == ["alia"]
+    assert [user.username for user in existing] == ["paul"]
+    assert [(user.email, error) for user, error in invalid] == [
+        ("alia2@mail.com", "Duplicate username"),
+        ("irulan@mail.com", "Unknown roles: scribe"),
+    ]
+
+
+@pytest.mark.parametrize("users_count", [2, 20])
+def test_create_users_statements_do_not_depend_on_users_count(
+    db_session, system_user, statements, users_count
+):
+    dbapi.sync_perms(db_session)
+    dbapi.create_role(db_session, name="editor", scopes=["node.view", "tag.view"])
+    users = [
+        schema.NewUser(
+            username=f"user{index}",
+            email=f"user{index}@mail.com",
+            password="x",
+            roles=["editor"],
+        )
+        for index in range(users_count)
+    ]
+    hashed_passwords = [passwords.hash_password("secret")] * users_count
+    statements.clear()
+
+    dbapi.create_users(db_session, users, hashed_passwords)
+
+    # role IDs, users, nodes, folders, ownerships, special folders, roles
+    assert len([s for s in statements if "SAVEPOINT" not in s]) == 7
+    user = dbapi.get_user_by_username(db_session, f"user{users_count - 1}")
+    assert user.home_folder_id and user.inbox_folder_id
+    assert sorted(user.scopes) == ["node.view", "tag.view"]
+    assert auth.db_auth(db_session, user.username, "secret")
+
+
+def test_iter_users_pages_by_username(db_session, system_user, statements):
+    users = [
+        schema.NewUser(username=f"user{index}", email=f"u{index}@mail.com", password="x")
+        for index in range(4)
+    ]
+    dbapi.create_users(db_session, users, ["-"] * len(users))
+    statements.clear()
+
+    usernames = [row.username for row in dbapi.iter_users(db_session, page_size=2)]
+
+    assert usernames == ["system", "user0", "user1", "user2", "user3"]
+    assert len(statements) == 3  # last page is not full, no extra query
+
+
+def test_set_owner_is_one_statement(db_session, system_user, statements):
+    resource = types.NodeResource(id=uuid.uuid4())
+    first = types.Owner.create_from(user_id=system_user.id)
+    second = types.Owner.create_from(group_id=uuid.uuid4())
+    statements.clear()
+
+    ownership = dbapi.set_owner(db_session, resource, first)
+    assert len(statements) == 1
+    assert ownership.owner_id == system_user.id
+
+    ownership = dbapi.set_owner(db_session, resource, second)
+    assert len(statements) == 2
+    assert (ownership.owner_type, ownership.owner_id) == ("group", second.owner_id)
+    count = db_session.scalar(select(func.count(Ownership.id)))
+    assert count == 1
+
+
+def test_set_owners_last_owner_wins(db_session, system_user, statements):
+    resource = types.NodeResource(id=uuid.uuid4())
+    group_id = uuid.uuid4()
+    statements.clear()
+
+    dbapi.set_owners(
+        db_session,
+        [
+            (resource, types.Owner.create_from(user_id=system_user.id)),
+            (resource, types.Owner.create_from(group_id=group_id)),
+        ],
+    )
+
+    assert len(statements) == 1
+    ownership = db_session.scalars(select(Ownership)).one()
+    assert ownership.owner_id == group_id
+
+
+def test_create_user_statements(db_session, system_user, statements):
+    statements.clear()
+
+    user = dbapi.create_user(
+        db_session, username="stilgar", email="stilgar@mail.com", password="sietch"
+    )
+
+    # user, nodes, folders, ownerships, special folders
+    assert len(statements) == 5
+    db_user = dbapi.get_user_by_username(db_session, "stilgar")
+    assert db_user.home_folder_id == user.home_folder_id
+    assert db_user.inbox_folder_id == user.inbox_folder_id
+
+
+@pytest.mark.parametrize("owners_count", [1, 10])
+def test_create_special_folders_statements_do_not_depend_on_owners_count(
+    db_session, system_user, statements, owners_count
+):
+    owners = [
+        types.Owner.create_from(group_id=uuid.uuid4()) for _ in range(owners_count)
+    ]
+    statements.clear()
+
+    folder_ids = dbapi.create_special_folders(db_session, owners)
+
+    # nodes, folders, ownerships, special folders
+    assert len(statements) == 4
+    stmt = select(func.count(Ownership.id)).where(
+        Ownership.resource_id.in_(
+            [folder_id for ids in folder_ids.values() for folder_id in ids.values()]
+        )
+    )
+    assert db_session.scalar(stmt) == 2 * owners_count
+
+
+def test_sync_perms_reports_changes(db_session, system_user, statements):
+    result = dbapi.sync_perms(db_session)
+    assert result.added == sorted(scopes.SCOPES)
+    assert result.removed == []
+
+    stale = Permission(codename="stale.view", name="Stale")
+    db_session.add(stale)
+    db_session.commit()
+    dbapi.create_role(db_session, name="old", scopes=["stale.view", "node.view"])
+    statements.clear()
+
+    result = dbapi.sync_perms(db_session)
+
+    assert (result.added, result.removed) == ([], ["stale.view"])
+    # lock, select, delete role links, delete permissions
+    assert len(statements) == 4
+    codenames = db_session.scalars(select(Permission.codename)).all()
+    assert sorted(codenames) == sorted(scopes.SCOPES)
+
+    statements.clear()
+    assert not dbapi.sync_perms(db_session).changed
+    assert len(statements) == 2
+
+
+def test_concurrent_sync_perms_do_not_duplicate(db_session, system_user):
+    barrier = threading.Barrier(2)
+
+    def sync():
+        with Session() as session:
+            barrier.wait()
+            return dbapi.sync_perms(session)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(lambda _: sync(), range(2)))
+
+    assert sorted(len(result.added) for result in results) == [0, len(scopes.SCOPES)]
+    count = db_session.scalar(select(func.count(Permission.id)))
+    assert count == len(scopes.SCOPES)
+
+
+def test_import_users_reimports_error_report_in_place(
+    db_session, system_user, tmp_path
+):
+    report = tmp_path / "import-errors.jsonl"
+    report.write_text(
+        '{"username": "stilgar", "email": "stilgar@mail.com", "password": "x"}\n'
+        '{"username": "chani", "email": \n'
+        '["not", "an", "object"]\n'
+        '{"username": "jamis"}\n'
+    )
+
+    result = CliRunner().invoke(
+        cli_app,
+        ["users", "import", str(report), "--errors", str(report), "--workers", "1"],
+    )
+
+    assert result.exit_code == 1, result.output
+    assert dbapi.get_user_by_username(db_session, "stilgar")
+    failed = [json.loads(line) for line in report.read_text().splitlines()]
+    assert [record["_line"] for record in failed] == [2, 3, 4]
+    assert failed[0]["_raw"] == '{"username": "chani", "email": '
+    assert failed[0]["_error"].startswith("Invalid JSON")
+    assert failed[1]["_error"] == "Record is not an object"
+    assert failed[2]["username"] == "jamis"
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+def test_import_users_unsupported_suffix(tmp_path):
+    path = tmp_path / "users.txt"
+    path.write_text("")
+
+    result = CliRunner().invoke(cli_app, ["users", "import", str(path)])
+
+    assert result.exit_code == 2
+    assert "Unsupported file type 'txt'" in result.output
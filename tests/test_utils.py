@@ -1,6 +1,6 @@
 import pytest
 
-from auth_server.utils import raise_on_empty
+from auth_server.utils import raise_on_empty, identity_headers
 
 
 def test_raise_on_empty():
@@ -15,3 +15,19 @@ def test_raise_on_empty():
             two="2",
             three=None  # because value here is None
         )
+
+
+def test_identity_headers():
+    headers = identity_headers(
+        {
+            "sub": "0b4c9b4e-2a8f-4d54-9b6a-2d0f1a2c7e11",
+            "preferred_username": "jürgen",
+            "scopes": ["node.view", "tag.view"],
+        }
+    )
+
+    assert headers == {
+        "X-Auth-User-Id": "0b4c9b4e-2a8f-4d54-9b6a-2d0f1a2c7e11",
+        "X-Auth-Username": "j%C3%BCrgen",
+        "X-Auth-Scopes": "node.view tag.view",
+    }
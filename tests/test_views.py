@@ -1,12 +1,24 @@
+import asyncio
 import logging
+import uuid
 from unittest import mock
 import httpx
 import pytest
 
+import jwt
+from fastapi.testclient import TestClient
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 
-from auth_server.main import settings
+from auth_server import passwords, scopes
+from auth_server.auth import create_token
+from auth_server.cache import TTLCache
+from auth_server.config import VerifyMode
+from auth_server.revocation import revocations
+from auth_server.main import app, settings, worker_stats
 from auth_server.db import api as dbapi
+from auth_server.db.engine import AsyncSession, get_async_engine
+from auth_server.db.role_scopes import get_role_scopes
 
 logger = logging.getLogger(__name__)
 
@@ -137,3 +149,588 @@ def test_db_based_authentication_for_non_existing_user(
 
     assert response.status_code == 401, response.text
     assert response.json()["detail"] == "Unauthorized"
+
+
+def test_token_endpoint_when_password_workers_are_saturated(
+    client: httpx.Client, db_session: Session, system_user
+):
+    dbapi.create_user(
+        db_session, username="socrates", email="socrates@mail.com", password="secret"
+    )
+
+    with mock.patch(
+        "auth_server.auth.passwords.verify_and_update_async",
+        side_effect=passwords.PasswordQueueFull,
+    ):
+        response = client.post(
+            "/token", json={"username": "socrates", "password": "secret"}
+        )
+
+    assert response.status_code == 503, response.text
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_verify_endpoint_caches_verified_token(
+    client: httpx.Client, db_session: Session, system_user, statements
+):
+    dbapi.create_user(
+        db_session, username="socrates", email="socrates@mail.com", password="secret"
+    )
+    response = client.post(
+        "/token", json={"username": "socrates", "password": "secret"}
+    )
+    token = response.json()["access_token"]
+    statements.clear()
+
+    for _ in range(5):
+        response = client.get("/verify", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, response.text
+
+    # only first call reached the database
+    assert len(statements) == 1
+
+
+def test_verify_endpoint_identity_headers(
+    client: httpx.Client, db_session: Session, system_user
+):
+    user = dbapi.create_user(
+        db_session, username="socrates", email="socrates@mail.com", password="secret"
+    )
+    headers = {"Authorization": f"Bearer {create_token(user)}"}
+
+    response = client.get("/verify", headers=headers)
+    assert "X-Auth-User-Id" not in response.headers
+
+    with mock.patch.object(settings, "verify_identity_headers", True):
+        response = client.get("/verify", headers=headers)
+
+    assert response.status_code == 200, response.text
+    assert response.headers["X-Auth-User-Id"] == str(user.id)
+    assert response.headers["X-Auth-Username"] == "socrates"
+
+
+def test_compact_scopes_token(client: httpx.Client, db_session: Session, system_user):
+    dbapi.sync_perms(db_session)
+    user = dbapi.create_user(
+        db_session, username="socrates", email="socrates@mail.com", password="secret"
+    )
+
+    with (
+        mock.patch.object(settings, "token_compact_scopes", True),
+        mock.patch.object(settings, "verify_identity_headers", True),
+    ):
+        response = client.post(
+            "/token", json={"username": "socrates", "password": "secret"}
+        )
+        token = response.json()["access_token"]
+        response = client.get("/verify", headers={"Authorization": f"Bearer {token}"})
+
+    claims = jwt.decode(token, options={"verify_signature": False})
+    assert "scopes" not in claims
+    assert claims["scm"] == "1:3ffffff"  # superuser
+    assert len(response.headers["X-Auth-Scopes"].split()) == len(scopes.SCOPES)
+
+
+def test_jwks_endpoint(client: httpx.Client):
+    response = client.get("/.well-known/jwks.json")
+
+    assert response.status_code == 200
+    # default algorithm is symmetric i.e. there are no public keys
+    assert response.json() == {"keys": []}
+    assert "max-age" in response.headers["Cache-Control"]
+
+
+def test_verify_endpoint_rejects_invalid_token(client: httpx.Client):
+    response = client.get("/verify", headers={"Authorization": "Bearer not.a.jwt"})
+
+    assert response.status_code == 401, response.text
+
+
+@pytest.mark.parametrize("error", [ConnectionRefusedError, TimeoutError])
+def test_verify_endpoint_when_db_is_unreachable(
+    client: httpx.Client, db_session: Session, system_user, error
+):
+    user = dbapi.create_user(
+        db_session, username="socrates", email="socrates@mail.com", password="secret"
+    )
+    headers = {"Authorization": f"Bearer {create_token(user)}"}
+
+    with mock.patch(
+        "auth_server.db.async_api.user_exists", side_effect=error("DB unreachable")
+    ):
+        response = client.get("/verify", headers=headers)
+
+    assert response.status_code == 401, response.text
+
+
+def test_concurrent_verify_requests_share_one_db_lookup(
+    db_session: Session, system_user, statements
+):
+    user = dbapi.create_user(
+        db_session, username="socrates", email="socrates@mail.com", password="secret"
+    )
+    headers = {"Authorization": f"Bearer {create_token(user)}"}
+    statements.clear()
+
+    async def verify_many():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            responses = await asyncio.gather(
+                *[ac.get("/verify", headers=headers) for _ in range(20)]
+            )
+        await get_async_engine().dispose()
+        return responses
+
+    responses = asyncio.run(verify_many())
+
+    assert all(response.status_code == 200 for response in responses)
+    assert len(statements) == 1
+
+
+def test_stateless_verify_does_not_query_db(
+    db_session: Session, system_user, statements
+):
+    user = dbapi.create_user(
+        db_session, username="socrates", email="socrates@mail.com", password="secret"
+    )
+    token = create_token(user)
+    claims = jwt.decode(token, options={"verify_signature": False})
+    other_token = create_token(user)
+
+    with (
+        mock.patch.object(settings, "verify_mode", VerifyMode.STATELESS),
+        TestClient(app) as client,
+    ):
+        # revoked after revocation list was loaded on startup
+        dbapi.revoke_token(db_session, claims["jti"])
+        client.portal.call(_refresh_revocations)
+        statements.clear()
+
+        response = client.get("/verify", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 401, response.text
+        assert response.json()["detail"] == "Token revoked"
+
+        response = client.get(
+            "/verify", headers={"Authorization": f"Bearer {other_token}"}
+        )
+        assert response.status_code == 200, response.text
+
+    revocations.clear()
+    assert len(statements) == 0
+
+
+async def _refresh_revocations():
+    async with AsyncSession() as db_session:
+        await revocations.refresh(db_session)
+
+
+def test_token_endpoint_throttles_login_attempts(
+    client: httpx.Client, db_session: Session, system_user, statements
+):
+    dbapi.create_user(
+        db_session, username="gurney", email="gurney@mail.com", password="secret"
+    )
+    creds = {"username": "gurney", "password": "wrong"}
+    for _ in range(settings.login_throttle_attempts):
+        assert client.post("/token", json=creds).status_code == 401
+
+    statements.clear()
+    response = client.post("/token", json={"username": "gurney", "password": "secret"})
+
+    assert response.status_code == 429, response.text
+    assert response.headers["Retry-After"] == str(settings.login_throttle_lockout)
+    # rejected before any DB lookup
+    assert statements == []
+
+
+def test_successful_login_resets_username_throttle(
+    client: httpx.Client, db_session: Session, system_user
+):
+    dbapi.create_user(
+        db_session, username="duncan", email="duncan@mail.com", password="secret"
+    )
+    for _ in range(settings.login_throttle_attempts - 1):
+        client.post("/token", json={"username": "duncan", "password": "wrong"})
+
+    response = client.post("/token", json={"username": "duncan", "password": "secret"})
+    assert response.status_code == 200, response.text
+
+    response = client.post("/token", json={"username": "duncan", "password": "wrong"})
+    assert response.status_code == 401, response.text
+
+
+def test_unknown_username_is_looked_up_once(
+    client: httpx.Client, db_session: Session, system_user, statements
+):
+    creds = {"username": "shaddam", "password": "secret"}
+    assert client.post("/token", json=creds).status_code == 401
+    statements.clear()
+
+    assert client.post("/token", json=creds).status_code == 401
+    assert statements == []
+
+    # creating the user makes the name known right away
+    dbapi.create_user(
+        db_session, username="shaddam", email="shaddam@mail.com", password="secret"
+    )
+    assert client.post("/token", json=creds).status_code == 200
+
+
+def test_unknown_username_costs_dummy_verification(
+    client: httpx.Client, db_session: Session, system_user
+):
+    creds = {"username": "feyd", "password": "secret"}
+
+    with (
+        mock.patch.object(settings, "login_dummy_verify", True),
+        mock.patch(
+            "auth_server.passwords.verify_dummy", wraps=passwords.verify_dummy
+        ) as verify_dummy,
+    ):
+        assert client.post("/token", json=creds).status_code == 401
+        assert client.post("/token", json=creds).status_code == 401
+
+    # for cached unknown username as well
+    assert verify_dummy.call_count == 2
+
+
+def test_token_endpoint_response(
+    client: httpx.Client, db_session: Session, system_user
+):
+    dbapi.create_user(
+        db_session, username="liet", email="liet@mail.com", password="secret"
+    )
+
+    response = client.post("/token", json={"username": "liet", "password": "secret"})
+
+    assert response.status_code == 200, response.text
+    token = response.json()["access_token"]
+    assert response.json() == {
+        "access_token": token,
+        "token_type": "bearer",
+        "refresh_token": None,
+    }
+    assert response.headers["Authorization"] == f"Bearer {token}"
+    assert response.cookies[settings.cookie_name] == token
+
+
+def test_refresh_tokens_are_disabled_by_default(
+    client: httpx.Client, db_session: Session, system_user
+):
+    dbapi.create_user(
+        db_session, username="liet", email="liet@mail.com", password="secret"
+    )
+
+    response = client.post("/token", json={"username": "liet", "password": "secret"})
+
+    assert response.json()["refresh_token"] is None
+    response = client.post("/token/refresh", json={"refresh_token": "x"})
+    assert response.status_code == 404
+
+
+def test_refresh_token_rotation(
+    client: httpx.Client, db_session: Session, system_user
+):
+    dbapi.create_user(
+        db_session, username="kynes", email="kynes@mail.com", password="secret"
+    )
+
+    with (
+        mock.patch.object(settings, "refresh_token_expire_minutes", 60),
+        mock.patch(
+            "auth_server.auth.passwords.verify_and_update_async",
+            wraps=passwords.verify_and_update_async,
+        ) as verify,
+    ):
+        response = client.post(
+            "/token", json={"username": "kynes", "password": "secret"}
+        )
+        first = response.json()["refresh_token"]
+
+        response = client.post("/token/refresh", json={"refresh_token": first})
+        assert response.status_code == 200, response.text
+        second = response.json()["refresh_token"]
+        access_token = response.json()["access_token"]
+        assert second != first
+        assert verify.call_count == 1  # only on login
+        response = client.get(
+            "/verify", headers={"Authorization": f"Bearer {access_token}"}
+        )
+        assert response.status_code == 200
+
+        # reuse of exchanged token revokes the whole family
+        response = client.post("/token/refresh", json={"refresh_token": first})
+        assert response.status_code == 401
+        response = client.post("/token/refresh", json={"refresh_token": second})
+        assert response.status_code == 401
+
+
+def test_revoked_user_refresh_tokens_are_rejected(
+    client: httpx.Client, db_session: Session, system_user
+):
+    user = dbapi.create_user(
+        db_session, username="jamis", email="jamis@mail.com", password="secret"
+    )
+
+    with mock.patch.object(settings, "refresh_token_expire_minutes", 60):
+        response = client.post(
+            "/token", json={"username": "jamis", "password": "secret"}
+        )
+        refresh_token = response.json()["refresh_token"]
+        dbapi.revoke_user_tokens(db_session, user.id)
+
+        response = client.post(
+            "/token/refresh", json={"refresh_token": refresh_token}
+        )
+
+    assert response.status_code == 401
+
+
+def test_verify_endpoint_renews_expiring_cookie_once(
+    client: httpx.Client, db_session: Session, system_user
+):
+    user = dbapi.create_user(
+        db_session, username="chani", email="chani@mail.com", password="secret"
+    )
+    with mock.patch.object(settings, "token_expire_minutes", 5):
+        expiring_token = create_token(user)
+
+    with mock.patch.object(settings, "token_renew_before_minutes", 10):
+        response = verify_with_cookie(client, expiring_token)
+        assert response.status_code == 200, response.text
+        fresh_token = response.cookies[settings.cookie_name]
+        assert fresh_token != expiring_token
+
+        # renewed once per token
+        response = verify_with_cookie(client, expiring_token)
+        assert response.status_code == 200, response.text
+        assert settings.cookie_name not in response.cookies
+
+        # fresh token is far from expiration
+        response = verify_with_cookie(client, fresh_token)
+        assert response.status_code == 200, response.text
+        assert settings.cookie_name not in response.cookies
+
+
+def test_renewal_is_deduplicated_without_verify_cache(
+    client: httpx.Client, db_session: Session, system_user
+):
+    user = dbapi.create_user(
+        db_session, username="chani", email="chani@mail.com", password="secret"
+    )
+    with mock.patch.object(settings, "token_expire_minutes", 5):
+        expiring_token = create_token(user)
+
+    with (
+        mock.patch.object(settings, "token_renew_before_minutes", 10),
+        mock.patch.object(settings, "verify_cache_size", 0),
+        mock.patch(
+            "auth_server.main.get_verify_cache",
+            return_value=TTLCache(maxsize=0, ttl=30),
+        ),
+    ):
+        responses = [verify_with_cookie(client, expiring_token) for _ in range(3)]
+
+    assert all(response.status_code == 200 for response in responses)
+    renewed = [r for r in responses if settings.cookie_name in r.cookies]
+    assert len(renewed) == 1
+
+
+def verify_with_cookie(client: httpx.Client, token: str) -> httpx.Response:
+    """Sends `token` as the only cookie, whatever previous responses set"""
+    client.cookies.clear()
+
+    return client.get("/verify", headers={"Cookie": f"{settings.cookie_name}={token}"})
+
+
+def test_stateless_renewal_does_not_query_db(
+    db_session: Session, system_user, statements
+):
+    user = dbapi.create_user(
+        db_session, username="chani", email="chani@mail.com", password="secret"
+    )
+    with mock.patch.object(settings, "token_expire_minutes", 5):
+        expiring_token = create_token(user)
+
+    with (
+        mock.patch.object(settings, "verify_mode", VerifyMode.STATELESS),
+        mock.patch.object(settings, "token_renew_before_minutes", 10),
+        TestClient(app) as client,
+    ):
+        statements.clear()
+        client.cookies.set(settings.cookie_name, expiring_token)
+        response = client.get("/verify")
+        assert response.status_code == 200, response.text
+        fresh_token = response.cookies[settings.cookie_name]
+
+    old_claims = jwt.decode(expiring_token, options={"verify_signature": False})
+    claims = jwt.decode(fresh_token, options={"verify_signature": False})
+    assert claims["jti"] != old_claims["jti"]
+    assert claims["exp"] > old_claims["exp"]
+    assert claims["sub"] == old_claims["sub"]
+    assert claims["scopes"] == old_claims["scopes"]
+    assert len(statements) == 0
+
+
+def test_verify_endpoint_does_not_renew_by_default(
+    client: httpx.Client, db_session: Session, system_user
+):
+    user = dbapi.create_user(
+        db_session, username="chani", email="chani@mail.com", password="secret"
+    )
+    with mock.patch.object(settings, "token_expire_minutes", 5):
+        client.cookies.set(settings.cookie_name, create_token(user))
+
+    response = client.get("/verify")
+
+    assert response.status_code == 200, response.text
+    assert settings.cookie_name not in response.cookies
+
+
+def test_worker_stats(client: httpx.Client, db_session: Session, system_user):
+    user = dbapi.create_user(
+        db_session, username="socrates", email="socrates@mail.com", password="secret"
+    )
+    headers = {"Authorization": f"Bearer {create_token(user)}"}
+    for _ in range(2):
+        client.get("/verify", headers=headers)
+
+    stats = worker_stats()
+
+    assert stats["db_pool"]["checkouts"] >= 1
+    assert stats["verify_cache"]["hits"] >= 1
+    assert stats["verify_cache"]["size"] >= 1
+    assert set(stats["username_throttle"]) == {
+        "allowed",
+        "rejected",
+        "lockouts",
+        "size",
+    }
+
+
+def test_stats_are_logged(caplog):
+    with (
+        mock.patch.object(settings, "stats_log_interval", 0.01),
+        caplog.at_level(logging.INFO, logger="auth_server.main"),
+        TestClient(app) as client,
+    ):
+        client.portal.call(asyncio.sleep, 0.05)
+
+    assert any("stats" in record.getMessage() for record in caplog.records)
+
+
+def test_lifespan_warms_up_worker(client: httpx.Client):
+    assert get_async_engine().pool.checkedin() == settings.db_pool_size
+    assert not get_role_scopes().is_stale()
+
+
+def test_stateless_mode_needs_revoked_tokens_table(db_session: Session, db_engine):
+    db_session.close()
+    with db_engine.connect() as conn:
+        conn.execute(text("DROP TABLE revoked_tokens"))
+        conn.commit()
+
+    with (
+        mock.patch.object(settings, "verify_mode", VerifyMode.STATELESS),
+        pytest.raises(RuntimeError, match="Missing tables: revoked_tokens"),
+        TestClient(app),
+    ):
+        pass
+
+
+def test_refresh_tokens_need_table(db_session: Session, db_engine):
+    db_session.close()
+    with db_engine.connect() as conn:
+        conn.execute(text("DROP TABLE refresh_tokens"))
+        conn.commit()
+
+    with (
+        mock.patch.object(settings, "refresh_token_expire_minutes", 60),
+        pytest.raises(RuntimeError, match="Missing tables: refresh_tokens"),
+        TestClient(app),
+    ):
+        pass
+
+
+@pytest.fixture()
+def fast_path():
+    with mock.patch.object(settings, "verify_fast_path", True):
+        yield
+
+
+def test_verify_fast_path(
+    fast_path, client: httpx.Client, db_session: Session, system_user, statements
+):
+    user = dbapi.create_user(
+        db_session, username="socrates", email="socrates@mail.com", password="secret"
+    )
+    token = create_token(user)
+    statements.clear()
+
+    for _ in range(3):
+        response = client.get("/verify", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200
+        assert response.content == b""
+        assert "X-Auth-User-Id" not in response.headers
+    # outcome is cached same as with the route
+    assert len(statements) == 1
+
+    client.cookies.set(settings.cookie_name, token)
+    assert client.get("/verify").status_code == 200
+    client.cookies.clear()
+
+    for headers in ({}, {"Authorization": "Bearer not.a.jwt"}):
+        response = client.get("/verify", headers=headers)
+        assert response.status_code == 401
+        assert response.content == b""
+
+    # other endpoints are served by the app
+    assert client.get("/.well-known/jwks.json").status_code == 200
+
+
+def test_verify_fast_path_rejects_unknown_user(
+    fast_path, client: httpx.Client, db_session: Session, system_user
+):
+    user = dbapi.create_user(
+        db_session, username="socrates", email="socrates@mail.com", password="secret"
+    )
+    user.id = uuid.uuid4()
+    token = create_token(user)
+
+    response = client.get("/verify", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 401
+    assert response.content == b""
+
+
+def test_verify_fast_path_identity_headers(
+    fast_path, client: httpx.Client, db_session: Session, system_user
+):
+    user = dbapi.create_user(
+        db_session, username="socrates", email="socrates@mail.com", password="secret"
+    )
+    headers = {"Authorization": f"Bearer {create_token(user)}"}
+
+    with mock.patch.object(settings, "verify_identity_headers", True):
+        response = client.get("/verify", headers=headers)
+
+    assert response.status_code == 200
+    assert response.headers["X-Auth-User-Id"] == str(user.id)
+    assert response.headers["X-Auth-Username"] == "socrates"
+
+
+def test_verify_fast_path_leaves_renewal_to_route(
+    fast_path, client: httpx.Client, db_session: Session, system_user
+):
+    user = dbapi.create_user(
+        db_session, username="chani", email="chani@mail.com", password="secret"
+    )
+    with mock.patch.object(settings, "token_expire_minutes", 5):
+        expiring_token = create_token(user)
+
+    with mock.patch.object(settings, "token_renew_before_minutes", 10):
+        client.cookies.set(settings.cookie_name, expiring_token)
+        response = client.get("/verify")
+
+    assert response.status_code == 200, response.text
+    assert response.cookies[settings.cookie_name] != expiring_token
@@ -0,0 +1,126 @@
+from unittest import mock
+
+import pytest
+from typer.testing import CliRunner
+
+from auth_server.cli.cli import app as cli_app
+from auth_server.workers import WorkerConfig, available_cpus
+
+
+async def asgi_app(scope, receive, send):
+    pass
+
+
+@pytest.mark.parametrize(
+    "cpu_max, expected",
+    [
+        ("max 100000\n", 8),
+        ("200000 100000\n", 2),
+        ("150000 100000\n", 2),
+        ("10000 100000\n", 1),
+        ("1600000 100000\n", 8),
+    ],
+)
+def test_available_cpus_honors_cgroup_quota(tmp_path, cpu_max, expected):
+    path = tmp_path / "cpu.max"
+    path.write_text(cpu_max)
+
+    with mock.patch("os.process_cpu_count", return_value=8):
+        assert available_cpus(path) == expected
+
+
+def test_available_cpus_without_cgroup(tmp_path):
+    with mock.patch("os.process_cpu_count", return_value=3):
+        assert available_cpus(tmp_path / "missing") == 3
+
+
+def test_worker_config_jitter():
+    limits = set()
+    for _ in range(20):
+        config = WorkerConfig(
+            asgi_app, ws="none", limit_max_requests=100, max_requests_jitter=10
+        )
+        config.load()
+        limits.add(config.limit_max_requests)
+
+    assert all(100 <= limit <= 110 for limit in limits)
+    assert len(limits) > 1
+
+
+def test_worker_config_no_recycling():
+    config = WorkerConfig(asgi_app, ws="none", max_requests_jitter=10)
+    config.load()
+
+    assert config.limit_max_requests is None
+
+
+def test_serve_starts_workers():
+    with (
+        mock.patch("auth_server.workers.WorkerConfig.bind_socket") as bind_socket,
+        mock.patch("uvicorn.supervisors.Multiprocess") as multiprocess,
+    ):
+        result = CliRunner().invoke(
+            cli_app, ["serve", "--workers", "3", "--max-requests", "1000"]
+        )
+
+    assert result.exit_code == 0, result.output
+    config = multiprocess.call_args.args[0]
+    assert config.workers == 3
+    assert config.limit_max_requests == 1000
+    assert config.loop == "uvloop"
+    assert config.http == "httptools"
+    assert config.proxy_headers
+    assert config.forwarded_allow_ips == "127.0.0.1"
+    assert multiprocess.call_args.kwargs["sockets"] == [bind_socket.return_value]
+    multiprocess.return_value.run.assert_called_once()
+
+
+def test_serve_log_config():
+    with (
+        mock.patch("auth_server.workers.WorkerConfig.configure_logging"),
+        mock.patch("auth_server.workers.WorkerConfig.bind_socket"),
+        mock.patch("uvicorn.supervisors.Multiprocess") as multiprocess,
+    ):
+        result = CliRunner().invoke(
+            cli_app, ["serve", "--workers", "2", "--log-config", "etc/logging.yml"]
+        )
+
+    assert result.exit_code == 0, result.output
+    config = multiprocess.call_args.args[0]
+    assert config.log_config["root"]["handlers"] == ["queue"]
+
+
+def test_serve_preload_loads_settings_and_keys():
+    with (
+        mock.patch("auth_server.workers.WorkerConfig.bind_socket"),
+        mock.patch("uvicorn.supervisors.Multiprocess") as multiprocess,
+        mock.patch("auth_server.keys.get_keyring") as get_keyring,
+        mock.patch("auth_server.passwords.get_context") as get_context,
+    ):
+        result = CliRunner().invoke(cli_app, ["serve", "--workers", "2", "--preload"])
+
+    assert result.exit_code == 0, result.output
+    get_keyring.assert_called_once()
+    get_context.assert_called_once()
+    multiprocess.return_value.run.assert_called_once()
+
+
+def test_serve_preload_fails_on_bad_configuration():
+    with (
+        mock.patch("uvicorn.supervisors.Multiprocess") as multiprocess,
+        mock.patch(
+            "auth_server.keys.get_keyring", side_effect=ValueError("No private key")
+        ),
+    ):
+        result = CliRunner().invoke(cli_app, ["serve", "--workers", "2", "--preload"])
+
+    assert result.exit_code == 1
+    assert "Bad configuration: No private key" in result.output
+    multiprocess.assert_not_called()
+
+
+def test_worker_config_starts_log_listeners():
+    with mock.patch("auth_server.logs.start_listeners") as start_listeners:
+        WorkerConfig(asgi_app, ws="none")
+
+    start_listeners.assert_called_once()